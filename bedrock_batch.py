@@ -0,0 +1,252 @@
+"""
+# Title: Amazon Bedrock batch inference for image quality assessments
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import json
+import logging
+import os
+
+import evaluation_engine
+import image_cache as image_caching
+import json_extractor
+import results_writer
+import utilities
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+BATCH_DIRECTORY = "batch/"
+MAX_SHARD_MB = 512  # Bedrock limit: 1 GB per input file
+MAX_SHARD_RECORDS = 50_000  # Bedrock limit: 50,000 records per input file
+MIN_JOB_RECORDS = 100  # Bedrock minimum number of records per job
+OUTPUT_SUFFIX = ".jsonl.out"
+
+
+class ShardWriter:
+    """
+    Write batch inference records to numbered JSONL shards within size limits.
+
+    A new shard is started whenever the next record would take the current shard
+    past `max_mb` or `max_records`.
+
+    Args:
+        directory (str): The directory the shards are written to.
+        prefix (str): The shard filename prefix.
+        max_mb (float): The maximum size of a shard, in megabytes.
+        max_records (int): The maximum number of records in a shard.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        prefix: str = "records",
+        max_mb: float = MAX_SHARD_MB,
+        max_records: int = MAX_SHARD_RECORDS,
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+
+        # Remove the shards of a previous run, so they are not uploaded with this one
+        for name in os.listdir(directory):
+            if name.startswith(f"{prefix}_") and name.endswith(".jsonl"):
+                os.remove(os.path.join(directory, name))
+
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_records = max_records
+        self.paths = []
+        self.file = None
+        self.shard_bytes = 0
+        self.shard_records = 0
+        self.total_records = 0
+
+    def open_shard(self) -> None:
+        if self.file is not None:
+            self.file.close()
+        path = os.path.join(self.directory, f"{self.prefix}_{len(self.paths):04d}.jsonl")
+        self.file = open(path, "wb")
+        self.paths.append(path)
+        self.shard_bytes = 0
+        self.shard_records = 0
+
+    def write(self, record: dict) -> None:
+        """
+        Append a record to the current shard, starting a new shard if it is full.
+
+        Args:
+            record (dict): The batch inference record.
+        """
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        if len(line) > self.max_bytes:
+            raise ValueError(f"Record {record.get('recordId')} exceeds the shard size")
+        if (
+            self.file is None
+            or self.shard_bytes + len(line) > self.max_bytes
+            or self.shard_records >= self.max_records
+        ):
+            self.open_shard()
+
+        self.file.write(line)
+        self.shard_bytes += len(line)
+        self.shard_records += 1
+        self.total_records += 1
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def batch_name(provider) -> str:
+    """
+    Get the batch directory name of a provider, from its output filename.
+
+    Args:
+        provider (module): The provider module.
+
+    Returns:
+        str: The output filename without its extension.
+    """
+    return os.path.splitext(os.path.basename(provider.OUTPUT_PATH))[0]
+
+
+def prepare_batch(
+    provider,
+    directory: str = None,
+    batch_directory: str = BATCH_DIRECTORY,
+    max_mb: float = MAX_SHARD_MB,
+    max_records: int = MAX_SHARD_RECORDS,
+) -> list:
+    """
+    Write the batch inference input shards for all images in a directory.
+
+    Each record's recordId is the image ID, and its modelInput is the provider's
+    native InvokeModel request body, with the prompts and the base64-encoded image.
+
+    Args:
+        provider (module): The Bedrock provider module, which defines the
+                           batch_model_input and batch_output_text adapter functions.
+        directory (str, optional): The directory containing the images. Defaults to
+                                   the provider's DIRECTORY.
+        batch_directory (str): The directory the shards are written to, in a
+                               subdirectory named after the provider's output file.
+        max_mb (float): The maximum size of a shard, in megabytes.
+        max_records (int): The maximum number of records in a shard.
+
+    Returns:
+        list: The paths of the shards written.
+    """
+    directory = directory or provider.DIRECTORY
+    shard_directory = os.path.join(batch_directory, batch_name(provider))
+    image_cache = image_caching.create_image_cache()
+    max_pixels = getattr(provider, "MAX_PIXELS", None)
+
+    with ShardWriter(shard_directory, max_mb=max_mb, max_records=max_records) as shards:
+        for filename in evaluation_engine.list_images(directory):
+            try:
+                image_bytes, file_format = utilities.prepare_image(
+                    os.path.join(directory, filename), max_pixels, image_cache
+                )
+                shards.write(
+                    {
+                        "recordId": filename,
+                        "modelInput": provider.batch_model_input(image_bytes, file_format),
+                    }
+                )
+            except Exception as e:
+                logging.error(f"Error processing {filename}: {e}")
+
+    logging.info(
+        f"Wrote {shards.total_records} batch records to {len(shards.paths)} shards "
+        f"in {shard_directory}"
+    )
+    if shards.total_records < MIN_JOB_RECORDS:
+        logging.warning(
+            f"Bedrock batch inference jobs require at least {MIN_JOB_RECORDS} records"
+        )
+
+    return shards.paths
+
+
+def find_output_files(job_output_directory: str) -> list:
+    """
+    Find the batch inference output files (*.jsonl.out) in a job output directory.
+
+    Args:
+        job_output_directory (str): The local copy of the job's S3 output location.
+
+    Returns:
+        list: The sorted paths of the output files.
+    """
+    paths = []
+    for root, _, files in os.walk(job_output_directory):
+        paths.extend(
+            os.path.join(root, name) for name in files if name.endswith(OUTPUT_SUFFIX)
+        )
+    return sorted(paths)
+
+
+def collect_batch(provider, job_output_directory: str) -> None:
+    """
+    Parse the batch inference output files into the provider's standard results.
+
+    Records are written to the provider's JSONL file and exported to its JSON results
+    file, in the same format as a synchronous run. Batch records have no per-request
+    latency, so their time is None. Records that failed are logged and skipped.
+
+    Args:
+        provider (module): The Bedrock provider module.
+        job_output_directory (str): The local copy of the job's S3 output location.
+    """
+    paths = find_output_files(job_output_directory)
+    if not paths:
+        logging.error(f"No {OUTPUT_SUFFIX} files found in {job_output_directory}")
+        return
+
+    jsonl_path = results_writer.jsonl_path(provider.OUTPUT_PATH)
+    errors = 0
+    with results_writer.JsonlResultWriter(jsonl_path) as writer:
+        for path in paths:
+            for output in results_writer.read_records(path):
+                image_id = output.get("recordId")
+                if "error" in output or "modelOutput" not in output:
+                    logging.error(f"Batch record {image_id} failed: {output.get('error')}")
+                    errors += 1
+                    continue
+
+                try:
+                    response_text = provider.batch_output_text(output["modelOutput"])
+                except (KeyError, IndexError, TypeError) as e:
+                    logging.error(f"Error reading batch record {image_id}: {e}")
+                    errors += 1
+                    continue
+
+                result = utilities.truncate(response_text)
+                writer.write(
+                    evaluation_engine.build_record(
+                        result,
+                        image_id,
+                        provider.MODEL_ID,
+                        provider.TEMPERATURE,
+                        provider.MAX_TOKENS,
+                        None,
+                    )
+                )
+
+    json_extractor.log_parse_stats()
+    logging.info(
+        f"Collected {writer.count} batch records from {len(paths)} files, {errors} failed"
+    )
+    results_writer.export_scores(jsonl_path, provider.OUTPUT_PATH)
@@ -0,0 +1,504 @@
+"""
+# Title: Benchmark the image preprocessing and response parsing hot paths
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import platform
+import sqlite3
+import sys
+import time
+
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+
+import instrumentation
+import utilities
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+BENCHMARK_DIRECTORY = "benchmarks/"
+IMAGE_DIRECTORY = "benchmarks/images/"
+BASELINE_PATH = "benchmarks/baseline.json"
+SIZES_MP = (1, 12, 24, 50)  # synthetic image sizes, in megapixels
+FORMATS = ("jpeg", "png")
+MAX_PIXELS = 1568  # resize target, the most common maximum size of the providers
+ROUNDS = 5  # timed rounds per image benchmark
+PARSE_ROUNDS = 200  # timed passes over the response corpus
+REGRESSION_THRESHOLD = 0.2  # flag a benchmark whose p50 is 20% slower than baseline
+MIN_REGRESSION_MS = 0.05  # ignore smaller p50 changes, which are timer noise
+# resize_image must stay within this PSNR of a single full-resolution LANCZOS resize;
+# 40 dB and above is visually indistinguishable
+MIN_RESIZE_PSNR_DB = 40.0
+
+# Raw model responses in the shapes seen in practice, used when no recorded responses
+# are given: bare JSON, code fences, prose, braces in strings, nested, numeric string
+# scores, truncated by the maximum tokens, and unparseable
+RESPONSE_CORPUS = [
+    '{"score": 2, "explanation": "The image is sharp, well exposed and well composed."}',
+    '```json\n{\n  "score": 1,\n  "explanation": "Slightly soft focus and some noise in the shadows."\n}\n```',
+    'Here is my assessment of the image:\n\n{"score": 0, "explanation": "The image is blurry and underexposed."}\n\nLet me know if you need more detail.',
+    '{"score": 1, "explanation": "Good framing {rule of thirds}, but the \\"highlights\\" are clipped."}',
+    '{"result": {"score": 2, "explanation": "Excellent detail and accurate color."}}',
+    '{"score": "1", "explanation": "Average quality overall."}',
+    '{"score": 2, "explanation": "The image is perfectly focused and sharp throughout. The exposure is ideal with excellent dynamic range, and there is minimal',
+    "I'm sorry, I cannot evaluate this image.",
+    '{"score": 0, "explanation": "'
+    + "Heavy noise, motion blur and a strong color cast. " * 20
+    + '"}',
+]
+
+
+def image_path(megapixels: int, file_format: str) -> str:
+    extension = "jpg" if file_format == "jpeg" else "png"
+    return os.path.join(IMAGE_DIRECTORY, f"synthetic_{megapixels}mp.{extension}")
+
+
+def make_synthetic_image(megapixels: int, file_format: str) -> str:
+    """
+    Create a deterministic synthetic photo-like image, unless it already exists.
+
+    The image is a smooth gradient with blurred noise, which compresses like a photo
+    rather than like a flat color or pure noise.
+
+    Args:
+        megapixels (int): The image size, in megapixels, with a 4:3 aspect ratio.
+        file_format (str): The image format ('jpeg' or 'png').
+
+    Returns:
+        str: The path of the image.
+    """
+    path = image_path(megapixels, file_format)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(IMAGE_DIRECTORY, exist_ok=True)
+    width = int(math.sqrt(megapixels * 1_000_000 * 4 / 3))
+    height = int(width * 3 / 4)
+    logging.info(f"Creating {width}x{height} {file_format} image {path}")
+
+    channels = [
+        Image.linear_gradient("L").resize((width, height)),
+        Image.radial_gradient("L").resize((width, height)),
+        Image.effect_noise((width, height), 64).filter(ImageFilter.GaussianBlur(2)),
+    ]
+    image = Image.merge("RGB", channels)
+    image.save(path, format=file_format, quality=90)
+
+    return path
+
+
+def load_recorded_responses(database_path: str) -> list:
+    """
+    Load recorded raw model responses from a response cache database.
+
+    Args:
+        database_path (str): The path of the response cache (e.g.,
+                             cache/responses.sqlite).
+
+    Returns:
+        list: The raw response texts.
+    """
+    with sqlite3.connect(database_path) as connection:
+        rows = connection.execute("SELECT response_text FROM responses").fetchall()
+    return [row[0] for row in rows]
+
+
+def peak_above(rss_before: int) -> int:
+    peak = instrumentation.peak_rss_bytes()
+    if peak is None or rss_before is None:
+        return None
+    return max(0, peak - rss_before)
+
+
+def benchmark_image(name: str, path: str, rounds: int) -> dict:
+    """
+    Time a preprocessing function on an image, in a fresh process.
+
+    Each round starts from a lazily opened image, as in production, so the resize
+    benchmarks include decoding the image. The encode benchmarks start from an
+    already resized image. The peak memory is the growth of the peak RSS over the
+    setup, after a warm-up round, so it covers the pixel buffers allocated by Pillow
+    (on Linux; elsewhere, only growth beyond the warm-up round is seen).
+
+    Args:
+        name (str): The function: 'resize_image', 'image_to_bytes',
+                    'image_to_base64' or 'prepare_image'.
+        path (str): The image path.
+        rounds (int): The number of timed rounds.
+
+    Returns:
+        dict: The per-round latencies, in seconds, and the peak memory growth, in bytes.
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+    file_format = "jpeg" if path.endswith(".jpg") else "png"
+
+    def setup():
+        image = Image.open(path)
+        if name in ("image_to_bytes", "image_to_base64"):
+            resized = utilities.resize_image(image, MAX_PIXELS)
+            image.close()
+            return resized
+        return image
+
+    def run(image):
+        if name == "resize_image":
+            utilities.resize_image(image, MAX_PIXELS)
+        elif name == "image_to_bytes":
+            utilities.image_to_bytes(image, file_format)
+        elif name == "image_to_base64":
+            utilities.image_to_base64(image, file_format)
+        else:
+            utilities.prepare_image(path, MAX_PIXELS)
+
+    # Warm up, so imports and codec initialization are not timed
+    run(setup())
+
+    latencies = []
+    rss_before = None
+    for _ in range(rounds):
+        image = setup()
+        if rss_before is None:
+            rss_before = instrumentation.current_rss_bytes()
+        t0 = time.perf_counter()
+        run(image)
+        latencies.append(time.perf_counter() - t0)
+        image.close()
+
+    return {"latencies": latencies, "peak_bytes": peak_above(rss_before)}
+
+
+def sharpness(image: Image) -> float:
+    # Variance of the Laplacian of the luminance, a common focus measure
+    laplacian = image.convert("L").filter(
+        ImageFilter.Kernel((3, 3), [0, -1, 0, -1, 4, -1, 0, -1, 0], scale=1, offset=128)
+    )
+    return ImageStat.Stat(laplacian).var[0]
+
+
+def compare_resize_quality(path: str) -> dict:
+    """
+    Compare resize_image to a single LANCZOS resize of the fully decoded image.
+
+    resize_image decodes large JPEGs at a reduced scale and resamples in two steps,
+    so its output is checked against the reference the models were scored with:
+    the peak signal-to-noise ratio of the difference, and the ratio of the
+    sharpness (variance of the Laplacian), which the models judge.
+
+    Args:
+        path (str): The image path.
+
+    Returns:
+        dict: The "psnr_db" (None if identical) and "sharpness_ratio".
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+    with Image.open(path) as image:
+        image.load()
+        width, height = image.size
+        scale_factor = MAX_PIXELS / max(width, height)
+        reference = image.resize(
+            (int(width * scale_factor), int(height * scale_factor)), Image.LANCZOS
+        )
+    with Image.open(path) as image:
+        resized = utilities.resize_image(image, MAX_PIXELS)
+
+    bands = ImageStat.Stat(ImageChops.difference(reference, resized)).rms
+    rms = math.sqrt(sum(value**2 for value in bands) / len(bands))
+    return {
+        "psnr_db": round(20 * math.log10(255 / rms), 1) if rms else None,
+        "sharpness_ratio": round(sharpness(resized) / sharpness(reference), 3),
+    }
+
+
+def benchmark_parsing(responses: list, rounds: int) -> dict:
+    """
+    Time utilities.truncate over a corpus of raw model responses.
+
+    Args:
+        responses (list): The raw response texts.
+        rounds (int): The number of passes over the corpus.
+
+    Returns:
+        dict: The per-response latencies, in seconds, and the peak memory growth, in
+              bytes.
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+    for response in responses:
+        utilities.truncate(response)
+
+    latencies = []
+    rss_before = instrumentation.current_rss_bytes()
+    for _ in range(rounds):
+        for response in responses:
+            t0 = time.perf_counter()
+            utilities.truncate(response)
+            latencies.append(time.perf_counter() - t0)
+
+    return {"latencies": latencies, "peak_bytes": peak_above(rss_before)}
+
+
+def percentile(values: list, percent: float) -> float:
+    """
+    Calculate a percentile of a list of values, using the nearest-rank method.
+
+    Args:
+        values (list): The values.
+        percent (float): The percentile, from 0 to 100.
+
+    Returns:
+        float: The percentile value.
+    """
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies: list, peak_bytes: int, megapixels: float = None) -> dict:
+    """
+    Summarize the latencies of a benchmark.
+
+    Args:
+        latencies (list): The latencies, in seconds.
+        peak_bytes (int): The peak memory growth, in bytes, or None.
+        megapixels (float, optional): The image size, to report megapixels per second.
+
+    Returns:
+        dict: The count, p50, p99 and mean latencies in milliseconds, the throughput
+              in operations (and megapixels) per second, and the peak memory in MB.
+    """
+    mean = sum(latencies) / len(latencies)
+    summary = {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(mean * 1000, 3),
+        "ops_per_s": round(1 / mean, 2) if mean else None,
+        "peak_mb": round(peak_bytes / 1024**2, 1) if peak_bytes is not None else None,
+    }
+    if megapixels is not None and mean:
+        summary["mp_per_s"] = round(megapixels / mean, 2)
+    return summary
+
+
+def run_benchmarks(
+    sizes: list, formats: list, functions: list, rounds: int, responses: list
+) -> dict:
+    """
+    Run the benchmarks, each in a fresh process so the peak memory is its own.
+
+    Args:
+        sizes (list): The image sizes, in megapixels.
+        formats (list): The image formats.
+        functions (list): The preprocessing functions to benchmark.
+        rounds (int): The number of timed rounds per image benchmark.
+        responses (list): The raw response corpus for the parsing benchmark.
+
+    Returns:
+        dict: The summary of each benchmark, keyed by name.
+    """
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for megapixels in sizes:
+            for file_format in formats:
+                path = make_synthetic_image(megapixels, file_format)
+                for name in functions:
+                    key = f"{name}[{megapixels}mp-{file_format}]"
+                    logging.info(f"Benchmarking {key}")
+                    measured = pool.apply(benchmark_image, (name, path, rounds))
+                    results[key] = summarize(
+                        measured["latencies"], measured["peak_bytes"], megapixels
+                    )
+                    if name == "resize_image" and megapixels * 1_000_000 > MAX_PIXELS**2:
+                        results[key].update(pool.apply(compare_resize_quality, (path,)))
+
+        key = f"truncate[{len(responses)} responses]"
+        logging.info(f"Benchmarking {key}")
+        measured = pool.apply(benchmark_parsing, (responses, PARSE_ROUNDS))
+        results[key] = summarize(measured["latencies"], measured["peak_bytes"])
+
+    return results
+
+
+def compare_to_baseline(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Compare the results to a baseline, and log the change of each benchmark.
+
+    Args:
+        results (dict): The benchmark summaries.
+        baseline (dict): The baseline benchmark summaries.
+        threshold (float): The relative p50 slowdown reported as a regression, if
+                           also slower by more than MIN_REGRESSION_MS.
+
+    Returns:
+        list: The names of the regressed benchmarks.
+    """
+    regressions = []
+    for key, summary in results.items():
+        previous = baseline.get(key)
+        if previous is None or not previous["p50_ms"]:
+            continue
+        change = summary["p50_ms"] / previous["p50_ms"] - 1
+        regressed = (
+            change > threshold
+            and summary["p50_ms"] - previous["p50_ms"] > MIN_REGRESSION_MS
+        )
+        if regressed:
+            regressions.append(key)
+        logging.log(
+            logging.WARNING if regressed else logging.INFO,
+            f"{key}: p50 {previous['p50_ms']:.3f} -> {summary['p50_ms']:.3f} ms "
+            f"({change:+.0%}){' REGRESSION' if regressed else ''}",
+        )
+    return regressions
+
+
+def log_results(results: dict) -> None:
+    logging.info(
+        f"{'benchmark':<40} {'p50 ms':>10} {'p99 ms':>10} {'ops/s':>9} "
+        f"{'MP/s':>8} {'peak MB':>8}"
+    )
+    for key, summary in results.items():
+        mp_per_s = summary.get("mp_per_s")
+        peak_mb = summary["peak_mb"]
+        logging.info(
+            f"{key:<40} {summary['p50_ms']:>10.3f} {summary['p99_ms']:>10.3f} "
+            f"{summary['ops_per_s']:>9.2f} "
+            f"{mp_per_s if mp_per_s is not None else '-':>8} "
+            f"{peak_mb if peak_mb is not None else '-':>8}"
+        )
+    for key, summary in results.items():
+        if "sharpness_ratio" in summary:
+            psnr_db = summary["psnr_db"]
+            logging.info(
+                f"{key}: {'identical' if psnr_db is None else f'PSNR {psnr_db} dB'} "
+                f"to a full-resolution LANCZOS resize, "
+                f"sharpness ratio {summary['sharpness_ratio']}"
+            )
+
+
+def check_resize_quality(results: dict) -> list:
+    """
+    Check that resize_image stays equivalent to a full-resolution LANCZOS resize.
+
+    Args:
+        results (dict): The benchmark summaries.
+
+    Returns:
+        list: The names of the resize benchmarks below MIN_RESIZE_PSNR_DB.
+    """
+    degraded = [
+        key
+        for key, summary in results.items()
+        if summary.get("psnr_db") is not None
+        and summary["psnr_db"] < MIN_RESIZE_PSNR_DB
+    ]
+    for key in degraded:
+        logging.warning(
+            f"{key}: PSNR {results[key]['psnr_db']} dB is below "
+            f"{MIN_RESIZE_PSNR_DB} dB, QUALITY REGRESSION"
+        )
+    return degraded
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the image preprocessing and response parsing functions."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=list(SIZES_MP),
+        help="synthetic image sizes, in megapixels",
+    )
+    parser.add_argument(
+        "--formats", nargs="+", choices=FORMATS, default=list(FORMATS)
+    )
+    parser.add_argument(
+        "--functions",
+        nargs="+",
+        choices=["resize_image", "image_to_bytes", "image_to_base64", "prepare_image"],
+        default=["resize_image", "image_to_bytes", "image_to_base64", "prepare_image"],
+    )
+    parser.add_argument("--rounds", type=int, default=ROUNDS)
+    parser.add_argument(
+        "--responses",
+        help="response cache database to take recorded responses from "
+        "(e.g., cache/responses.sqlite), instead of the built-in corpus",
+    )
+    parser.add_argument(
+        "--output", help="write the results to this JSON file, in addition to the log"
+    )
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="save the results as the new baseline",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=REGRESSION_THRESHOLD,
+        help="relative p50 slowdown reported as a regression (default: 0.2)",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    responses = RESPONSE_CORPUS
+    if args.responses:
+        responses = load_recorded_responses(args.responses)
+        logging.info(f"Loaded {len(responses)} recorded responses")
+
+    results = run_benchmarks(
+        args.sizes, args.formats, args.functions, args.rounds, responses
+    )
+    log_results(results)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pillow": Image.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(
+            results, baseline["results"], args.threshold
+        )
+    regressions += check_resize_quality(results)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"Saved baseline to {args.baseline}")
+
+    if regressions:
+        logging.warning(f"{len(regressions)} benchmarks regressed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
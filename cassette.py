@@ -0,0 +1,319 @@
+"""
+# Title: Record and replay model calls for deterministic re-scoring and regression runs
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import asyncio
+import contextlib
+import functools
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+
+import instrumentation
+import response_cache as response_caching
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+DEFAULT_CASSETTE_PATH = "cassettes/responses.sqlite"
+RECORD = "record"
+REPLAY = "replay"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS interactions (
+    fingerprint TEXT PRIMARY KEY,
+    model_id TEXT NOT NULL,
+    payload_sha256 TEXT NOT NULL,
+    response BLOB NOT NULL,
+    latency REAL,
+    ttft REAL,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    recorded_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class CassetteMissError(Exception):
+    """No response was recorded for a request that is being replayed."""
+
+
+def make_fingerprint(
+    model_id: str,
+    prompt_hash: str,
+    temperature: float,
+    max_tokens: int,
+    payload_sha256: str,
+    file_format: str,
+) -> str:
+    """
+    Build the fingerprint of a model request.
+
+    The fingerprint covers everything the provider adapter sends: the model, the
+    prompts, the sampling settings, and the exact image payload, so a change to the
+    prompts or the preprocessing is a cassette miss rather than a stale response.
+
+    Args:
+        model_id (str): The model identifier.
+        prompt_hash (str): The digest of the system and user prompts.
+        temperature (float): The sampling temperature.
+        max_tokens (int): The maximum number of output tokens.
+        payload_sha256 (str): The SHA-256 digest of the image bytes sent.
+        file_format (str): The image format ('jpeg' or 'png').
+
+    Returns:
+        str: The hexadecimal fingerprint.
+    """
+    fields = json.dumps(
+        [
+            model_id,
+            prompt_hash,
+            float(temperature),
+            int(max_tokens),
+            payload_sha256,
+            file_format,
+        ]
+    )
+    return hashlib.sha256(fields.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    SQLite store of recorded model calls: the raw response of each request
+    fingerprint (zlib-compressed), with its latency, time to first token and token
+    usage.
+
+    Args:
+        path (str): The path of the SQLite database file.
+        mode (str): RECORD or REPLAY.
+        replay_latency (bool): Wait for each call's recorded latency when replaying.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CASSETTE_PATH,
+        mode: str = REPLAY,
+        replay_latency: bool = False,
+    ) -> None:
+        if mode == REPLAY and not os.path.exists(path):
+            raise FileNotFoundError(f"Cassette {path} does not exist; record it first")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self.stats = Counter(hits=0, misses=0, writes=0)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def get(self, fingerprint: str) -> dict:
+        """
+        Look up a recorded call.
+
+        Args:
+            fingerprint (str): The request fingerprint.
+
+        Returns:
+            dict: The "response_text", "latency", "ttft" and "usage" of the call, or
+                  None if it was not recorded.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response, latency, ttft, input_tokens, output_tokens "
+                "FROM interactions WHERE fingerprint = ?",
+                (fingerprint,),
+            ).fetchone()
+            self.stats["hits" if row is not None else "misses"] += 1
+        if row is None:
+            return None
+
+        return {
+            "response_text": zlib.decompress(row[0]).decode("utf-8"),
+            "latency": row[1],
+            "ttft": row[2],
+            "usage": {"input_tokens": row[3], "output_tokens": row[4]},
+        }
+
+    def put(
+        self,
+        fingerprint: str,
+        model_id: str,
+        payload_sha256: str,
+        response_text: str,
+        latency: float = None,
+        ttft: float = None,
+        usage: dict = None,
+    ) -> None:
+        """
+        Record a call, replacing an earlier recording of the same request.
+
+        Args:
+            fingerprint (str): The request fingerprint.
+            model_id (str): The model identifier.
+            payload_sha256 (str): The SHA-256 digest of the image bytes sent.
+            response_text (str): The raw response text.
+            latency (float, optional): The duration of the call, in seconds.
+            ttft (float, optional): The time to first token, in seconds.
+            usage (dict, optional): The "input_tokens" and "output_tokens" reported.
+        """
+        usage = usage or {}
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO interactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    fingerprint,
+                    model_id,
+                    payload_sha256,
+                    zlib.compress(response_text.encode("utf-8"), 9),
+                    latency,
+                    ttft,
+                    usage.get("input_tokens"),
+                    usage.get("output_tokens"),
+                    time.time(),
+                ),
+            )
+            self.connection.commit()
+            self.stats["writes"] += 1
+
+    def log_stats(self) -> None:
+        """Log the recorded or replayed call statistics."""
+        if self.mode == RECORD:
+            logging.info(f"Cassette: recorded {self.stats['writes']} calls to {self.path}")
+        else:
+            logging.info(
+                f"Cassette: replayed {self.stats['hits']} calls from {self.path}, "
+                f"{self.stats['misses']} not recorded"
+            )
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self.lock:
+            self.connection.close()
+
+
+async def record_model(
+    cassette: Cassette,
+    invoke_model,
+    model_id: str,
+    request_fields: tuple,
+    image_bytes: bytes,
+    file_format: str,
+) -> str:
+    payload_sha256 = hashlib.sha256(image_bytes).hexdigest()
+    start = time.perf_counter()
+    response_text = await invoke_model(image_bytes, file_format)
+    latency = time.perf_counter() - start
+
+    trace = instrumentation.CURRENT_TRACE.get()
+    await asyncio.to_thread(
+        cassette.put,
+        make_fingerprint(model_id, *request_fields, payload_sha256, file_format),
+        model_id,
+        payload_sha256,
+        response_text,
+        latency,
+        trace.times.get("ttft") if trace else None,
+        dict(trace.usage) if trace else None,
+    )
+    return response_text
+
+
+async def replay_model(
+    cassette: Cassette,
+    model_id: str,
+    request_fields: tuple,
+    image_bytes: bytes,
+    file_format: str,
+) -> str:
+    payload_sha256 = hashlib.sha256(image_bytes).hexdigest()
+    fingerprint = make_fingerprint(
+        model_id, *request_fields, payload_sha256, file_format
+    )
+    entry = await asyncio.to_thread(cassette.get, fingerprint)
+    if entry is None:
+        raise CassetteMissError(
+            f"No recorded response for {model_id} and payload {payload_sha256[:12]}"
+        )
+
+    if cassette.replay_latency and entry["latency"]:
+        await asyncio.sleep(entry["latency"])
+    if entry["ttft"] is not None:
+        instrumentation.record_time("ttft", entry["ttft"])
+    instrumentation.record_usage(**entry["usage"])
+
+    return entry["response_text"]
+
+
+@contextlib.asynccontextmanager
+async def open_invoker(provider, rate_limiter, cassette: Cassette = None):
+    """
+    Open a provider's invoke_model coroutine function, recording or replaying its
+    calls with a cassette.
+
+    When replaying, the provider's client is never opened, so no credentials or
+    network are needed.
+
+    Args:
+        provider (module): The provider module.
+        rate_limiter (RateLimiter): The provider's shared rate limiter.
+        cassette (Cassette, optional): The cassette; the provider's own invoker if None.
+    """
+    request_fields = (
+        response_caching.hash_prompts(provider.SYSTEM_PROMPT, provider.USER_PROMPT),
+        provider.TEMPERATURE,
+        provider.MAX_TOKENS,
+    )
+
+    if cassette is not None and cassette.mode == REPLAY:
+        yield functools.partial(replay_model, cassette, provider.MODEL_ID, request_fields)
+        return
+
+    async with provider.open_invoker(rate_limiter) as invoke_model:
+        if cassette is None:
+            yield invoke_model
+        else:
+            yield functools.partial(
+                record_model, cassette, invoke_model, provider.MODEL_ID, request_fields
+            )
+
+
+def create_cassette() -> Cassette:
+    """
+    Create the cassette from environment variables.
+
+    IQA_CASSETTE_MODE is "record" to record every model call, or "replay" to serve
+    the recorded responses without calling the models. IQA_CASSETTE sets the
+    database path, and IQA_CASSETTE_LATENCY=1 replays the recorded latencies.
+
+    Returns:
+        Cassette: The cassette, or None if IQA_CASSETTE_MODE is not set.
+    """
+    mode = os.environ.get("IQA_CASSETTE_MODE", "").lower()
+    if not mode:
+        return None
+    if mode not in (RECORD, REPLAY):
+        raise ValueError(f"Invalid IQA_CASSETTE_MODE {mode!r}, expected record or replay")
+
+    path = os.environ.get("IQA_CASSETTE", DEFAULT_CASSETTE_PATH)
+    replay_latency = os.environ.get("IQA_CASSETTE_LATENCY", "").lower() in (
+        "1",
+        "true",
+        "yes",
+        "on",
+    )
+    logging.info(f"Cassette: {mode}ing model calls with {path}")
+    return Cassette(path, mode, replay_latency)
@@ -0,0 +1,715 @@
+"""
+# Title: Asynchronous evaluation engine for image quality assessments
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import logging
+import os
+import time
+import urllib.parse
+from collections import Counter
+from typing import Awaitable, Callable
+
+import cassette as recording
+import image_cache as image_caching
+import instrumentation
+import json_extractor
+import preprocessing_pipeline as preprocessing
+import rate_limiter as rate_limiting
+import response_cache as response_caching
+import results_db
+import results_writer
+import retry_policy as retrying
+import streaming
+import utilities
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+IMAGE_EXTENSIONS = (".jpeg", ".jpg", ".png")
+DEFAULT_CONCURRENCY = 4
+
+
+def list_images(directory: str) -> list:
+    """
+    List the image files in a directory, sorted by filename.
+
+    Args:
+        directory (str): The directory containing the images.
+
+    Returns:
+        list: The sorted filenames of all JPEG and PNG images in the directory.
+    """
+    return [
+        filename
+        for filename in sorted(os.listdir(directory))
+        if filename.endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+def get_concurrency(default: int) -> int:
+    """
+    Get the maximum number of in-flight requests for a provider.
+
+    The provider's default can be overridden with the IQA_MAX_CONCURRENCY
+    environment variable.
+
+    Args:
+        default (int): The provider's default concurrency limit.
+
+    Returns:
+        int: The concurrency limit, never less than 1.
+    """
+    try:
+        concurrency = int(os.environ.get("IQA_MAX_CONCURRENCY", default))
+    except ValueError:
+        logging.error("Invalid IQA_MAX_CONCURRENCY value. Using provider default.")
+        concurrency = default
+
+    return max(1, concurrency)
+
+
+def get_endpoint_url(default: str = None) -> str:
+    """
+    Get the URL that a provider's requests are sent to.
+
+    The provider's endpoint can be overridden with the IQA_ENDPOINT_URL environment
+    variable, e.g. to point every provider at the local mock provider server
+    (mock_provider_server.py) for load testing. The scheme and host of the
+    provider's URL are replaced, and its path and query are kept.
+
+    Args:
+        default (str, optional): The provider's endpoint URL, or None for the SDK
+                                 default.
+
+    Returns:
+        str: The endpoint URL, or None for the SDK default.
+    """
+    endpoint_url = os.environ.get("IQA_ENDPOINT_URL", "").rstrip("/")
+    if not endpoint_url:
+        return default
+    if not default:
+        return endpoint_url
+
+    parts = urllib.parse.urlsplit(default)
+    return endpoint_url + urllib.parse.urlunsplit(
+        ("", "", parts.path, parts.query, parts.fragment)
+    )
+
+
+def reserve_threads(threads: int) -> None:
+    """
+    Size the event loop's default executor for the requests in flight.
+
+    Preprocessing and the blocking SDK calls (boto3, requests, streamed responses)
+    run in the default executor through asyncio.to_thread. It has min(32, CPUs + 4)
+    threads by default, which, on a small machine, caps the requests in flight
+    below the concurrency limit. Call before the first asyncio.to_thread.
+
+    Args:
+        threads (int): The threads needed for the requests in flight, on top of the
+                       default.
+    """
+    max_workers = threads + min(32, (os.cpu_count() or 1) + 4)
+    asyncio.get_running_loop().set_default_executor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    )
+
+
+async def evaluate_image(
+    filename: str,
+    invoke_model: Callable[[bytes, str], Awaitable[str]],
+    directory: str,
+    model_id: str,
+    temperature: float,
+    max_tokens: int,
+    max_pixels: int = None,
+    rate_limiter: rate_limiting.RateLimiter = None,
+    request_tokens: int = 0,
+    response_cache: response_caching.ResponseCache = None,
+    prompt_hash: str = None,
+    image_cache: image_caching.ImageCache = None,
+    image_sha256: str = None,
+    payload: tuple = None,
+    retry_policy: retrying.RetryPolicy = None,
+    dead_letter: results_writer.JsonlResultWriter = None,
+    trace: instrumentation.RequestTrace = None,
+) -> dict:
+    """
+    Evaluate the quality of a single image.
+
+    The time spent in each stage (decode, resize, encode, upload, queue, request,
+    time to first token, backoff and parse), the token usage reported by the
+    provider, and the payload size are recorded in the trace and added to the record.
+
+    Args:
+        filename (str): The filename of the image within the directory.
+        invoke_model (Callable): Coroutine function that sends the image bytes and file
+                                 format to the model and returns the raw response text.
+        directory (str): The directory containing the image.
+        model_id (str): The model identifier recorded with the result.
+        temperature (float): The temperature recorded with the result.
+        max_tokens (int): The maximum tokens recorded with the result.
+        max_pixels (int, optional): The maximum number of pixels for the largest dimension
+                                    of the image. If None, the image is not resized.
+        rate_limiter (RateLimiter, optional): The provider's shared rate limiter.
+        request_tokens (int): The estimated tokens consumed by each request.
+        response_cache (ResponseCache, optional): The cache of previous model responses.
+        prompt_hash (str, optional): The digest of the prompts, part of the cache key.
+        image_cache (ImageCache, optional): The cache of preprocessed image payloads.
+        image_sha256 (str, optional): The SHA-256 digest of the image file, if already
+                                      known.
+        payload (tuple, optional): The already prepared image bytes and file format. If
+                                   None, the image is loaded and prepared here.
+        retry_policy (RetryPolicy, optional): The policy for retrying throttled and
+                                              transient failures. Defaults to
+                                              RetryPolicy().
+        dead_letter (JsonlResultWriter, optional): The writer failed images are
+                                                   recorded to.
+        trace (RequestTrace, optional): The trace the stages are recorded in, e.g.
+                                        with the preprocessing already recorded. A
+                                        new trace if None.
+
+    Returns:
+        dict: The result record, or None if the request failed.
+    """
+    t0 = time.time()
+    trace = instrumentation.start_trace(trace)
+
+    logging.info(f"Evaluation for {filename}")
+
+    image_path = os.path.join(directory, filename)
+    cache_key = None
+    if response_cache is not None:
+        try:
+            if image_sha256 is None:
+                image_sha256 = await asyncio.to_thread(utilities.hash_file, image_path)
+            cache_key = response_caching.make_key(
+                image_sha256, model_id, prompt_hash, temperature, max_tokens
+            )
+            cached = await asyncio.to_thread(response_cache.get, cache_key)
+        except Exception as e:
+            logging.error(f"Error reading response cache for {filename}: {e}")
+            cached = cache_key = None
+
+        if cached is not None:
+            logging.info(f"Using cached response for {filename}")
+            result = cached["result"]
+            # Parse failures are re-parsed, in case the parser has improved since
+            if result.get("score") == -1:
+                result = utilities.truncate(cached["response_text"])
+            return build_record(
+                result, filename, model_id, temperature, max_tokens, cached["time"]
+            )
+
+    if payload is None:
+        try:
+            # Decoding, resizing and encoding are CPU-bound, so keep them off the event loop
+            payload = await asyncio.to_thread(
+                utilities.prepare_image, image_path, max_pixels, image_cache, image_sha256
+            )
+        except Exception as e:
+            logging.error(f"Error processing {filename}: {e}")
+            record_failure(dead_letter, filename, model_id, retrying.FATAL, e, 0)
+            return None
+    image_bytes, file_format = payload
+    instrumentation.record_payload(image_bytes)
+
+    retry_policy = retry_policy or retrying.RetryPolicy()
+    response_text, failure, attempts = await retry_policy.call(
+        lambda: invoke_model(image_bytes, file_format),
+        rate_limiter=rate_limiter,
+        request_tokens=request_tokens,
+        label=filename,
+    )
+    if failure is not None:
+        category, e = failure
+        logging.error(
+            f"Error processing {filename} after {attempts} attempts ({category}): {e}"
+        )
+        record_failure(dead_letter, filename, model_id, category, e, attempts)
+        return None
+
+    logging.debug(f"Raw response: {response_text}")
+
+    # Calculate time taken
+    t1 = time.time()
+    tt = round(t1 - t0, 2)
+    logging.debug(f"Processed {filename} in {tt:.2f} seconds")
+
+    with instrumentation.stage("parse"):
+        result = utilities.truncate(response_text)
+
+    if cache_key is not None:
+        try:
+            await asyncio.to_thread(
+                response_cache.put,
+                cache_key,
+                image_sha256,
+                model_id,
+                response_text,
+                result,
+                tt,
+            )
+        except Exception as e:
+            logging.error(f"Error writing response cache for {filename}: {e}")
+
+    return build_record(
+        result, filename, model_id, temperature, max_tokens, tt, trace.metrics()
+    )
+
+
+def record_failure(
+    dead_letter: results_writer.JsonlResultWriter,
+    filename: str,
+    model_id: str,
+    category: str,
+    error: Exception,
+    attempts: int,
+) -> None:
+    """
+    Record a failed image in the dead-letter file, so it can be retried on its own.
+
+    Args:
+        dead_letter (JsonlResultWriter): The dead-letter writer, or None.
+        filename (str): The filename of the image.
+        model_id (str): The model identifier.
+        category (str): The error category (throttled, transient or fatal).
+        error (Exception): The last error.
+        attempts (int): The number of attempts made.
+    """
+    if dead_letter is None:
+        return
+    dead_letter.write(
+        {
+            "image_id": filename,
+            "model_id": model_id,
+            "category": category,
+            "error_type": type(error).__name__,
+            "error": str(error),
+            "attempts": attempts,
+            "time": time.time(),
+        }
+    )
+
+
+def build_record(
+    result: dict,
+    filename: str,
+    model_id: str,
+    temperature: float,
+    max_tokens: int,
+    elapsed: float,
+    metrics: dict = None,
+) -> dict:
+    """
+    Add the image, model and timing fields to a parsed model response.
+
+    Args:
+        result (dict): The parsed response, with "score" and "explanation" keys.
+        filename (str): The filename of the image.
+        model_id (str): The model identifier.
+        temperature (float): The sampling temperature.
+        max_tokens (int): The maximum number of output tokens.
+        elapsed (float): The processing time, in seconds.
+        metrics (dict, optional): The stage timings, token usage and payload size
+                                  (see RequestTrace.metrics).
+
+    Returns:
+        dict: The result record.
+    """
+    record = dict(result)
+    record["image_id"] = filename
+    record["model_id"] = model_id
+    record["temperature"] = temperature
+    record["max_tokens"] = max_tokens
+    record["time"] = elapsed
+    if metrics:
+        record.update(metrics)
+
+    return record
+
+
+async def run_evaluations(
+    invoke_model: Callable[[bytes, str], Awaitable[str]],
+    model_id: str,
+    temperature: float,
+    max_tokens: int,
+    directory: str = "input/",
+    max_pixels: int = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    rate_limiter: rate_limiting.RateLimiter = None,
+    request_tokens: int = 0,
+    response_cache: response_caching.ResponseCache = None,
+    prompt_hash: str = None,
+    image_cache: image_caching.ImageCache = None,
+    result_writer: results_writer.JsonlResultWriter = None,
+    filenames: list = None,
+    retry_policy: retrying.RetryPolicy = None,
+    dead_letter: results_writer.JsonlResultWriter = None,
+    span_exporter: instrumentation.SpanExporter = None,
+    pipeline: preprocessing.PreprocessingPipeline = None,
+) -> dict:
+    """
+    Evaluate all images in a directory with a bounded number of concurrent requests.
+
+    A fixed pool of workers pulls filenames from a queue, so at most `concurrency`
+    requests are in flight. With a result writer, each record is appended to it as
+    soon as the image finishes and is not kept in memory; otherwise, results are
+    returned in filename order, regardless of completion order.
+
+    Args:
+        invoke_model (Callable): Coroutine function that sends the image bytes and file
+                                 format to the model and returns the raw response text.
+        model_id (str): The model identifier recorded with each result.
+        temperature (float): The temperature recorded with each result.
+        max_tokens (int): The maximum tokens recorded with each result.
+        directory (str): The directory containing the images.
+        max_pixels (int, optional): The maximum number of pixels for the largest dimension
+                                    of each image. If None, images are not resized.
+        concurrency (int): The maximum number of in-flight requests.
+        rate_limiter (RateLimiter, optional): The provider's shared rate limiter, which
+                                              paces requests across all workers.
+        request_tokens (int): The estimated tokens consumed by each request.
+        response_cache (ResponseCache, optional): The cache of previous model responses.
+                                                  Cached images are not sent to the model.
+        prompt_hash (str, optional): The digest of the prompts, part of the cache key.
+        image_cache (ImageCache, optional): The cache of preprocessed image payloads.
+        result_writer (JsonlResultWriter, optional): The writer each record is
+                                                     streamed to.
+        filenames (list, optional): The images to evaluate. Defaults to all images in
+                                    the directory.
+        retry_policy (RetryPolicy, optional): The policy for retrying throttled and
+                                              transient failures.
+        dead_letter (JsonlResultWriter, optional): The writer failed images are
+                                                   recorded to.
+        span_exporter (SpanExporter, optional): The exporter of each image's spans.
+        pipeline (PreprocessingPipeline, optional): The pipeline that prepares the
+                                                    payloads of `filenames` ahead, in
+                                                    a process pool. If None, each
+                                                    worker prepares its own image.
+
+    Returns:
+        dict: The scores dictionary, in the form {"scores": [...]}, which is empty
+              when the records are streamed to a result writer.
+    """
+    if filenames is None:
+        filenames = list_images(directory)
+    results = [None] * len(filenames)
+    indexes = {filename: index for index, filename in enumerate(filenames)}
+
+    queue = asyncio.Queue()
+    for index, filename in enumerate(filenames):
+        queue.put_nowait((index, filename))
+
+    async def next_image() -> tuple:
+        """Take the next image, and its payload if the pipeline prepared it."""
+        if pipeline is None:
+            if queue.empty():
+                return None
+            index, filename = queue.get_nowait()
+            return index, filename, None, None, instrumentation.RequestTrace()
+
+        while True:
+            item = await pipeline.get()
+            if item is None:
+                return None
+            filename, prepared, trace = item
+            if isinstance(prepared, Exception):
+                logging.error(f"Error processing {filename}: {prepared}")
+                record_failure(
+                    dead_letter, filename, model_id, retrying.FATAL, prepared, 0
+                )
+                continue
+            variants, file_format, image_sha256 = prepared
+            payload = (variants[max_pixels], file_format)
+            return indexes[filename], filename, payload, image_sha256, trace
+
+    async def worker() -> None:
+        while True:
+            image = await next_image()
+            if image is None:
+                return
+            index, filename, payload, image_sha256, trace = image
+            record = await evaluate_image(
+                filename,
+                invoke_model,
+                directory,
+                model_id,
+                temperature,
+                max_tokens,
+                max_pixels=max_pixels,
+                rate_limiter=rate_limiter,
+                request_tokens=request_tokens,
+                response_cache=response_cache,
+                prompt_hash=prompt_hash,
+                image_cache=image_cache,
+                image_sha256=image_sha256,
+                payload=payload,
+                retry_policy=retry_policy,
+                dead_letter=dead_letter,
+                trace=trace,
+            )
+            if span_exporter is not None:
+                span_exporter.export(trace, filename, model_id, record)
+            if result_writer is None:
+                results[index] = record
+            elif record is not None:
+                result_writer.write(record)
+
+    logging.info(
+        f"Evaluating {len(filenames)} images with up to {concurrency} concurrent requests"
+    )
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(filenames)))))
+
+    if response_cache is not None:
+        response_cache.log_stats()
+    if image_cache is not None:
+        image_cache.log_stats()
+    json_extractor.log_parse_stats()
+    streaming.log_stream_stats()
+
+    return {"scores": [result for result in results if result is not None]}
+
+
+def provider_options(provider) -> dict:
+    """
+    Get the model settings of a provider module as keyword arguments for evaluate_image.
+
+    Args:
+        provider (module): The provider module.
+
+    Returns:
+        dict: The model_id, temperature, max_tokens, max_pixels, request_tokens and
+              prompt_hash keyword arguments.
+    """
+    return {
+        "model_id": provider.MODEL_ID,
+        "temperature": provider.TEMPERATURE,
+        "max_tokens": provider.MAX_TOKENS,
+        "max_pixels": getattr(provider, "MAX_PIXELS", None),
+        "request_tokens": rate_limiting.estimate_tokens(
+            provider.SYSTEM_PROMPT + provider.USER_PROMPT, provider.MAX_TOKENS
+        ),
+        "prompt_hash": response_caching.hash_prompts(
+            provider.SYSTEM_PROMPT, provider.USER_PROMPT
+        ),
+    }
+
+
+def select_images(
+    filenames: list, output_path: str, resume: bool = False, retry_failed: bool = False
+) -> list:
+    """
+    Select the images to evaluate, for a fresh, resumed or retry run.
+
+    Args:
+        filenames (list): All image filenames.
+        output_path (str): The path of the provider's JSON results file.
+        resume (bool): Skip the images already recorded in the JSONL file.
+        retry_failed (bool): Only evaluate the images recorded in the dead-letter file
+                             that have not succeeded since.
+
+    Returns:
+        list: The filenames to evaluate.
+    """
+    if not resume and not retry_failed:
+        return filenames
+
+    completed_ids = results_writer.load_completed_ids(
+        results_writer.jsonl_path(output_path)
+    )
+    selected = [filename for filename in filenames if filename not in completed_ids]
+    if retry_failed:
+        failed_ids = results_writer.load_completed_ids(
+            results_writer.dead_letter_path(output_path)
+        )
+        selected = [filename for filename in selected if filename in failed_ids]
+        logging.info(f"Retrying {len(selected)} failed images")
+    else:
+        logging.info(
+            f"Resuming: skipping {len(filenames) - len(selected)} completed images"
+        )
+
+    return selected
+
+
+def create_prescreen():
+    """
+    Create the local pre-screen, if it is enabled with IQA_PRESCREEN.
+
+    The pre-screen needs NumPy, so prescreen.py is only imported when it is enabled.
+
+    Returns:
+        Prescreen: The pre-screen, or None if IQA_PRESCREEN is not set.
+    """
+    if os.environ.get("IQA_PRESCREEN", "").lower() not in ("1", "true", "yes", "on"):
+        return None
+
+    import prescreen as prescreening
+
+    return prescreening.create_prescreen()
+
+
+def write_prescreened(
+    prescreened: dict, writer: results_writer.JsonlResultWriter, provider
+) -> None:
+    """
+    Record the images that failed the pre-screen as a provider's results, so its
+    results cover every image, and a resumed run skips them.
+
+    Args:
+        prescreened (dict): The result and screening time of each image that failed,
+                            keyed by filename (see Prescreen.screen_images).
+        writer (JsonlResultWriter): The provider's JSONL writer.
+        provider (module): The provider module.
+    """
+    for filename, (result, elapsed) in prescreened.items():
+        writer.write(
+            build_record(
+                result,
+                filename,
+                provider.MODEL_ID,
+                provider.TEMPERATURE,
+                provider.MAX_TOKENS,
+                elapsed,
+            )
+        )
+
+
+async def evaluate_provider(
+    provider, directory: str = None, resume: bool = False, retry_failed: bool = False
+) -> Counter:
+    """
+    Evaluate all images in a directory with a single provider.
+
+    The provider is an image_quality_* module, which defines the model settings
+    (MODEL_ID, TEMPERATURE, MAX_TOKENS, MAX_PIXELS, MAX_CONCURRENCY,
+    REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, SYSTEM_PROMPT, USER_PROMPT, OUTPUT_PATH)
+    and an `open_invoker(rate_limiter)` async context manager that yields its
+    invoke_model coroutine function. It may also define RETRYABLE_ERRORS, the
+    provider's additional transient exception class names and error codes.
+
+    With a cassette (IQA_CASSETTE_MODE), every model call is recorded, or replayed
+    without calling the model; the response cache is not used. With IQA_RESULTS_DB,
+    the JSON results file is imported into the results database at the end. With
+    IQA_PREPROCESS_PROCESSES, the images are prepared ahead in a process pool. With
+    IQA_PRESCREEN, images that are clearly unusable are scored 0 locally instead of
+    being sent to the model, and recorded as the model's results (see prescreen.py).
+
+    Each record is appended to a JSONL file next to OUTPUT_PATH as soon as its image
+    finishes, and the JSON results file is written from it at the end, so an
+    interrupted run keeps every completed result. Images that still fail after
+    retrying are recorded in a dead-letter file next to OUTPUT_PATH.
+
+    Args:
+        provider (module): The provider module.
+        directory (str, optional): The directory containing the images. Defaults to
+                                   the provider's DIRECTORY.
+        resume (bool): Skip the images already recorded in the JSONL file and append
+                       to it, instead of starting over.
+        retry_failed (bool): Only evaluate the images in the dead-letter file, and
+                             append their results to the JSONL file.
+
+    Returns:
+        Counter: The count of each score.
+    """
+    directory = directory or provider.DIRECTORY
+    rate_limiter = rate_limiting.create_rate_limiter(
+        provider.REQUESTS_PER_MINUTE, provider.TOKENS_PER_MINUTE
+    )
+    filenames = select_images(
+        list_images(directory), provider.OUTPUT_PATH, resume, retry_failed
+    )
+    jsonl_path = results_writer.jsonl_path(provider.OUTPUT_PATH)
+    dead_letter_path = results_writer.dead_letter_path(provider.OUTPUT_PATH)
+    span_exporter = instrumentation.create_span_exporter()
+    cassette = recording.create_cassette()
+    replaying = cassette is not None and cassette.mode == recording.REPLAY
+
+    with results_writer.JsonlResultWriter(
+        jsonl_path, append=resume or retry_failed
+    ) as writer, results_writer.JsonlResultWriter(
+        dead_letter_path, append=resume
+    ) as dead_letter:
+        prescreen = create_prescreen()
+        if prescreen is not None:
+            prescreened = await asyncio.to_thread(
+                prescreen.screen_images, directory, filenames
+            )
+            write_prescreened(prescreened, writer, provider)
+            filenames = [name for name in filenames if name not in prescreened]
+
+        concurrency = get_concurrency(provider.MAX_CONCURRENCY)
+        reserve_threads(concurrency)
+        image_cache = image_caching.create_image_cache()
+        pipeline = preprocessing.create_pipeline(
+            directory, filenames, [getattr(provider, "MAX_PIXELS", None)], image_cache
+        )
+        async with recording.open_invoker(
+            provider, rate_limiter, cassette
+        ) as invoke_model, pipeline or contextlib.nullcontext():
+            await run_evaluations(
+                invoke_model,
+                directory=directory,
+                concurrency=concurrency,
+                # Replayed calls are not paced, and every call is recorded or replayed
+                rate_limiter=None if replaying else rate_limiter,
+                response_cache=(
+                    None if cassette else response_caching.create_response_cache()
+                ),
+                image_cache=image_cache,
+                result_writer=writer,
+                filenames=filenames,
+                retry_policy=retrying.create_retry_policy(
+                    getattr(provider, "RETRYABLE_ERRORS", ())
+                ),
+                dead_letter=dead_letter,
+                span_exporter=span_exporter,
+                pipeline=pipeline,
+                **provider_options(provider),
+            )
+
+    if span_exporter is not None:
+        span_exporter.close()
+    if cassette is not None:
+        cassette.log_stats()
+        cassette.close()
+    if dead_letter.count:
+        logging.warning(f"{dead_letter.count} images failed, see {dead_letter_path}")
+
+    score_counts = results_writer.export_scores(jsonl_path, provider.OUTPUT_PATH)
+    results_db.import_results([provider.OUTPUT_PATH])
+    return score_counts
+
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse the command-line arguments shared by the image_quality_* scripts.
+
+    Returns:
+        argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Evaluate the quality of the images in the input directory."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip images already recorded in the JSONL output and append to it",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Only evaluate the images recorded in the dead-letter file",
+    )
+    return parser.parse_args()
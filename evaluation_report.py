@@ -1,30 +1,508 @@
+"""
+# Title: Cross-model report of image quality assessment results
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import argparse
+import csv
 import json
-from collections import Counter
+import logging
 import os
+import time
+
+import numpy as np
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+OUTPUT_DIRECTORY = "output/"
+STORE_PATH = "cache/results.npz"
+REPORT_DIRECTORY = "output/report/"
+SCORES = (0, 1, 2)  # valid scores; -1 is a response that could not be parsed
+SCORE_VALUES = (-1,) + SCORES
+MISSING = -2  # no record of the image for the model
+PERCENTILES = (50, 90, 99)
+# Latency columns: the total time, and the request, time to first token and rate
+# limiter stages of the record's timings
+LATENCY_COLUMNS = ("time", "request", "ttft", "queue")
+TOKEN_COLUMNS = ("input_tokens", "output_tokens")
+
+
+class ResultsTable:
+    """
+    Columnar table of result records, one row per image and model.
+
+    Image and model IDs are stored once, and each row refers to them by index, so
+    the scores, latencies and token usage are compact NumPy columns that the report
+    computes over in vectorized form.
+
+    Args:
+        image_ids (np.ndarray): The distinct image IDs.
+        model_ids (np.ndarray): The distinct model IDs.
+        columns (dict): The "image" and "model" index columns, and the "score",
+                        latency and token columns. Missing values are NaN.
+    """
+
+    def __init__(self, image_ids: np.ndarray, model_ids: np.ndarray, columns: dict) -> None:
+        self.image_ids = image_ids
+        self.model_ids = model_ids
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns["score"])
+
+    @classmethod
+    def from_records(cls, records) -> "ResultsTable":
+        """
+        Build the table from result records.
+
+        Args:
+            records (iterable): The result records, with "image_id", "model_id" and
+                                "score" keys, and optionally "time", "timings" and
+                                "usage".
+
+        Returns:
+            ResultsTable: The table.
+        """
+        image_index, model_index = {}, {}
+        rows = {name: [] for name in ("image", "model", "score")}
+        rows.update({name: [] for name in LATENCY_COLUMNS + TOKEN_COLUMNS})
+        nan = float("nan")
+
+        for record in records:
+            rows["image"].append(
+                image_index.setdefault(record["image_id"], len(image_index))
+            )
+            rows["model"].append(
+                model_index.setdefault(record["model_id"], len(model_index))
+            )
+            score = record.get("score")
+            rows["score"].append(score if score in SCORES else -1)
+            timings = record.get("timings") or {}
+            usage = record.get("usage") or {}
+            rows["time"].append(record.get("time", nan))
+            for name in LATENCY_COLUMNS[1:]:
+                rows[name].append(timings.get(name, nan))
+            for name in TOKEN_COLUMNS:
+                value = usage.get(name)
+                rows[name].append(nan if value is None else value)
+
+        columns = {
+            "image": np.array(rows.pop("image"), dtype=np.int32),
+            "model": np.array(rows.pop("model"), dtype=np.int16),
+            "score": np.array(rows.pop("score"), dtype=np.int8),
+        }
+        columns.update(
+            {name: np.array(values, dtype=np.float32) for name, values in rows.items()}
+        )
+        return cls(
+            np.array(list(image_index), dtype=str),
+            np.array(list(model_index), dtype=str),
+            columns,
+        )
+
+    def save(self, path: str, sources: dict) -> None:
+        """
+        Save the table as a NumPy .npz columnar store.
+
+        Args:
+            path (str): The path of the store.
+            sources (dict): The modification time and size of each source file, to
+                            tell when the store is out of date.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp.npz"
+        np.savez(
+            temp_path,
+            image_ids=self.image_ids,
+            model_ids=self.model_ids,
+            sources=np.array(json.dumps(sources, sort_keys=True)),
+            **self.columns,
+        )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str, sources: dict) -> "ResultsTable":
+        """
+        Load the table from a NumPy .npz columnar store, if it is up to date.
+
+        Args:
+            path (str): The path of the store.
+            sources (dict): The modification time and size of each source file.
+
+        Returns:
+            ResultsTable: The table, or None if the store is missing or out of date.
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as store:
+            if str(store["sources"]) != json.dumps(sources, sort_keys=True):
+                return None
+            columns = {
+                name: store[name]
+                for name in store.files
+                if name not in ("image_ids", "model_ids", "sources")
+            }
+            return cls(store["image_ids"], store["model_ids"], columns)
+
+    def matrix(self) -> np.ndarray:
+        """
+        Get the wide image × model score matrix.
+
+        Returns:
+            np.ndarray: The scores (int8), one row per image and one column per model,
+                        MISSING where the model has no record of the image. If an
+                        image was recorded more than once for a model, the last
+                        record wins.
+        """
+        scores = np.full((len(self.image_ids), len(self.model_ids)), MISSING, np.int8)
+        scores[self.columns["image"], self.columns["model"]] = self.columns["score"]
+        return scores
+
+    def score_distribution(self, scores: np.ndarray = None) -> np.ndarray:
+        """
+        Count each score value per model, over the same records as the matrix.
+
+        Args:
+            scores (np.ndarray, optional): The score matrix, if already built.
+
+        Returns:
+            np.ndarray: The counts, one row per model and one column per SCORE_VALUES.
+        """
+        if scores is None:
+            scores = self.matrix()
+        model, image = np.nonzero(scores.T != MISSING)
+        codes = model * len(SCORE_VALUES) + (
+            scores[image, model].astype(np.int64) - SCORE_VALUES[0]
+        )
+        counts = np.bincount(codes, minlength=len(self.model_ids) * len(SCORE_VALUES))
+        return counts.reshape(len(self.model_ids), len(SCORE_VALUES))
+
+    def latency_percentiles(self, column: str, percentiles=PERCENTILES) -> np.ndarray:
+        """
+        Calculate the percentiles of a latency or token column per model.
+
+        Args:
+            column (str): The column, e.g. 'time' or 'ttft'.
+            percentiles (tuple): The percentiles, from 0 to 100.
+
+        Returns:
+            np.ndarray: The percentiles, one row per model, NaN where the model has no
+                        values.
+        """
+        order = np.argsort(self.columns["model"], kind="stable")
+        values = self.columns[column][order]
+        bounds = np.searchsorted(
+            self.columns["model"][order], np.arange(len(self.model_ids) + 1)
+        )
+        result = np.full((len(self.model_ids), len(percentiles)), np.nan)
+        for model in range(len(self.model_ids)):
+            segment = values[bounds[model] : bounds[model + 1]]
+            segment = segment[~np.isnan(segment)]
+            if len(segment):
+                result[model] = np.percentile(segment, percentiles)
+        return result
+
+
+def one_hot(scores: np.ndarray) -> np.ndarray:
+    """
+    Encode a score matrix as one indicator per valid score.
+
+    Args:
+        scores (np.ndarray): The image × model score matrix.
+
+    Returns:
+        np.ndarray: The image × model × score indicators (float64); all zero where the
+                    score is missing or not parsed.
+    """
+    return (scores[:, :, None] == np.array(SCORES, dtype=np.int8)).astype(np.float64)
+
+
+def cohen_kappa(scores: np.ndarray) -> np.ndarray:
+    """
+    Calculate Cohen's kappa for every pair of models, over the images both scored.
+
+    Args:
+        scores (np.ndarray): The image × model score matrix.
+
+    Returns:
+        np.ndarray: The model × model kappa matrix, NaN where a pair has no images in
+                    common or the expected agreement is 1.
+    """
+    images, models = scores.shape
+    indicators = one_hot(scores)
+    valid = indicators.sum(axis=2)
+    # One matrix product counts, for every pair of models, how often each score of
+    # one coincides with each score of the other
+    flat = indicators.reshape(images, models * len(SCORES))
+    joint = (flat.T @ flat).reshape(models, len(SCORES), models, len(SCORES))
+    # Images both models scored, and the images on which they agree
+    common = valid.T @ valid
+    agree = np.einsum("acbc->ab", joint)
+    # Each model's score counts, over the images the other model also scored
+    marginals = joint.sum(axis=3)  # model a × score × model b
+    expected = np.einsum("acb,bca->ab", marginals, marginals)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        observed = agree / common
+        expected = expected / common**2
+        kappa = (observed - expected) / (1 - expected)
+    kappa[(common == 0) | np.isclose(expected, 1)] = np.nan
+    return kappa
+
+
+def fleiss_kappa(scores: np.ndarray) -> tuple:
+    """
+    Calculate Fleiss' kappa across all models, over the images every model scored.
+
+    Args:
+        scores (np.ndarray): The image × model score matrix.
+
+    Returns:
+        tuple: Fleiss' kappa (NaN if it is undefined) and the number of images.
+    """
+    complete = (scores >= 0).all(axis=1)
+    counts = one_hot(scores[complete]).sum(axis=1)  # image × score rater counts
+    images, raters = len(counts), scores.shape[1]
+    if images == 0 or raters < 2:
+        return float("nan"), images
+
+    agreement = ((counts**2).sum(axis=1) - raters) / (raters * (raters - 1))
+    proportions = counts.sum(axis=0) / (images * raters)
+    expected = (proportions**2).sum()
+    if np.isclose(expected, 1):
+        return float("nan"), images
+    return float((agreement.mean() - expected) / (1 - expected)), images
+
+
+def list_sources(directory: str) -> dict:
+    """
+    List the JSON results files in a directory.
+
+    Args:
+        directory (str): The directory of the results files.
+
+    Returns:
+        dict: The modification time and size of each JSON file, by path.
+    """
+    sources = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".json"):
+            path = os.path.join(directory, filename)
+            stat = os.stat(path)
+            sources[path] = [stat.st_mtime_ns, stat.st_size]
+    return sources
+
+
+def read_results(sources: dict):
+    """
+    Read the records of JSON results files.
+
+    Args:
+        sources (dict): The JSON results files, by path.
+
+    Yields:
+        dict: Each result record.
+    """
+    for path in sources:
+        with open(path, "r") as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or "scores" not in data:
+            logging.warning(f"Skipping {path}, not a results file")
+            continue
+        yield from data["scores"]
+
+
+def load_table(
+    directory: str = OUTPUT_DIRECTORY, store_path: str = STORE_PATH, rebuild: bool = False
+) -> ResultsTable:
+    """
+    Load the results of all models, from the columnar store when it is up to date.
+
+    Args:
+        directory (str): The directory of the JSON results files.
+        store_path (str): The path of the columnar store, or None to not use one.
+        rebuild (bool): Rebuild the store from the JSON results files.
+
+    Returns:
+        ResultsTable: The results.
+    """
+    sources = list_sources(directory)
+    if store_path and not rebuild:
+        table = ResultsTable.load(store_path, sources)
+        if table is not None:
+            logging.info(f"Loaded {len(table)} records from {store_path}")
+            return table
+
+    table = ResultsTable.from_records(read_results(sources))
+    logging.info(f"Read {len(table)} records from {len(sources)} results files")
+    if store_path:
+        table.save(store_path, sources)
+    return table
+
+
+def build_report(table: ResultsTable) -> dict:
+    """
+    Compute the cross-model report.
+
+    Args:
+        table (ResultsTable): The results.
+
+    Returns:
+        dict: The "matrix", score "distribution", Cohen's "kappa" matrix, "fleiss"
+              kappa and its number of images, and "percentiles" of each latency and
+              token column.
+    """
+    scores = table.matrix()
+    fleiss, fleiss_images = fleiss_kappa(scores)
+    return {
+        "matrix": scores,
+        "distribution": table.score_distribution(scores),
+        "kappa": cohen_kappa(scores),
+        "fleiss": fleiss,
+        "fleiss_images": fleiss_images,
+        "percentiles": {
+            column: table.latency_percentiles(column)
+            for column in LATENCY_COLUMNS + TOKEN_COLUMNS
+        },
+    }
+
+
+def format_value(value: float) -> str:
+    return "" if np.isnan(value) else f"{value:.4g}"
+
+
+def export_csv(table: ResultsTable, report: dict, directory: str = REPORT_DIRECTORY) -> None:
+    """
+    Write the report as CSV files: scores.csv (the score distribution of each model),
+    matrix.csv (the image × model scores, empty where missing), agreement.csv
+    (Cohen's kappa of each pair of models), and latency.csv (the percentiles of each
+    latency and token column of each model).
+
+    Args:
+        table (ResultsTable): The results.
+        report (dict): The report, as returned by build_report.
+        directory (str): The directory the CSV files are written to.
+    """
+    os.makedirs(directory, exist_ok=True)
+    model_ids = table.model_ids.tolist()
+
+    with open(os.path.join(directory, "scores.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["model_id"] + [f"score_{value}" for value in SCORE_VALUES] + ["total"])
+        for model_id, counts in zip(model_ids, report["distribution"].tolist()):
+            writer.writerow([model_id] + counts + [sum(counts)])
+
+    matrix = report["matrix"].astype(str)
+    matrix[report["matrix"] == MISSING] = ""
+    order = np.argsort(table.image_ids)
+    with open(os.path.join(directory, "matrix.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["image_id"] + model_ids)
+        writer.writerows(
+            np.column_stack([table.image_ids[order], matrix[order]]).tolist()
+        )
+
+    with open(os.path.join(directory, "agreement.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["model_id"] + model_ids)
+        for model_id, row in zip(model_ids, report["kappa"]):
+            writer.writerow([model_id] + [format_value(value) for value in row])
+
+    with open(os.path.join(directory, "latency.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["model_id", "column"] + [f"p{p}" for p in PERCENTILES])
+        for column, values in report["percentiles"].items():
+            for model_id, row in zip(model_ids, values):
+                if not np.isnan(row).all():
+                    writer.writerow(
+                        [model_id, column] + [format_value(value) for value in row]
+                    )
+
+    logging.info(f"Report written to {directory}")
+
+
+def log_report(table: ResultsTable, report: dict) -> None:
+    model_ids = table.model_ids.tolist()
+    width = max([len(model_id) for model_id in model_ids] + [8])
+
+    logging.info(
+        f"Scores ({len(table.image_ids)} images, {len(model_ids)} models):\n"
+        + f"{'model':<{width}} "
+        + " ".join(f"{value:>7}" for value in SCORE_VALUES)
+        + f" {'total':>7}\n"
+        + "\n".join(
+            f"{model_id:<{width}} "
+            + " ".join(f"{count:>7}" for count in counts)
+            + f" {sum(counts):>7}"
+            for model_id, counts in zip(model_ids, report["distribution"].tolist())
+        )
+    )
+
+    logging.info(
+        "Cohen's kappa:\n"
+        + "\n".join(
+            f"{model_id:<{width}} "
+            + " ".join(f"{format_value(value):>6}" for value in row)
+            for model_id, row in zip(model_ids, report["kappa"])
+        )
+    )
+    logging.info(
+        f"Fleiss' kappa: {format_value(report['fleiss'])} "
+        f"over {report['fleiss_images']} images scored by every model"
+    )
+
+    latency = report["percentiles"]["time"]
+    logging.info(
+        "Time (s):\n"
+        + f"{'model':<{width}} "
+        + " ".join(f"{'p' + str(p):>7}" for p in PERCENTILES)
+        + "\n"
+        + "\n".join(
+            f"{model_id:<{width}} "
+            + " ".join(f"{format_value(value):>7}" for value in row)
+            for model_id, row in zip(model_ids, latency)
+        )
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Report the scores, agreement and latency of the models' results."
+    )
+    parser.add_argument("--directory", default=OUTPUT_DIRECTORY)
+    parser.add_argument(
+        "--export",
+        nargs="?",
+        const=REPORT_DIRECTORY,
+        help=f"write the report as CSV files to this directory (default: {REPORT_DIRECTORY})",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="rebuild the columnar store from the JSON results files",
+    )
+    return parser.parse_args()
 
-# Iterate over all JSON files
-for file in sorted(os.listdir("output")):
-    if file.endswith(".json"):
-        file = os.path.join("output", file)
-        file = open(file, "r")
 
-        # Load JSON data
-        print(f"\nReading: {file.name}...")
-        data = json.load(file)
+def main() -> None:
+    args = parse_args()
 
-        # Get count of scores, sorted by count
-        scores = [score["score"] for score in data["scores"]]
-        counter = Counter(scores)
-        sorted_counter = sorted(counter.items())
-        print(f"Scores: {sorted_counter}")
+    table = load_table(args.directory, rebuild=args.rebuild)
+    start = time.perf_counter()
+    report = build_report(table)
+    logging.info(f"Report computed in {time.perf_counter() - start:.3f} seconds")
+    log_report(table, report)
 
-        # Calculate total count
-        total_count = sum(counter.values())
-        print(f"Total count: {total_count}")
+    if args.export:
+        export_csv(table, report, args.export)
 
-        # Scores as list
-        print(scores)
 
-        # Print 1 score per line - easy to paste into Excel to analyze
-        for score in scores:
-            print(score)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+# Title: Evaluate Image Quality with multiple models, loading each image once
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import time
+
+import cassette as recording
+import evaluation_engine
+import image_cache as image_caching
+import instrumentation
+import json_extractor
+import preprocessing_pipeline as preprocessing
+import rate_limiter as rate_limiting
+import response_cache as response_caching
+import results_db
+import results_writer
+import retry_policy as retrying
+import streaming
+import utilities
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+DIRECTORY = "input/"
+
+
+async def run_fan_out(
+    providers: list,
+    directory: str = DIRECTORY,
+    resume: bool = False,
+    retry_failed: bool = False,
+) -> None:
+    """
+    Evaluate all images in a directory with several providers concurrently.
+
+    Each image is read, hashed and decoded once. A payload is built for each distinct
+    maximum size among the providers, then handed to the queue of every provider it
+    is for. Each provider has its own workers, as many as its concurrency limit, and
+    keeps its own rate limiter and retry policy, so a fast provider is not held back
+    by a slow one. Each queue holds as many images as the provider's concurrency
+    limit, which bounds how far a fast provider runs ahead of a slow one, and so the
+    number of images held in memory, to a few times the largest concurrency limit. With
+    IQA_PREPROCESS_PROCESSES, the images are prepared ahead in a process pool instead
+    (see preprocessing_pipeline.py), bounded by IQA_PREFETCH as well.
+    With IQA_PRESCREEN, each image is screened once, and clearly unusable images are
+    scored 0 locally instead of being sent to any provider, and recorded as each
+    provider's results (see prescreen.py).
+
+    Each provider's records are appended to the JSONL file next to its OUTPUT_PATH as
+    they finish, failed images are recorded in its dead-letter file, and its JSON
+    results file is written from the JSONL file at the end.
+
+    Args:
+        providers (list): The provider modules.
+        directory (str): The directory containing the images.
+        resume (bool): Skip the images already recorded in each provider's JSONL file
+                       and append to it, instead of starting over.
+        retry_failed (bool): Only evaluate the images in each provider's dead-letter
+                             file.
+    """
+    all_filenames = evaluation_engine.list_images(directory)
+    selected = {
+        provider.__name__: set(
+            evaluation_engine.select_images(
+                all_filenames, provider.OUTPUT_PATH, resume, retry_failed
+            )
+        )
+        for provider in providers
+    }
+    filenames = [
+        filename
+        for filename in all_filenames
+        if any(filename in names for names in selected.values())
+    ]
+    prescreen = evaluation_engine.create_prescreen()
+    prescreened = {}
+    if prescreen is not None:
+        prescreened = await asyncio.to_thread(
+            prescreen.screen_images, directory, filenames
+        )
+        filenames = [name for name in filenames if name not in prescreened]
+    max_pixels_list = [getattr(provider, "MAX_PIXELS", None) for provider in providers]
+    cassette = recording.create_cassette()
+    replaying = cassette is not None and cassette.mode == recording.REPLAY
+    # Every call is recorded or replayed, so the response cache is not used
+    response_cache = None if cassette else response_caching.create_response_cache()
+    image_cache = image_caching.create_image_cache()
+    span_exporter = instrumentation.create_span_exporter()
+
+    evaluation_engine.reserve_threads(
+        sum(
+            evaluation_engine.get_concurrency(provider.MAX_CONCURRENCY)
+            for provider in providers
+        )
+    )
+
+    async with contextlib.AsyncExitStack() as stack:
+        dispatchers = []
+        workers = 1
+        for provider in providers:
+            rate_limiter = rate_limiting.create_rate_limiter(
+                provider.REQUESTS_PER_MINUTE, provider.TOKENS_PER_MINUTE
+            )
+            concurrency = evaluation_engine.get_concurrency(provider.MAX_CONCURRENCY)
+            dispatchers.append(
+                {
+                    "provider": provider,
+                    "options": evaluation_engine.provider_options(provider),
+                    "writer": stack.enter_context(
+                        results_writer.JsonlResultWriter(
+                            results_writer.jsonl_path(provider.OUTPUT_PATH),
+                            append=resume or retry_failed,
+                        )
+                    ),
+                    "dead_letter": stack.enter_context(
+                        results_writer.JsonlResultWriter(
+                            results_writer.dead_letter_path(provider.OUTPUT_PATH),
+                            append=resume,
+                        )
+                    ),
+                    # Replayed calls are not paced
+                    "rate_limiter": None if replaying else rate_limiter,
+                    "retry_policy": retrying.create_retry_policy(
+                        getattr(provider, "RETRYABLE_ERRORS", ())
+                    ),
+                    "concurrency": concurrency,
+                    "queue": asyncio.Queue(maxsize=concurrency),
+                    "invoke_model": await stack.enter_async_context(
+                        recording.open_invoker(provider, rate_limiter, cassette)
+                    ),
+                }
+            )
+            workers = max(workers, concurrency)
+
+        for dispatcher in dispatchers:
+            names = selected[dispatcher["provider"].__name__]
+            evaluation_engine.write_prescreened(
+                {name: result for name, result in prescreened.items() if name in names},
+                dispatcher["writer"],
+                dispatcher["provider"],
+            )
+
+        async def dispatch(dispatcher, filename, variants, file_format, sha, trace):
+            options = dispatcher["options"]
+            record = await evaluation_engine.evaluate_image(
+                filename,
+                dispatcher["invoke_model"],
+                directory,
+                rate_limiter=dispatcher["rate_limiter"],
+                response_cache=response_cache,
+                image_sha256=sha,
+                payload=(variants[options["max_pixels"]], file_format),
+                retry_policy=dispatcher["retry_policy"],
+                dead_letter=dispatcher["dead_letter"],
+                trace=trace,
+                **options,
+            )
+            if span_exporter is not None:
+                span_exporter.export(trace, filename, options["model_id"], record)
+            if record is not None:
+                dispatcher["writer"].write(record)
+
+        queue = asyncio.Queue()
+        for filename in filenames:
+            queue.put_nowait(filename)
+
+        pipeline = preprocessing.create_pipeline(
+            directory, filenames, max_pixels_list, image_cache
+        )
+        if pipeline is not None:
+            await stack.enter_async_context(pipeline)
+
+        async def next_image() -> tuple:
+            """Take the next image and prepare its payloads, or take them prepared."""
+            if pipeline is not None:
+                return await pipeline.get()
+            if queue.empty():
+                return None
+
+            filename = queue.get_nowait()
+            trace = instrumentation.start_trace()
+            try:
+                prepared = await asyncio.to_thread(
+                    utilities.prepare_variants,
+                    os.path.join(directory, filename),
+                    max_pixels_list,
+                    image_cache,
+                )
+            except Exception as e:
+                prepared = e
+            return filename, prepared, trace
+
+        async def load() -> None:
+            """Prepare images and hand each to the queues of the providers it is for."""
+            while True:
+                image = await next_image()
+                if image is None:
+                    return
+                filename, prepared, trace = image
+                targets = [
+                    dispatcher
+                    for dispatcher in dispatchers
+                    if filename in selected[dispatcher["provider"].__name__]
+                ]
+                if isinstance(prepared, Exception):
+                    logging.error(f"Error processing {filename}: {prepared}")
+                    for dispatcher in targets:
+                        evaluation_engine.record_failure(
+                            dispatcher["dead_letter"],
+                            filename,
+                            dispatcher["options"]["model_id"],
+                            retrying.FATAL,
+                            prepared,
+                            0,
+                        )
+                    continue
+
+                variants, file_format, sha = prepared
+                queued_ns = time.time_ns()
+                await asyncio.gather(
+                    *(
+                        dispatcher["queue"].put(
+                            (
+                                filename,
+                                variants,
+                                file_format,
+                                sha,
+                                # Each model's trace starts with the preprocessing of
+                                # its payload variant
+                                trace.copy(dispatcher["options"]["max_pixels"]),
+                                queued_ns,
+                            )
+                        )
+                        for dispatcher in targets
+                    )
+                )
+
+        async def load_all() -> None:
+            await asyncio.gather(*(load() for _ in range(min(workers, len(filenames)))))
+            # Then stop each provider's workers once its queue is drained
+            for dispatcher in dispatchers:
+                for _ in range(dispatcher["concurrency"]):
+                    await dispatcher["queue"].put(None)
+
+        async def worker(dispatcher) -> None:
+            """Evaluate the images in a provider's queue, at the provider's own pace."""
+            while True:
+                item = await dispatcher["queue"].get()
+                if item is None:
+                    return
+                filename, variants, file_format, sha, trace, queued_ns = item
+                trace.add_span("dispatch", queued_ns, time.time_ns())
+                await dispatch(dispatcher, filename, variants, file_format, sha, trace)
+
+        logging.info(
+            f"Evaluating {len(filenames)} images with {len(providers)} models, "
+            f"{workers} images in flight"
+        )
+        await asyncio.gather(
+            load_all(),
+            *(
+                worker(dispatcher)
+                for dispatcher in dispatchers
+                for _ in range(dispatcher["concurrency"])
+            ),
+        )
+
+    if response_cache is not None:
+        response_cache.log_stats()
+    if image_cache is not None:
+        image_cache.log_stats()
+    json_extractor.log_parse_stats()
+    streaming.log_stream_stats()
+    if span_exporter is not None:
+        span_exporter.close()
+    if cassette is not None:
+        cassette.log_stats()
+        cassette.close()
+
+    for dispatcher in dispatchers:
+        provider = dispatcher["provider"]
+        if dispatcher["dead_letter"].count:
+            logging.warning(
+                f"{dispatcher['dead_letter'].count} images failed for {provider.MODEL_ID}, "
+                f"see {dispatcher['dead_letter'].path}"
+            )
+        results_writer.export_scores(
+            results_writer.jsonl_path(provider.OUTPUT_PATH), provider.OUTPUT_PATH
+        )
+    results_db.import_results(
+        [dispatcher["provider"].OUTPUT_PATH for dispatcher in dispatchers]
+    )
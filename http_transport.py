@@ -0,0 +1,209 @@
+"""
+# Title: Pooled keep-alive HTTP transport for raw HTTP model providers
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import streaming
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+DEFAULT_POOL_SIZE = 4  # connections per host
+CONNECT_TIMEOUT = 10  # seconds
+READ_TIMEOUT = 300  # seconds
+
+
+class HttpTransport:
+    """
+    Shared HTTP client that keeps connections to each host alive across requests.
+
+    By default, a requests Session with a connection pool per host is used, and each
+    request runs in a worker thread. With `http2`, an httpx AsyncClient multiplexes
+    the requests over HTTP/2 connections instead; this needs the optional
+    `httpx[http2]` package, and falls back to the requests Session without it.
+
+    Either way, the TCP and TLS handshakes are paid once per connection rather than
+    once per request. The responses of both clients provide status_code, headers,
+    text, json() and raise_for_status().
+
+    A request body built by payload_builder is passed as `content`. The requests
+    Session sends the buffer as-is; httpx needs it copied to bytes first.
+
+    Args:
+        pool_size (int): The maximum number of connections to each host.
+        http2 (bool): Use HTTP/2 when httpx is installed.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, http2: bool = False) -> None:
+        self.pool_size = max(1, pool_size)
+        self.client = None
+        self.session = None
+
+        if http2:
+            try:
+                import httpx
+
+                self.client = httpx.AsyncClient(
+                    http2=True,
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size,
+                        max_keepalive_connections=self.pool_size,
+                    ),
+                    timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                )
+            except ImportError:
+                logging.warning(
+                    "HTTP/2 needs the httpx[http2] package. Using HTTP/1.1 keep-alive."
+                )
+
+        if self.client is None:
+            # Block rather than open extra, unpooled connections when the pool is busy
+            adapter = HTTPAdapter(
+                pool_connections=self.pool_size,
+                pool_maxsize=self.pool_size,
+                pool_block=True,
+            )
+            self.session = requests.Session()
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+
+        logging.info(
+            f"HTTP transport: {'HTTP/2' if self.client else 'HTTP/1.1 keep-alive'}, "
+            f"{self.pool_size} connections per host"
+        )
+
+    def body_options(self, content) -> dict:
+        """
+        Get the request options that send a prebuilt request body.
+
+        Args:
+            content (bytes-like): The request body, or None.
+
+        Returns:
+            dict: The request options for the client in use.
+        """
+        if content is None:
+            return {}
+        if self.client is not None:
+            return {"content": bytes(content)}
+        # urllib3 sends a bytes-like body through a memoryview, without copying it
+        return {"data": content}
+
+    async def post(self, url: str, content=None, **kwargs):
+        """
+        Send a POST request over a pooled connection.
+
+        Args:
+            url (str): The request URL.
+            content (bytes-like, optional): The request body, e.g. built by
+                                            payload_builder.
+            **kwargs: The request options, e.g. headers and json.
+
+        Returns:
+            requests.Response or httpx.Response: The response.
+        """
+        kwargs.update(self.body_options(content))
+        if self.client is not None:
+            return await self.client.post(url, **kwargs)
+
+        # requests is synchronous, so run it in a worker thread
+        return await asyncio.to_thread(
+            self.session.post, url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs
+        )
+
+    @contextlib.asynccontextmanager
+    async def stream(self, url: str, content=None, **kwargs):
+        """
+        Send a POST request over a pooled connection and stream the response body.
+
+        Leaving the context before the body is fully read closes the connection, which
+        cancels the rest of a streamed model response; the pool opens a new one for
+        the next request.
+
+        Args:
+            url (str): The request URL.
+            content (bytes-like, optional): The request body, e.g. built by
+                                            payload_builder.
+            **kwargs: The request options, e.g. headers and json.
+
+        Yields:
+            tuple: The response, and an async iterator of the lines of the body.
+        """
+        kwargs.update(self.body_options(content))
+        if self.client is not None:
+            async with self.client.stream("POST", url, **kwargs) as response:
+                if response.is_error:
+                    await response.aread()  # load the error body for the exception
+                yield response, response.aiter_lines()
+            return
+
+        response = await asyncio.to_thread(
+            self.session.post,
+            url,
+            stream=True,
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+            **kwargs,
+        )
+        # Event streams are UTF-8, but requests assumes ISO-8859-1 for text/* without
+        # a charset
+        response.encoding = "utf-8"
+        try:
+            if not response.ok:
+                # Load the error body for the exception, e.g. to detect an unsupported
+                # structured output setting
+                await asyncio.to_thread(getattr, response, "content")
+            lines = response.iter_lines(decode_unicode=True)
+            yield response, streaming.iterate_in_thread(lines)
+        finally:
+            response.close()
+
+    async def close(self) -> None:
+        """Close all pooled connections."""
+        if self.client is not None:
+            await self.client.aclose()
+        if self.session is not None:
+            self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+def create_transport(default_pool_size: int = DEFAULT_POOL_SIZE) -> HttpTransport:
+    """
+    Create the HTTP transport from environment variables.
+
+    IQA_HTTP_POOL_SIZE sets the maximum number of connections to each host, and
+    IQA_HTTP2=1 enables HTTP/2.
+
+    Args:
+        default_pool_size (int): The default pool size, usually the provider's
+                                 concurrency limit.
+
+    Returns:
+        HttpTransport: The HTTP transport.
+    """
+    try:
+        pool_size = int(os.environ.get("IQA_HTTP_POOL_SIZE", default_pool_size))
+    except ValueError:
+        logging.error("Invalid IQA_HTTP_POOL_SIZE value. Using default.")
+        pool_size = default_pool_size
+
+    http2 = os.environ.get("IQA_HTTP2", "").lower() in ("1", "true", "yes", "on")
+
+    return HttpTransport(pool_size, http2)
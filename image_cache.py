@@ -0,0 +1,199 @@
+"""
+# Title: Persistent cache of preprocessed image payloads for image quality assessments
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import Counter
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+DEFAULT_CACHE_DIRECTORY = "cache/images"
+DEFAULT_MAX_MB = 2048
+# Eviction frees space down to this fraction of the size limit, so the cache is not
+# rescanned on every write once it is full
+EVICT_TO_FRACTION = 0.9
+
+
+def make_key(source_sha256: str, max_pixels: int, file_format: str, quality: int) -> str:
+    """
+    Build the cache key for a preprocessed image variant.
+
+    Args:
+        source_sha256 (str): The SHA-256 digest of the source image file.
+        max_pixels (int): The maximum number of pixels for the largest dimension.
+        file_format (str): The output format (e.g., 'jpeg', 'png').
+        quality (int): The output encoder quality.
+
+    Returns:
+        str: The hexadecimal cache key.
+    """
+    fields = json.dumps([source_sha256, max_pixels, file_format.lower(), quality])
+    return hashlib.sha256(fields.encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+    """
+    Disk cache of resized and encoded image payloads, evicted least recently used.
+
+    Each variant is stored as a file under a two-character shard directory. A cache
+    hit refreshes the file's modification time, and when the total size exceeds
+    `max_mb` the files with the oldest modification times are removed first, until it
+    is back under EVICT_TO_FRACTION of the limit.
+
+    Args:
+        directory (str): The cache directory.
+        max_mb (float): The maximum total size of the cached payloads, in megabytes.
+    """
+
+    def __init__(
+        self, directory: str = DEFAULT_CACHE_DIRECTORY, max_mb: float = DEFAULT_MAX_MB
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.stats = Counter(hits=0, misses=0, writes=0, evictions=0)
+        self.lock = threading.Lock()
+        self.total_bytes = sum(size for _, _, size in self.scan())
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def scan(self) -> list:
+        """Return (modified time, path, size) for every cached payload."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def get(self, key: str) -> bytes:
+        """
+        Look up a preprocessed payload.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            bytes: The cached payload, or None on a cache miss.
+        """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                payload = f.read()
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            with self.lock:
+                self.stats["misses"] += 1
+            return None
+
+        with self.lock:
+            self.stats["hits"] += 1
+        return payload
+
+    def put(self, key: str, payload: bytes) -> None:
+        """
+        Store a preprocessed payload, evicting old payloads if over the size limit.
+
+        Args:
+            key (str): The cache key.
+            payload (bytes): The resized and encoded image bytes.
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first, so readers never see a partial payload
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(payload)
+
+        with self.lock:
+            # A payload replacing one already cached only adds the difference in size
+            try:
+                replaced_bytes = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced_bytes = 0
+            os.replace(temp_path, path)
+            self.stats["writes"] += 1
+            self.total_bytes += len(payload) - replaced_bytes
+            evict = self.total_bytes > self.max_bytes
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used payloads until the cache is back under
+        EVICT_TO_FRACTION of its size limit.
+
+        Returns:
+            int: The number of payloads removed.
+        """
+        with self.lock:
+            entries = sorted(self.scan())
+            total = sum(size for _, _, size in entries)
+            target = self.max_bytes * EVICT_TO_FRACTION
+            removed = 0
+            for _, path, size in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            self.total_bytes = total
+            self.stats["evictions"] += removed
+
+        if removed:
+            logging.info(f"Evicted {removed} cached image payloads")
+        return removed
+
+    def log_stats(self) -> None:
+        """Log the cache hit and miss statistics."""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups if lookups else 0
+        logging.info(
+            f"Image cache: {self.stats['hits']} hits, {self.stats['misses']} misses "
+            f"({hit_rate:.0%} hit rate), {self.stats['writes']} writes, "
+            f"{self.stats['evictions']} evictions, {self.total_bytes / 1024 / 1024:.1f} MB"
+        )
+
+
+def create_image_cache() -> ImageCache:
+    """
+    Create the image cache from environment variables.
+
+    IQA_IMAGE_CACHE sets the cache directory, or disables the cache when set to
+    "off". IQA_IMAGE_CACHE_MAX_MB sets the size limit.
+
+    Returns:
+        ImageCache: The image cache, or None if it is disabled.
+    """
+    directory = os.environ.get("IQA_IMAGE_CACHE", DEFAULT_CACHE_DIRECTORY)
+    if directory.lower() in ("off", "false", "0", "none"):
+        logging.info("Image cache disabled")
+        return None
+
+    try:
+        max_mb = float(os.environ.get("IQA_IMAGE_CACHE_MAX_MB", DEFAULT_MAX_MB))
+    except ValueError:
+        logging.error("Invalid IQA_IMAGE_CACHE_MAX_MB value. Using default.")
+        max_mb = DEFAULT_MAX_MB
+
+    return ImageCache(directory, max_mb)
@@ -4,16 +4,23 @@
 # Date: 2024-10-19
 """
 
+import asyncio
+import contextlib
+import functools
 import json
 import logging
 import os
-import time
+import sys
 
-from anthropic import Anthropic
+from anthropic import AsyncAnthropic
 from dotenv import load_dotenv
-from PIL import Image
 
-import utilities
+import evaluation_engine
+import instrumentation
+import payload_builder
+import rate_limiter as rate_limiting
+import streaming
+import structured_output
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -27,6 +34,11 @@ MODEL_ID = "claude-3-5-sonnet-20241022"
 DIRECTORY = "input/"
 TEMPERATURE = 0
 MAX_TOKENS = 512
+MAX_PIXELS = 1568  # max. 1568 pixels longest side
+MAX_CONCURRENCY = 4
+REQUESTS_PER_MINUTE = 50  # default quota, override with IQA_REQUESTS_PER_MINUTE
+TOKENS_PER_MINUTE = 40_000  # default quota, override with IQA_TOKENS_PER_MINUTE
+OUTPUT_PATH = f"output/image_quality_anthropic_{MODEL_ID}.json"
 
 # Read the system prompt from a file
 SYSTEM_PROMPT = open("prompts/image_quality_system_prompt.txt", "r").read()
@@ -35,95 +47,139 @@ SYSTEM_PROMPT = open("prompts/image_quality_system_prompt.txt", "r").read()
 USER_PROMPT = open("prompts/image_quality_user_prompt.txt", "r").read()
 
 
-def main() -> None:
+async def invoke_model(
+    client: AsyncAnthropic,
+    stream: bool,
+    rate_limiter: rate_limiting.RateLimiter,
+    output_modes: structured_output.OutputModes,
+    image_bytes: bytes,
+    file_format: str,
+) -> str:
+    image_base64 = payload_builder.encode_base64(image_bytes)
+
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": f"image/{file_format}",
+                        "data": image_base64,
+                    },
+                },
+                {
+                    "type": "text",
+                    "text": USER_PROMPT,
+                },
+            ],
+        },
+    ]
+
+    system_messages = SYSTEM_PROMPT
+
+    async def send(mode: str) -> str:
+        # Forcing a call to the result tool constrains the output to its schema
+        options = {}
+        if mode == "tool":
+            options = {
+                "tools": [
+                    {
+                        "name": structured_output.TOOL_NAME,
+                        "description": structured_output.TOOL_DESCRIPTION,
+                        "input_schema": structured_output.RESULT_SCHEMA,
+                    }
+                ],
+                "tool_choice": {"type": "tool", "name": structured_output.TOOL_NAME},
+            }
+
+        if stream:
+            return await send_stream(options)
+
+        # Send request to Anthropic; the raw response exposes the rate-limit headers
+        raw_response = await client.messages.with_raw_response.create(
+            model=MODEL_ID,
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS,
+            messages=messages,
+            system=system_messages,
+            **options,
+        )
+        rate_limiter.update_from_headers(raw_response.headers)
+        response = raw_response.parse()
+        instrumentation.record_usage(
+            response.usage.input_tokens, response.usage.output_tokens
+        )
+
+        for block in response.content:
+            if block.type == "tool_use":
+                return json.dumps(block.input)
+        return response.content[0].text.strip()
+
+    async def send_stream(options: dict) -> str:
+        # Stream the response, and stop reading once the result object is complete;
+        # leaving the stream context closes the connection, cancelling the generation
+        collector = streaming.StreamCollector()
+        async with client.messages.stream(
+            model=MODEL_ID,
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS,
+            messages=messages,
+            system=system_messages,
+            **options,
+        ) as message_stream:
+            rate_limiter.update_from_headers(message_stream.response.headers)
+            async for event in message_stream:
+                if event.type != "content_block_delta":
+                    continue
+                delta = event.delta
+                chunk = getattr(delta, "text", None) or getattr(
+                    delta, "partial_json", None
+                )
+                if collector.feed(chunk):
+                    break
+            # The output tokens are only final once the stream was read to the end
+            usage = message_stream.current_message_snapshot.usage
+            instrumentation.record_usage(
+                usage.input_tokens, None if collector.done else usage.output_tokens
+            )
+        return collector.finish()
+
+    return await output_modes.invoke(send)
+
+
+@contextlib.asynccontextmanager
+async def open_invoker(rate_limiter: rate_limiting.RateLimiter):
     load_dotenv()
 
     # Retrieve the API key from environment variables
     api_key = os.environ["ANTHROPIC_API_KEY"]
 
-    # Initialize the Mistral client
-    client = Anthropic(api_key=api_key)
-
-    # Initialize the scores dictionary
-    scores = {"scores": []}
+    # Initialize the Anthropic client; throttling is handled by the rate limiter
+    async with AsyncAnthropic(
+        api_key=api_key,
+        base_url=evaluation_engine.get_endpoint_url(),
+        max_retries=0,
+    ) as client:
+        output_modes = structured_output.OutputModes(["tool", "prompt"], MODEL_ID)
+        yield functools.partial(
+            invoke_model,
+            client,
+            streaming.stream_enabled(),
+            rate_limiter,
+            output_modes,
+        )
 
-    # Iterate over all combined images in the directory
-    for filename in sorted(os.listdir(DIRECTORY)):
-        t0 = time.time()
 
-        logging.info(f"Evaluation for {filename}")
-
-        if filename.endswith((".jpeg", ".jpg", ".png")):
-            image_path = os.path.join(DIRECTORY, filename)
-            image = Image.open(image_path)
-            file_format = "jpeg" if image.format.lower() in ["jpg", "jpeg"] else "png"
-            image_resize = utilities.resize_image(
-                image, 1568
-            )  # max. 1568 pixels longest side
-            image_base64 = utilities.image_to_base64(image_resize, file_format)
+def main() -> None:
+    args = evaluation_engine.parse_args()
 
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": f"image/{file_format}",
-                                "data": image_base64,
-                            },
-                        },
-                        {
-                            "type": "text",
-                            "text": USER_PROMPT,
-                        },
-                    ],
-                },
-            ]
-
-            system_messages = SYSTEM_PROMPT
-
-            # Send request to Anthropic
-            try:
-                response = client.messages.create(
-                    model=MODEL_ID,
-                    temperature=TEMPERATURE,
-                    max_tokens=MAX_TOKENS,
-                    messages=messages,
-                    system=system_messages,
-                )
-            except Exception as e:
-                logging.error(f"Error processing {filename}: {e}")
-                continue
-
-            response_text = response.content[0].text.strip()
-            logging.debug(f"Raw response: {response_text}")
-
-            # Calculate time taken
-            t1 = time.time()
-            tt = round(t1 - t0, 2)
-            logging.debug(f"Processed {filename} in {tt:.2f} seconds")
-
-            result = utilities.truncate(response_text)
-            result["image_id"] = filename
-            result["model_id"] = MODEL_ID
-            result["temperature"] = TEMPERATURE
-            result["max_tokens"] = MAX_TOKENS
-            result["time"] = tt
-            scores["scores"].append(result)
-
-    logging.info(json.dumps(scores, indent=2))
-
-    # Count the scores
-    logging.info(f"Scores: {utilities.count_scores(scores)}")
-
-    # Write the JSON results to a file
-    try:
-        with open(f"output/image_quality_anthropic_{MODEL_ID}.json", "w") as f:
-            f.write(json.dumps(scores, indent=2))
-    except Exception as e:
-        logging.error(f"Error writing results to file: {e}")
+    asyncio.run(
+        evaluation_engine.evaluate_provider(
+            sys.modules[__name__], resume=args.resume, retry_failed=args.retry_failed
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -4,16 +4,22 @@
 # Date: 2024-10-20
 """
 
-import json
+import asyncio
+import contextlib
+import functools
 import logging
 import os
-import time
+import sys
 
-import requests
 from dotenv import load_dotenv
-from PIL import Image
 
-import utilities
+import evaluation_engine
+import instrumentation
+import http_transport
+import payload_builder
+import rate_limiter as rate_limiting
+import streaming
+import structured_output
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -27,7 +33,14 @@ DIRECTORY = "input/"
 TEMPERATURE = 0
 MAX_TOKENS = 512
 TOP_P = 0.95
+MAX_PIXELS = None  # not resized
+MAX_CONCURRENCY = 4
+REQUESTS_PER_MINUTE = 60  # default quota, override with IQA_REQUESTS_PER_MINUTE
+# Not limited by default, as deployment quotas vary; 429s and the x-ratelimit-*
+# headers govern. Set IQA_TOKENS_PER_MINUTE to the deployment quota to pace ahead
+TOKENS_PER_MINUTE = None
 
+OUTPUT_PATH = f"output/image_quality_azure_{MODEL_ID}.json"
 
 # Read the system prompt from a file
 SYSTEM_PROMPT = open("prompts/image_quality_system_prompt.txt", "r").read()
@@ -52,100 +65,122 @@ def retrieve_env_vars() -> tuple:
     return api_key, endpoint
 
 
-def main() -> None:
-    api_key, endpoint = retrieve_env_vars()
-
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": api_key,
-    }
-
-    # Initialize the scores dictionary
-    scores = {"scores": []}
-
-    # Iterate over all combined images in the directory
-    for filename in sorted(os.listdir(DIRECTORY)):
-        t0 = time.time()
-
-        logging.info(f"Evaluation for {filename}")
-
-        if filename.endswith((".jpeg", ".jpg", ".png")):
-            image_path = os.path.join(DIRECTORY, filename)
-            image = Image.open(image_path)
-            file_format = "jpeg" if image.format.lower() in ["jpg", "jpeg"] else "png"
-            image_base64 = utilities.image_to_base64(image, file_format)
-
-            messages = [
+async def invoke_model(
+    transport: http_transport.HttpTransport,
+    endpoint: str,
+    headers: dict,
+    stream: bool,
+    rate_limiter: rate_limiting.RateLimiter,
+    output_modes: structured_output.OutputModes,
+    image_bytes: bytes,
+    file_format: str,
+) -> str:
+    # The image is encoded into the request body when it is built
+    image_url = f"data:image/jpeg;base64,{payload_builder.IMAGE_PLACEHOLDER}"
+    messages = [
+        {
+            "role": "system",
+            "content": [
                 {
-                    "role": "system",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": SYSTEM_PROMPT,
-                        }
-                    ],
-                },
+                    "type": "text",
+                    "text": SYSTEM_PROMPT,
+                }
+            ],
+        },
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": USER_PROMPT},
                 {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": USER_PROMPT},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
-                            },
-                        },
-                    ],
+                    "type": "image_url",
+                    "image_url": {"url": image_url},
+                },
+            ],
+        },
+    ]
+
+    async def send(mode: str) -> str:
+        # Payload for the request
+        payload = {
+            "messages": messages,
+            "temperature": TEMPERATURE,
+            "max_tokens": MAX_TOKENS,
+            "top_p": TOP_P,
+        }
+        if mode == "json_schema":
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "image_quality",
+                    "strict": True,
+                    "schema": structured_output.RESULT_SCHEMA,
                 },
-            ]
-
-            # Payload for the request
-            payload = {
-                "messages": messages,
-                "temperature": TEMPERATURE,
-                "max_tokens": MAX_TOKENS,
-                "top_p": TOP_P,
             }
+        elif mode == "json_object":
+            payload["response_format"] = {"type": "json_object"}
+
+        if stream:
+            # Stream the response, and stop reading once the result object is complete
+            payload["stream"] = True
+            collector = streaming.StreamCollector()
+            body = payload_builder.build_json_body(payload, image_bytes)
+            async with transport.stream(
+                endpoint, headers=headers, content=body
+            ) as (response, lines):
+                response.raise_for_status()
+                rate_limiter.update_from_headers(response.headers)
+                return await streaming.collect_chat_completion_stream(lines, collector)
+
+        # Send request to Azure over a pooled keep-alive connection
+        body = payload_builder.build_json_body(payload, image_bytes)
+        response = await transport.post(endpoint, headers=headers, content=body)
+        response.raise_for_status()  # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
+        rate_limiter.update_from_headers(response.headers)
+        body = response.json()
+        usage = body.get("usage", {})
+        instrumentation.record_usage(
+            usage.get("prompt_tokens"), usage.get("completion_tokens")
+        )
+        return body["choices"][0]["message"]["content"]
 
-            # Send request to Bedrock
-            try:
-                response = requests.post(endpoint, headers=headers, json=payload)
-                response.raise_for_status()  # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
-            except Exception as e:
-                logging.error(f"Error processing {filename}: {e}")
-                continue
+    # Structured outputs need a recent model version; older ones fall back to JSON mode
+    return await output_modes.invoke(send)
 
-            response_text = (response.json())["choices"][0]["message"]["content"]
-            logging.debug(f"Raw response: {response_text}")
 
-            # Calculate time taken
-            t1 = time.time()
-            tt = round(t1 - t0, 2)
-            logging.debug(f"Processed {filename} in {tt:.2f} seconds")
+@contextlib.asynccontextmanager
+async def open_invoker(rate_limiter: rate_limiting.RateLimiter):
+    api_key, endpoint = retrieve_env_vars()
+    endpoint = evaluation_engine.get_endpoint_url(endpoint)
 
-            result = utilities.truncate(response_text)
-            result["image_id"] = filename
-            result["model_id"] = MODEL_ID
-            result["temperature"] = TEMPERATURE
-            result["max_tokens"] = MAX_TOKENS
-            result["time"] = tt
-            scores["scores"].append(result)
+    headers = {
+        "Content-Type": "application/json",
+        "api-key": api_key,
+    }
 
-            # Sleep for n seconds to avoid rate limiting
-            logging.info("Sleeping for 15 seconds...")
-            time.sleep(15)
+    pool_size = evaluation_engine.get_concurrency(MAX_CONCURRENCY)
+    async with http_transport.create_transport(pool_size) as transport:
+        output_modes = structured_output.OutputModes(
+            ["json_schema", "json_object", "prompt"], MODEL_ID
+        )
+        yield functools.partial(
+            invoke_model,
+            transport,
+            endpoint,
+            headers,
+            streaming.stream_enabled(),
+            rate_limiter,
+            output_modes,
+        )
 
-    logging.info(json.dumps(scores, indent=2))
 
-    # Count the scores
-    logging.info(f"Scores: {utilities.count_scores(scores)}")
+def main() -> None:
+    args = evaluation_engine.parse_args()
 
-    # Write the JSON results to a file
-    try:
-        with open(f"output/image_quality_azure_{MODEL_ID}.json", "w") as f:
-            f.write(json.dumps(scores, indent=2))
-    except Exception as e:
-        logging.error(f"Error writing results to file: {e}")
+    asyncio.run(
+        evaluation_engine.evaluate_provider(
+            sys.modules[__name__], resume=args.resume, retry_failed=args.retry_failed
+        )
+    )
 
 
 if __name__ == "__main__":
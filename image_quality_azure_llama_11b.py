@@ -5,7 +5,7 @@
 """
 DESCRIPTION:
     This sample demonstrates how to get a chat completions response from
-    the service using a synchronous client. The sample shows how to load
+    the service using an asynchronous client. The sample shows how to load
     an image from a file and include it in the input chat messages.
     This sample will only work on AI models that support image input.
     Only these AI models accept the array form of `content` in the
@@ -29,23 +29,33 @@ USAGE:
         request header `azureml-model-deployment`.
 """
 
-import json
+import asyncio
+import contextlib
+import functools
 import logging
 import os
-import time
+import sys
 
-from azure.ai.inference import ChatCompletionsClient
+from azure.ai.inference.aio import ChatCompletionsClient
 from azure.core.credentials import AzureKeyCredential
 from dotenv import load_dotenv
-from PIL import Image
 
-import utilities
+import evaluation_engine
+import instrumentation
+import payload_builder
+import rate_limiter as rate_limiting
+import streaming
 
 # Constants
 MODEL_ID = "llama-3-2-11b-vision-instruct"
 DIRECTORY = "input/"
 TEMPERATURE = 0
 MAX_TOKENS = 512
+MAX_PIXELS = None  # not resized
+MAX_CONCURRENCY = 4
+REQUESTS_PER_MINUTE = 60  # default quota, override with IQA_REQUESTS_PER_MINUTE
+TOKENS_PER_MINUTE = 200_000  # default quota, override with IQA_TOKENS_PER_MINUTE
+OUTPUT_PATH = f"output/image_quality_azure_{MODEL_ID}.json"
 
 # Read the system prompt from a file
 SYSTEM_PROMPT = open("prompts/image_quality_system_prompt.txt", "r").read()
@@ -78,103 +88,95 @@ def retrieve_env_vars() -> tuple:
     return endpoint, key, model_deployment
 
 
-def main() -> None:
+async def invoke_model(
+    client: ChatCompletionsClient,
+    stream: bool,
+    rate_limiter: rate_limiting.RateLimiter,
+    image_bytes: bytes,
+    file_format: str,
+) -> str:
+    image_url = payload_builder.data_url(image_bytes, "jpeg")
+
+    messages = [
+        {
+            "role": "system",
+            "content": [
+                {
+                    "type": "text",
+                    "text": SYSTEM_PROMPT,
+                }
+            ],
+        },
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": USER_PROMPT},
+                {
+                    "type": "image_url",
+                    "image_url": {"url": image_url},
+                },
+            ],
+        },
+    ]
+
+    # Payload for the request
+    payload = {
+        "messages": messages,
+        "temperature": TEMPERATURE,
+        "max_tokens": MAX_TOKENS,
+    }
+
+    if stream:
+        payload["stream"] = True
+    collector = streaming.StreamCollector() if stream else None
+
+    # Send request to Azure AI Chat
+    response = await client.complete(
+        payload,
+        raw_response_hook=lambda pipeline_response: rate_limiter.update_from_headers(
+            pipeline_response.http_response.headers
+        ),
+    )
+
+    if stream:
+        # Stop reading once the result object is complete
+        return await streaming.collect_chat_completion_updates(response, collector)
+
+    if response.usage:
+        instrumentation.record_usage(
+            response.usage.prompt_tokens, response.usage.completion_tokens
+        )
+
+    return response.choices[0].message.content.strip()
+
+
+@contextlib.asynccontextmanager
+async def open_invoker(rate_limiter: rate_limiting.RateLimiter):
     # Retrieve the values from environment variables
     endpoint, key, model_deployment = retrieve_env_vars()
 
-    # Initialize the client
-    client = ChatCompletionsClient(
-        endpoint=endpoint,
+    # Initialize the client; throttling is handled by the rate limiter
+    async with ChatCompletionsClient(
+        endpoint=evaluation_engine.get_endpoint_url(endpoint),
         temperature=TEMPERATURE,
         max_tokens=MAX_TOKENS,
         credential=AzureKeyCredential(key),
         headers={"azureml-model-deployment": model_deployment},
-    )
-
-    # Initialize the scores dictionary
-    scores = {"scores": []}
-
-    # Iterate over all combined images in the directory
-    for filename in sorted(os.listdir(DIRECTORY)):
-        t0 = time.time()
+        retry_total=0,
+    ) as client:
+        yield functools.partial(
+            invoke_model, client, streaming.stream_enabled(), rate_limiter
+        )
 
-        logging.info(f"Evaluation for {filename}")
 
-        if filename.endswith((".jpeg", ".jpg", ".png")):
-            image_path = os.path.join(DIRECTORY, filename)
-            image = Image.open(image_path)
-            file_format = "jpeg" if image.format.lower() in ["jpg", "jpeg"] else "png"
-            image_base64 = utilities.image_to_base64(image, file_format)
+def main() -> None:
+    args = evaluation_engine.parse_args()
 
-            messages = [
-                {
-                    "role": "system",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": SYSTEM_PROMPT,
-                        }
-                    ],
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": USER_PROMPT},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
-                            },
-                        },
-                    ],
-                },
-            ]
-
-            # Payload for the request
-            payload = {
-                "messages": messages,
-                "temperature": TEMPERATURE,
-                "max_tokens": MAX_TOKENS,
-            }
-
-            # Send request to Azure AI Chat
-            try:
-                response = client.complete(payload)
-            except Exception as e:
-                logging.error(f"Error processing {filename}: {e}")
-                continue
-
-            response_text = response.choices[0].message.content.strip()
-            logging.debug(f"Raw response: {response_text}")
-
-            # Calculate time taken
-            t1 = time.time()
-            tt = round(t1 - t0, 2)
-            logging.debug(f"Processed {filename} in {tt:.2f} seconds")
-
-            result = utilities.truncate(response_text)
-            result["image_id"] = filename
-            result["model_id"] = MODEL_ID
-            result["temperature"] = TEMPERATURE
-            result["max_tokens"] = MAX_TOKENS
-            result["time"] = tt
-            scores["scores"].append(result)
-
-            # Sleep for n seconds to avoid rate limiting
-            logging.info("Sleeping for 10 seconds...")
-            time.sleep(10)
-
-    logging.info(json.dumps(scores, indent=2))
-
-    # Count the scores
-    logging.info(f"Scores: {utilities.count_scores(scores)}")
-
-    # Write the JSON results to a file
-    try:
-        with open(f"output/image_quality_azure_{MODEL_ID}.json", "w") as f:
-            f.write(json.dumps(scores, indent=2))
-    except Exception as e:
-        logging.error(f"Error writing results to file: {e}")
+    asyncio.run(
+        evaluation_engine.evaluate_provider(
+            sys.modules[__name__], resume=args.resume, retry_failed=args.retry_failed
+        )
+    )
 
 
 if __name__ == "__main__":
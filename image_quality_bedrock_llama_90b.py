@@ -4,15 +4,20 @@
 # Date: 2024-10-13
 """
 
-import json
+import asyncio
+import contextlib
+import functools
 import logging
-import os
-import time
+import sys
 
 import boto3
-from PIL import Image
+from botocore.config import Config
 
-import utilities
+import evaluation_engine
+import instrumentation
+import payload_builder
+import rate_limiter as rate_limiting
+import streaming
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -25,6 +30,12 @@ MODEL_ID = "us.meta.llama3-2-90b-instruct-v1:0"
 DIRECTORY = "input/"
 TEMPERATURE = 0.3
 MAX_TOKENS = 512
+MAX_PIXELS = 1120  # max. 1120x1120 pixels
+MAX_CONCURRENCY = 4
+REQUESTS_PER_MINUTE = 50  # default quota, override with IQA_REQUESTS_PER_MINUTE
+TOKENS_PER_MINUTE = 200_000  # default quota, override with IQA_TOKENS_PER_MINUTE
+RETRYABLE_ERRORS = ("ModelTimeoutException", "ModelErrorException")
+OUTPUT_PATH = "output/image_quality_bedrock_llama3-2-90b-instruct.json"
 
 # Read the system prompt from a file
 SYSTEM_PROMPT = open("prompts/image_quality_system_prompt.txt", "r").read()
@@ -32,89 +43,117 @@ SYSTEM_PROMPT = open("prompts/image_quality_system_prompt.txt", "r").read()
 # Read the user prompt from a file
 USER_PROMPT = open("prompts/image_quality_user_prompt.txt", "r").read()
 
+# Llama 3.2 prompt format, used by the native request body of batch inference records
+BATCH_PROMPT_TEMPLATE = (
+    "<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n\n{system}<|eot_id|>"
+    "<|start_header_id|>user<|end_header_id|>\n\n<|image|>{user}<|eot_id|>"
+    "<|start_header_id|>assistant<|end_header_id|>\n\n"
+)
 
-def main() -> None:
-    # Create a Bedrock Runtime client
-    bedrock_runtime = boto3.client("bedrock-runtime", region_name="us-east-1")
 
+async def invoke_model(
+    bedrock_runtime, stream: bool, image_bytes: bytes, file_format: str
+) -> str:
     # Base inference parameters to use
     inference_config = {"temperature": TEMPERATURE, "maxTokens": MAX_TOKENS}
 
-    # Initialize the scores dictionary
-    scores = {"scores": []}
-
-    # Iterate over all combined images in the directory
-    for filename in sorted(os.listdir(DIRECTORY)):
-        t0 = time.time()
-
-        logging.info(f"Evaluation for {filename}")
-
-        if filename.endswith((".jpeg", ".jpg", ".png")):
-            image_path = os.path.join(DIRECTORY, filename)
-            image = Image.open(image_path)
-            file_format = "jpeg" if image.format.lower() in ["jpg", "jpeg"] else "png"
-            image_resize = utilities.resize_image(image, 1120)  # max. 1120x1120 pixels
-            image = utilities.image_to_bytes(image_resize, file_format)
-
-            user_messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"image": {"format": file_format, "source": {"bytes": image}}},
-                        {"text": USER_PROMPT},
-                    ],
-                }
-            ]
-
-            system_messages = [
-                {
-                    "text": SYSTEM_PROMPT,
-                }
-            ]
-
-            # Send request to Bedrock
-            try:
-                response = bedrock_runtime.converse(
-                    modelId=MODEL_ID,
-                    system=system_messages,
-                    messages=user_messages,
-                    inferenceConfig=inference_config,
-                )
-            except bedrock_runtime.exceptions.ValidationException as e:
-                logging.error(f"Error processing {filename}: {e}")
-                continue
-
-            response_text = response["output"]["message"]["content"][0]["text"].strip()
-            logging.debug(f"Raw response: {response_text}")
-
-            # Calculate time taken
-            t1 = time.time()
-            tt = round(t1 - t0, 2)
-            logging.debug(f"Processed {filename} in {tt:.2f} seconds")
-
-            result = utilities.truncate(response_text)
-            result["image_id"] = filename
-            result["model_id"] = MODEL_ID
-            result["temperature"] = TEMPERATURE
-            result["max_tokens"] = MAX_TOKENS
-            result["time"] = tt
-            scores["scores"].append(result)
-
-            # Sleep for n seconds to avoid rate limiting from Bedrock Isengard account
-            logging.info("Sleeping for 25 seconds...")
-            time.sleep(25)
-
-    logging.info(json.dumps(scores, indent=2))
-
-    # Count the scores
-    logging.info(f"Scores: {utilities.count_scores(scores)}")
-
-    # Write the JSON results to a file
-    try:
-        with open("output/image_quality_bedrock_llama3-2-90b-instruct.json", "w") as f:
-            f.write(json.dumps(scores, indent=2))
-    except Exception as e:
-        logging.error(f"Error writing results to file: {e}")
+    user_messages = [
+        {
+            "role": "user",
+            "content": [
+                {"image": {"format": file_format, "source": {"bytes": image_bytes}}},
+                {"text": USER_PROMPT},
+            ],
+        }
+    ]
+
+    system_messages = [
+        {
+            "text": SYSTEM_PROMPT,
+        }
+    ]
+
+    request = {
+        "modelId": MODEL_ID,
+        "system": system_messages,
+        "messages": user_messages,
+        "inferenceConfig": inference_config,
+    }
+
+    if stream:
+        # Stream the response, and stop reading once the result object is complete
+        return await streaming.collect_converse_stream(bedrock_runtime, **request)
+
+    # Send request to Bedrock; boto3 is synchronous, so run it in a worker thread
+    response = await asyncio.to_thread(bedrock_runtime.converse, **request)
+    instrumentation.record_usage(
+        response["usage"]["inputTokens"], response["usage"]["outputTokens"]
+    )
+
+    return response["output"]["message"]["content"][0]["text"].strip()
+
+
+def batch_model_input(image_bytes: bytes, file_format: str) -> dict:
+    """
+    Build the native InvokeModel request body for a Bedrock batch inference record.
+
+    Args:
+        image_bytes (bytes): The image bytes.
+        file_format (str): The image format (e.g., 'jpeg', 'png').
+
+    Returns:
+        dict: The Llama 3.2 request body.
+    """
+    prompt = BATCH_PROMPT_TEMPLATE.format(system=SYSTEM_PROMPT, user=USER_PROMPT)
+
+    return {
+        "prompt": prompt,
+        "images": [payload_builder.encode_base64(image_bytes)],
+        "temperature": TEMPERATURE,
+        "max_gen_len": MAX_TOKENS,
+    }
+
+
+def batch_output_text(model_output: dict) -> str:
+    """
+    Extract the response text from a Bedrock batch inference output record.
+
+    Args:
+        model_output (dict): The record's native InvokeModel response body.
+
+    Returns:
+        str: The response text.
+    """
+    return model_output["generation"].strip()
+
+
+@contextlib.asynccontextmanager
+async def open_invoker(rate_limiter: rate_limiting.RateLimiter):
+    # Create a Bedrock Runtime client, with a connection for each in-flight request;
+    # throttling is handled by the rate limiter instead of botocore retries
+    bedrock_runtime = boto3.client(
+        "bedrock-runtime",
+        region_name="us-east-1",
+        endpoint_url=evaluation_engine.get_endpoint_url(),
+        config=Config(
+            max_pool_connections=evaluation_engine.get_concurrency(MAX_CONCURRENCY),
+            retries={"mode": "standard", "max_attempts": 1},
+        ),
+    )
+
+    yield functools.partial(
+        invoke_model, bedrock_runtime, streaming.stream_enabled()
+    )
+
+
+def main() -> None:
+    args = evaluation_engine.parse_args()
+
+    asyncio.run(
+        evaluation_engine.evaluate_provider(
+            sys.modules[__name__], resume=args.resume, retry_failed=args.retry_failed
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -4,16 +4,25 @@
 # Date: 2024-10-21
 """
 
-import json
+import asyncio
+import contextlib
+import functools
+import hashlib
+import io
 import logging
 import os
-import time
+import sys
 
 import google.generativeai as genai
+import google.generativeai.client as genai_client
 from dotenv import load_dotenv
-from PIL import Image
 
-import utilities
+import evaluation_engine
+import instrumentation
+import rate_limiter as rate_limiting
+import streaming
+import structured_output
+import upload_cache as upload_caching
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -26,6 +35,13 @@ MODEL_ID = "gemini-1.5-pro-002"
 DIRECTORY = "input/"
 TEMPERATURE = 0
 MAX_TOKENS = 512
+MAX_PIXELS = None  # not resized
+MAX_CONCURRENCY = 4
+REQUESTS_PER_MINUTE = 60  # default quota, override with IQA_REQUESTS_PER_MINUTE
+TOKENS_PER_MINUTE = None  # default quota, override with IQA_TOKENS_PER_MINUTE
+OUTPUT_PATH = f"output/image_quality_google_{MODEL_ID}.json"
+# Requests are limited to 20 MB, and inline image bytes are base64-encoded (4/3 larger)
+INLINE_MAX_BYTES = 14 * 1024 * 1024
 
 # Read the system prompt from a file
 SYSTEM_PROMPT = open("prompts/image_quality_system_prompt.txt", "r").read()
@@ -44,11 +60,162 @@ def upload_to_gemini(path, mime_type=None):
     return file
 
 
-def main() -> None:
+async def get_file_part(
+    upload_cache: upload_caching.UploadCache,
+    image_bytes: bytes,
+    mime_type: str,
+    refresh: bool = False,
+) -> dict:
+    """
+    Reference an image uploaded with the File API, reusing a previous upload.
+
+    Args:
+        upload_cache (UploadCache): The cache of uploaded file URIs, or None.
+        image_bytes (bytes): The image bytes.
+        mime_type (str): The image MIME type.
+        refresh (bool): Forget a cached upload, e.g. one the service rejected, and
+                        upload the image again.
+
+    Returns:
+        dict: The file_data content part.
+    """
+    sha256 = hashlib.sha256(image_bytes).hexdigest()
+    upload = None
+    if upload_cache is not None:
+        if refresh:
+            await asyncio.to_thread(upload_cache.delete, "gemini", sha256)
+        else:
+            upload = await asyncio.to_thread(upload_cache.get, "gemini", sha256)
+
+    if upload is None:
+        # The upload API is synchronous, so run it in a worker thread
+        with instrumentation.stage("upload"):
+            file = await asyncio.to_thread(
+                upload_to_gemini, io.BytesIO(image_bytes), mime_type=mime_type
+            )
+        upload = {"name": file.name, "uri": file.uri, "mime_type": file.mime_type}
+        if upload_cache is not None:
+            expiration_time = getattr(file, "expiration_time", None)
+            await asyncio.to_thread(
+                upload_cache.put,
+                "gemini",
+                sha256,
+                file.name,
+                file.uri,
+                file.mime_type,
+                expiration_time.timestamp() if expiration_time else None,
+            )
+
+    return {"file_data": {"mime_type": upload["mime_type"], "file_uri": upload["uri"]}}
+
+
+def record_usage(usage_metadata) -> None:
+    # Streamed responses report the usage so far with each chunk
+    if usage_metadata:
+        instrumentation.record_usage(
+            usage_metadata.prompt_token_count or None,
+            usage_metadata.candidates_token_count or None,
+        )
+
+
+async def send_message(
+    model: genai.GenerativeModel,
+    image_part: dict,
+    stream: bool = False,
+    rest: bool = False,
+) -> str:
+    chat_session = model.start_chat(
+        history=[
+            {
+                "role": "user",
+                "parts": [
+                    image_part,
+                    USER_PROMPT,
+                ],
+            },
+        ]
+    )
+
+    # The time to first token includes the request
+    collector = streaming.StreamCollector() if stream else None
+    if rest:
+        # The asynchronous client only supports gRPC, so the REST client's requests
+        # are sent from a worker thread
+        response = await asyncio.to_thread(
+            chat_session.send_message, "INSERT_INPUT_HERE", stream=stream
+        )
+        chunks = streaming.iterate_in_thread(iter(response)) if stream else None
+    else:
+        response = await chat_session.send_message_async(
+            "INSERT_INPUT_HERE", stream=stream
+        )
+        chunks = response
+
+    if stream:
+        # Stream the response, and stop reading once the result object is complete;
+        # the abandoned stream is cancelled when it is garbage collected
+        async for chunk in chunks:
+            record_usage(chunk.usage_metadata)
+            text = "".join(part.text for part in chunk.parts) if chunk.candidates else ""
+            if collector.feed(text):
+                break
+        return collector.finish()
+
+    record_usage(response.usage_metadata)
+
+    return response.text.strip()
+
+
+async def invoke_model(
+    models: dict,
+    stream: bool,
+    rest: bool,
+    output_modes: structured_output.OutputModes,
+    upload_cache: upload_caching.UploadCache,
+    image_bytes: bytes,
+    file_format: str,
+) -> str:
+    mime_type = f"image/{file_format}"
+
+    async def send(image_part: dict) -> str:
+        return await output_modes.invoke(
+            lambda mode: send_message(models[mode], image_part, stream, rest)
+        )
+
+    # Send images small enough inline, saving the upload round trip
+    if len(image_bytes) <= INLINE_MAX_BYTES:
+        return await send({"mime_type": mime_type, "data": image_bytes})
+
+    image_part = await get_file_part(upload_cache, image_bytes, mime_type)
+    try:
+        return await send(image_part)
+    except Exception as e:
+        # A cached upload may have been deleted early; upload it again once
+        if upload_cache is None or rate_limiting.get_status_code(e) not in (403, 404):
+            raise
+        image_part = await get_file_part(upload_cache, image_bytes, mime_type, True)
+        return await send(image_part)
+
+
+@contextlib.asynccontextmanager
+async def open_invoker(rate_limiter: rate_limiting.RateLimiter):
     load_dotenv()
-    genai.configure(api_key=os.environ["GOOGLE_GEMINI_API_KEY"])
 
-    # Create the model
+    endpoint_url = evaluation_engine.get_endpoint_url()
+    if endpoint_url is None:
+        genai.configure(api_key=os.environ["GOOGLE_GEMINI_API_KEY"])
+    else:
+        # Only the REST transport can be pointed at another endpoint, e.g. the mock
+        # provider server; File API uploads read their discovery document from it too
+        genai.configure(
+            api_key=os.environ["GOOGLE_GEMINI_API_KEY"],
+            transport="rest",
+            client_options={"api_endpoint": endpoint_url},
+        )
+        genai_client.GENAI_API_DISCOVERY_URL = f"{endpoint_url}/$discovery/rest"
+
+    # Create the models; JSON mode with a response schema constrains the output, and
+    # plain text is the fallback if the model rejects the schema
     generation_config = {
         "temperature": TEMPERATURE,
         "top_p": 0.95,
@@ -56,83 +223,46 @@ def main() -> None:
         "max_output_tokens": MAX_TOKENS,
         "response_mime_type": "text/plain",
     }
-
-    model = genai.GenerativeModel(
-        model_name=MODEL_ID,
-        generation_config=generation_config,
-        system_instruction=SYSTEM_PROMPT,
+    schema_config = dict(
+        generation_config,
+        response_mime_type="application/json",
+        response_schema=structured_output.GEMINI_RESULT_SCHEMA,
     )
 
-    # Initialize the scores dictionary
-    scores = {"scores": []}
-
-    # Iterate over all combined images in the directory
-    for filename in sorted(os.listdir(DIRECTORY)):
-        t0 = time.time()
-
-        logging.info(f"Evaluation for {filename}")
-
-        if filename.endswith((".jpeg", ".jpg", ".png")):
-            image_path = os.path.join(DIRECTORY, filename)
-            image = Image.open(image_path)
-            file_format = "jpeg" if image.format.lower() in ["jpg", "jpeg"] else "png"
-            # image_resize = utilities.resize_image(image, 1120)  # max. 1120x1120 pixels
-            # image = utilities.image_to_bytes(image_resize, file_format)
-
-            files = [
-                upload_to_gemini(image_path, mime_type=f"image/{file_format}"),
-            ]
-
-            chat_session = model.start_chat(
-                history=[
-                    {
-                        "role": "user",
-                        "parts": [
-                            files[0],
-                            USER_PROMPT,
-                        ],
-                    },
-                ]
-            )
-
-            # Send request to Bedrock
-            try:
-                response = chat_session.send_message("INSERT_INPUT_HERE")
-            except Exception as e:
-                logging.error(f"Error processing {filename}: {e}")
-                continue
-
-            response_text = response.text.strip()
-            logging.debug(f"Raw response: {response_text}")
+    models = {
+        mode: genai.GenerativeModel(
+            model_name=MODEL_ID,
+            generation_config=config,
+            system_instruction=SYSTEM_PROMPT,
+        )
+        for mode, config in (("schema", schema_config), ("prompt", generation_config))
+    }
+    output_modes = structured_output.OutputModes(["schema", "prompt"], MODEL_ID)
 
-            # Calculate time taken
-            t1 = time.time()
-            tt = round(t1 - t0, 2)
-            logging.debug(f"Processed {filename} in {tt:.2f} seconds")
+    upload_cache = upload_caching.create_upload_cache()
 
-            result = utilities.truncate(response_text)
-            result["image_id"] = filename
-            result["model_id"] = MODEL_ID
-            result["temperature"] = TEMPERATURE
-            result["max_tokens"] = MAX_TOKENS
-            result["time"] = tt
-            scores["scores"].append(result)
+    yield functools.partial(
+        invoke_model,
+        models,
+        streaming.stream_enabled(),
+        endpoint_url is not None,
+        output_modes,
+        upload_cache,
+    )
 
-            # Sleep for n seconds to avoid rate limiting
-            # logging.info("Sleeping for 25 seconds...")
-            # time.sleep(25)
+    if upload_cache is not None:
+        upload_cache.log_stats()
+        upload_cache.close()
 
-    logging.info(json.dumps(scores, indent=2))
 
-    # Count the scores
-    logging.info(f"Scores: {utilities.count_scores(scores)}")
+def main() -> None:
+    args = evaluation_engine.parse_args()
 
-    # Write the JSON results to a file
-    try:
-        with open(f"output/image_quality_google_{MODEL_ID}.json", "w") as f:
-            f.write(json.dumps(scores, indent=2))
-    except Exception as e:
-        logging.error(f"Error writing results to file: {e}")
+    asyncio.run(
+        evaluation_engine.evaluate_provider(
+            sys.modules[__name__], resume=args.resume, retry_failed=args.retry_failed
+        )
+    )
 
 
 if __name__ == "__main__":
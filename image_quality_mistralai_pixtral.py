@@ -4,16 +4,22 @@
 # Date: 2024-10-13
 """
 
-import json
+import asyncio
+import contextlib
+import functools
 import logging
 import os
-import time
+import sys
 
 from mistralai import Mistral
 from dotenv import load_dotenv
-from PIL import Image
 
-import utilities
+import evaluation_engine
+import instrumentation
+import payload_builder
+import rate_limiter as rate_limiting
+import streaming
+import structured_output
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -26,6 +32,11 @@ MODEL_ID = "pixtral-12b-2409"
 DIRECTORY = "input/"
 TEMPERATURE = 0
 MAX_TOKENS = 512
+MAX_PIXELS = None  # not resized
+MAX_CONCURRENCY = 4
+REQUESTS_PER_MINUTE = 60  # default quota, override with IQA_REQUESTS_PER_MINUTE
+TOKENS_PER_MINUTE = 500_000  # default quota, override with IQA_TOKENS_PER_MINUTE
+OUTPUT_PATH = f"output/image_quality_minstralai_{MODEL_ID}.json"
 
 # Read the system prompt from a file
 SYSTEM_PROMPT = open("prompts/image_quality_system_prompt.txt", "r").read()
@@ -34,88 +45,81 @@ SYSTEM_PROMPT = open("prompts/image_quality_system_prompt.txt", "r").read()
 USER_PROMPT = open("prompts/image_quality_user_prompt.txt", "r").read()
 
 
-def main() -> None:
+async def invoke_model(
+    client: Mistral,
+    stream: bool,
+    output_modes: structured_output.OutputModes,
+    image_bytes: bytes,
+    file_format: str,
+) -> str:
+    image_url = payload_builder.data_url(image_bytes, file_format)
+
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": f"{SYSTEM_PROMPT}\n\n{USER_PROMPT}"},
+                {
+                    "type": "image_url",
+                    "image_url": image_url,
+                },
+            ],
+        }
+    ]
+
+    async def send(mode: str) -> str:
+        request = {
+            "model": MODEL_ID,
+            "temperature": TEMPERATURE,
+            "max_tokens": MAX_TOKENS,
+            "messages": messages,
+        }
+        if mode == "json_object":
+            request["response_format"] = {"type": "json_object"}
+
+        if stream:
+            # Stream the response, and stop reading once the result object is complete
+            collector = streaming.StreamCollector()
+            updates = await client.chat.stream_async(**request)
+            return await streaming.collect_chat_completion_updates(updates, collector)
+
+        # Send request to Mistral AI
+        response = await client.chat.complete_async(**request)
+        instrumentation.record_usage(
+            response.usage.prompt_tokens, response.usage.completion_tokens
+        )
+
+        return response.choices[0].message.content.strip()
+
+    # Fall back to the plain prompt if JSON mode is rejected
+    return await output_modes.invoke(send)
+
+
+@contextlib.asynccontextmanager
+async def open_invoker(rate_limiter: rate_limiting.RateLimiter):
     load_dotenv()
 
     # Retrieve the API key from environment variables
     api_key = os.environ["MISTRAL_API_KEY"]
 
     # Initialize the Mistral client
-    client = Mistral(api_key=api_key)
-
-    # Base inference parameters to use
-    inference_config = {"temperature": TEMPERATURE, "maxTokens": MAX_TOKENS}
-
-    # Initialize the scores dictionary
-    scores = {"scores": []}
+    async with Mistral(
+        api_key=api_key, server_url=evaluation_engine.get_endpoint_url()
+    ) as client:
+        output_modes = structured_output.OutputModes(["json_object", "prompt"], MODEL_ID)
+        yield functools.partial(
+            invoke_model, client, streaming.stream_enabled(), output_modes
+        )
 
-    # Iterate over all combined images in the directory
-    for filename in sorted(os.listdir(DIRECTORY)):
-        t0 = time.time()
 
-        logging.info(f"Evaluation for {filename}")
-
-        if filename.endswith((".jpeg", ".jpg", ".png")):
-            image_path = os.path.join(DIRECTORY, filename)
-            image = Image.open(image_path)
-            file_format = "jpeg" if image.format.lower() in ["jpg", "jpeg"] else "png"
-            image_base64 = utilities.image_to_base64(image, file_format)
+def main() -> None:
+    args = evaluation_engine.parse_args()
 
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": f"{SYSTEM_PROMPT}\n\n{USER_PROMPT}"},
-                        {
-                            "type": "image_url",
-                            "image_url": f"data:image/{file_format};base64,{image_base64}",
-                        },
-                    ],
-                }
-            ]
-
-            # Send request to Bedrock
-            try:
-                response = client.chat.complete(
-                    model=MODEL_ID,
-                    temperature=TEMPERATURE,
-                    max_tokens=MAX_TOKENS,
-                    messages=messages,
-                    response_format={
-                        "type": "json_object",
-                    },
-                )
-            except Exception as e:
-                logging.error(f"Error processing {filename}: {e}")
-                continue
-
-            response_text = response.choices[0].message.content.strip()
-            logging.debug(f"Raw response: {response_text}")
-
-            # Calculate time taken
-            t1 = time.time()
-            tt = round(t1 - t0, 2)
-            logging.debug(f"Processed {filename} in {tt:.2f} seconds")
-
-            result = utilities.truncate(response_text)
-            result["image_id"] = filename
-            result["model_id"] = MODEL_ID
-            result["temperature"] = TEMPERATURE
-            result["max_tokens"] = MAX_TOKENS
-            result["time"] = tt
-            scores["scores"].append(result)
-
-    logging.info(json.dumps(scores, indent=2))
-
-    # Count the scores
-    logging.info(f"Scores: {utilities.count_scores(scores)}")
-
-    # Write the JSON results to a file
-    try:
-        with open(f"output/image_quality_minstralai_{MODEL_ID}.json", "w") as f:
-            f.write(json.dumps(scores, indent=2))
-    except Exception as e:
-        logging.error(f"Error writing results to file: {e}")
+    asyncio.run(
+        evaluation_engine.evaluate_provider(
+            sys.modules[__name__], resume=args.resume, retry_failed=args.retry_failed
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -4,16 +4,21 @@
 # Date: 2024-10-22
 """
 
-import json
+import asyncio
+import contextlib
+import functools
 import logging
 import os
-import time
-import requests
+import sys
 
 from dotenv import load_dotenv
-from PIL import Image
 
-import utilities
+import evaluation_engine
+import instrumentation
+import http_transport
+import payload_builder
+import rate_limiter as rate_limiting
+import streaming
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -26,6 +31,12 @@ MODEL_ID = "neva-22b"
 DIRECTORY = "input/"
 TEMPERATURE = 0.000001  # can't be 0 - throws an error
 MAX_TOKENS = 512
+MAX_PIXELS = 1536  # max. 180_000
+MAX_CONCURRENCY = 4
+REQUESTS_PER_MINUTE = 40  # default quota, override with IQA_REQUESTS_PER_MINUTE
+TOKENS_PER_MINUTE = None  # default quota, override with IQA_TOKENS_PER_MINUTE
+INVOKE_URL = "https://ai.api.nvidia.com/v1/vlm/nvidia/neva-22b"
+OUTPUT_PATH = f"output/image_quality_nvidia_{MODEL_ID}.json"
 
 # Read the system prompt from a file
 SYSTEM_PROMPT = open("prompts/image_quality_system_prompt.txt", "r").read()
@@ -34,96 +45,93 @@ SYSTEM_PROMPT = open("prompts/image_quality_system_prompt.txt", "r").read()
 USER_PROMPT = open("prompts/image_quality_user_prompt.txt", "r").read()
 
 
-def main() -> None:
+async def invoke_model(
+    transport: http_transport.HttpTransport,
+    invoke_url: str,
+    headers: dict,
+    stream: bool,
+    rate_limiter: rate_limiting.RateLimiter,
+    image_bytes: bytes,
+    file_format: str,
+) -> str:
+    payload = {
+        "messages": [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT,
+            },
+            {
+                "role": "user",
+                "content": f'{USER_PROMPT} <img src="data:image/{file_format};base64,{payload_builder.IMAGE_PLACEHOLDER}" />',
+            },
+        ],
+        "max_tokens": MAX_TOKENS,
+        "temperature": TEMPERATURE,
+        "top_p": 0.70,
+        "seed": 0,
+    }
+
+    if stream:
+        # Stream the response, and stop reading once the result object is complete
+        payload["stream"] = True
+        collector = streaming.StreamCollector()
+        body = payload_builder.build_json_body(payload, image_bytes)
+        async with transport.stream(invoke_url, headers=headers, content=body) as (
+            response,
+            lines,
+        ):
+            response.raise_for_status()
+            rate_limiter.update_from_headers(response.headers)
+            return await streaming.collect_chat_completion_stream(lines, collector)
+
+    # Send request to the API over a pooled keep-alive connection
+    body = payload_builder.build_json_body(payload, image_bytes)
+    response = await transport.post(invoke_url, headers=headers, content=body)
+    response.raise_for_status()  # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
+    rate_limiter.update_from_headers(response.headers)
+    body = response.json()
+    logging.info(body)
+    usage = body.get("usage", {})
+    instrumentation.record_usage(
+        usage.get("prompt_tokens"), usage.get("completion_tokens")
+    )
+
+    return body["choices"][0]["message"]["content"]
+
+
+@contextlib.asynccontextmanager
+async def open_invoker(rate_limiter: rate_limiting.RateLimiter):
     load_dotenv()
 
-    invoke_url = "https://ai.api.nvidia.com/v1/vlm/nvidia/neva-22b"
-    gemini_api_key = os.environ["NVIDIA_API_KEY"]
-    stream = False
+    nvidia_api_key = os.environ["NVIDIA_API_KEY"]
+    stream = streaming.stream_enabled()
 
     headers = {
-        "Authorization": f"Bearer {gemini_api_key}",
+        "Authorization": f"Bearer {nvidia_api_key}",
+        "Content-Type": "application/json",
         "Accept": "text/event-stream" if stream else "application/json",
     }
 
-    # Initialize the scores dictionary
-    scores = {"scores": []}
-
-    # Iterate over all combined images in the directory
-    for filename in sorted(os.listdir(DIRECTORY)):
-        t0 = time.time()
-
-        logging.info(f"Evaluation for {filename}")
-
-        if filename.endswith((".jpeg", ".jpg", ".png")):
-            image_path = os.path.join(DIRECTORY, filename)
-            image = Image.open(image_path)
-            file_format = "jpeg" if image.format.lower() in ["jpg", "jpeg"] else "png"
-            image_resize = utilities.resize_image(image, 1536)  # max. 180_000
-            image_base64 = utilities.image_to_base64(image_resize, file_format)
-
-            payload = {
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": SYSTEM_PROMPT,
-                    },
-                    {
-                        "role": "user",
-                        "content": f'{USER_PROMPT} <img src="data:image/{file_format};base64,{image_base64}" />',
-                    },
-                ],
-                "max_tokens": MAX_TOKENS,
-                "temperature": TEMPERATURE,
-                "top_p": 0.70,
-                "seed": 0,
-            }
-
-            # Send request to the API
-            try:
-                response = requests.post(invoke_url, headers=headers, json=payload)
-            except Exception as e:
-                logging.error(f"Error processing {filename}: {e}")
-                continue
-
-            if stream:
-                for line in response.iter_lines():
-                    if line:
-                        logging.debug(line.decode("utf-8"))
-            else:
-                logging.info(response.json())
-
-            response_text = (response.json())["choices"][0]["message"]["content"]
-            logging.debug(f"Raw response: {response_text}")
-
-            # Calculate time taken
-            t1 = time.time()
-            tt = round(t1 - t0, 2)
-            logging.debug(f"Processed {filename} in {tt:.2f} seconds")
-
-            result = utilities.truncate(response_text)
-            result["image_id"] = filename
-            result["model_id"] = MODEL_ID
-            result["temperature"] = TEMPERATURE
-            result["max_tokens"] = MAX_TOKENS
-            result["time"] = tt
-            scores["scores"].append(result)
-
-            # Sleep for n seconds to avoid rate limiting
-            # logging.info("Sleeping for 25 seconds...")
-            # time.sleep(25)
-
-    logging.info(json.dumps(scores, indent=2))
-
-    # Count the scores
-    logging.info(f"Scores: {utilities.count_scores(scores)}")
-
-    # Write the JSON results to a file
-    try:
-        with open(f"output/image_quality_nvidia_{MODEL_ID}.json", "w") as f:
-            f.write(json.dumps(scores, indent=2))
-    except Exception as e:
-        logging.error(f"Error writing results to file: {e}")
+    pool_size = evaluation_engine.get_concurrency(MAX_CONCURRENCY)
+    async with http_transport.create_transport(pool_size) as transport:
+        yield functools.partial(
+            invoke_model,
+            transport,
+            evaluation_engine.get_endpoint_url(INVOKE_URL),
+            headers,
+            stream,
+            rate_limiter,
+        )
+
+
+def main() -> None:
+    args = evaluation_engine.parse_args()
+
+    asyncio.run(
+        evaluation_engine.evaluate_provider(
+            sys.modules[__name__], resume=args.resume, retry_failed=args.retry_failed
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,376 @@
+"""
+# Title: Per-stage timing, token usage and span export for image quality assessments
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import contextlib
+import contextvars
+import logging
+import os
+import secrets
+import sys
+import time
+
+import results_writer
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+# Stages timed for each image: read the original file (when sent as-is), decode,
+# resize and encode the image, upload it (Gemini File API), wait for a worker of the
+# model (fan-out runs), wait for the rate limiter, send the request (including
+# streaming), wait for the first token, back off between retries, and parse the
+# response
+STAGES = (
+    "read",
+    "decode",
+    "resize",
+    "encode",
+    "upload",
+    "dispatch",
+    "queue",
+    "request",
+    "ttft",
+    "backoff",
+    "parse",
+)
+SERVICE_NAME = "image-quality-analysis"
+SCOPE_NAME = "iqa"
+SPAN_KIND_INTERNAL = 1
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# Trace of the image being evaluated; each worker task has its own context, and
+# asyncio.to_thread copies it, so preprocessing in worker threads is recorded too
+CURRENT_TRACE = contextvars.ContextVar("current_trace", default=None)
+
+
+class RequestTrace:
+    """
+    The stage timings, token usage and payload size of one image and model.
+
+    Each timed stage is kept as a span, for export. Timings of a stage that runs more
+    than once, e.g. a request that is retried, are summed.
+    """
+
+    def __init__(self) -> None:
+        self.start_ns = time.time_ns()
+        self.spans = []  # (stage, start_ns, end_ns, variant)
+        self.times = {}  # durations that are not spans, e.g. the time to first token
+        self.usage = {}
+        self.payload_bytes = None
+        self.peak_rss_bytes = None  # the highest RSS sampled while preparing the image
+
+    def add_span(self, name: str, start_ns: int, end_ns: int, variant=None) -> None:
+        self.spans.append((name, start_ns, end_ns, variant))
+
+    @property
+    def timings(self) -> dict:
+        timings = {}
+        for name, start_ns, end_ns, _ in self.spans:
+            timings[name] = timings.get(name, 0) + (end_ns - start_ns) / 1e9
+        timings.update(self.times)
+        return timings
+
+    def copy(self, variant=None) -> "RequestTrace":
+        """
+        Copy the trace, e.g. to share the preprocessing of an image between the models
+        it is sent to.
+
+        Args:
+            variant (optional): Keep only the spans of this payload variant (e.g. the
+                                maximum size), and the spans shared by all variants.
+
+        Returns:
+            RequestTrace: The copy.
+        """
+        trace = RequestTrace()
+        trace.start_ns = self.start_ns
+        trace.spans = [span for span in self.spans if span[3] in (None, variant)]
+        trace.times = dict(self.times)
+        trace.usage = dict(self.usage)
+        trace.payload_bytes = self.payload_bytes
+        trace.peak_rss_bytes = self.peak_rss_bytes
+        return trace
+
+    def metrics(self) -> dict:
+        """
+        Get the fields recorded with the result.
+
+        Returns:
+            dict: The "timings" in seconds, in stage order, the token "usage", the
+                  "payload_bytes" sent, and the "peak_rss_bytes" of the process while
+                  the image was prepared, where known.
+        """
+        timings = self.timings
+        metrics = {
+            "timings": {
+                name: round(timings[name], 3) for name in sorted(timings, key=stage_order)
+            }
+        }
+        if self.usage:
+            metrics["usage"] = dict(self.usage)
+        if self.payload_bytes is not None:
+            metrics["payload_bytes"] = self.payload_bytes
+        if self.peak_rss_bytes is not None:
+            metrics["peak_rss_bytes"] = self.peak_rss_bytes
+        return metrics
+
+
+def stage_order(name: str) -> int:
+    return STAGES.index(name) if name in STAGES else len(STAGES)
+
+
+def start_trace(trace: RequestTrace = None) -> RequestTrace:
+    """
+    Make a trace the current trace of this task.
+
+    Args:
+        trace (RequestTrace, optional): The trace, e.g. with the preprocessing stages
+                                        already recorded. A new trace if None.
+
+    Returns:
+        RequestTrace: The current trace.
+    """
+    trace = trace or RequestTrace()
+    CURRENT_TRACE.set(trace)
+    return trace
+
+
+@contextlib.contextmanager
+def stage(name: str, trace: RequestTrace = None, variant=None):
+    """
+    Time a stage of the current trace. Does nothing outside a trace.
+
+    Args:
+        name (str): The stage name.
+        trace (RequestTrace, optional): The trace. Defaults to the current trace.
+        variant (optional): The payload variant the stage belongs to, if it is not
+                            shared by all variants.
+    """
+    trace = trace or CURRENT_TRACE.get()
+    start_ns = time.time_ns()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace.add_span(name, start_ns, time.time_ns(), variant)
+
+
+def record_time(name: str, seconds: float) -> None:
+    """
+    Record a duration that is not a span of its own, e.g. the time to first token.
+
+    Args:
+        name (str): The stage name.
+        seconds (float): The duration, in seconds.
+    """
+    trace = CURRENT_TRACE.get()
+    if trace is not None:
+        trace.times[name] = seconds
+
+
+def record_usage(input_tokens: int = None, output_tokens: int = None) -> None:
+    """
+    Record the token usage reported by the provider for the current trace.
+
+    Args:
+        input_tokens (int, optional): The input (prompt) tokens.
+        output_tokens (int, optional): The output (completion) tokens.
+    """
+    trace = CURRENT_TRACE.get()
+    if trace is None:
+        return
+    if input_tokens is not None:
+        trace.usage["input_tokens"] = input_tokens
+    if output_tokens is not None:
+        trace.usage["output_tokens"] = output_tokens
+
+
+def record_payload(image_bytes: bytes) -> None:
+    trace = CURRENT_TRACE.get()
+    if trace is not None:
+        trace.payload_bytes = len(image_bytes)
+
+
+def peak_rss_bytes() -> int:
+    """
+    Get the peak resident set size of this process.
+
+    Returns:
+        int: The peak RSS in bytes, or None where it is not available (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss_bytes() -> int:
+    """
+    Get the current resident set size of this process.
+
+    Returns:
+        int: The RSS in bytes. Where it is not available (other than Linux), the peak
+             RSS, so the memory growth is measured instead of the peak.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_bytes()
+
+
+def record_memory() -> None:
+    """
+    Sample the RSS of the process into the current trace, keeping the highest sample.
+
+    Sampled where an image is at its largest in memory: once decoded and resized, and
+    once its request body is built. With several images in flight, the RSS includes
+    theirs too.
+    """
+    trace = CURRENT_TRACE.get()
+    if trace is None:
+        return
+    rss = current_rss_bytes()
+    if rss is not None and (trace.peak_rss_bytes is None or rss > trace.peak_rss_bytes):
+        trace.peak_rss_bytes = rss
+
+
+def otlp_attributes(attributes: dict) -> list:
+    """
+    Convert attributes to OTLP/JSON key-value pairs, skipping None values.
+
+    Args:
+        attributes (dict): The attributes.
+
+    Returns:
+        list: The OTLP/JSON attributes.
+    """
+    converted = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            converted.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            converted.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            converted.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            converted.append({"key": key, "value": {"stringValue": str(value)}})
+    return converted
+
+
+class SpanExporter:
+    """
+    Exports traces to a file in the OTLP/JSON format, one ExportTraceServiceRequest
+    per line, as read by the OpenTelemetry Collector's file receiver.
+
+    Each image and model is a trace with a root "evaluate_image" span and a child
+    span for each timed stage.
+
+    Args:
+        path (str): The path of the JSON Lines span file. Spans are appended.
+    """
+
+    def __init__(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.writer = results_writer.JsonlResultWriter(path, append=True)
+        self.path = path
+
+    def export(
+        self, trace: RequestTrace, image_id: str, model_id: str, record: dict
+    ) -> None:
+        """
+        Export the spans of an image's evaluation.
+
+        Args:
+            trace (RequestTrace): The trace.
+            image_id (str): The image filename.
+            model_id (str): The model identifier.
+            record (dict): The result record, or None if the request failed.
+        """
+        trace_id = secrets.token_hex(16)
+        root_id = secrets.token_hex(8)
+        end_ns = time.time_ns()
+
+        status = {"code": STATUS_OK}
+        if record is None:
+            status = {"code": STATUS_ERROR, "message": "Request failed"}
+        elif record.get("score") == -1:
+            status = {"code": STATUS_ERROR, "message": "Response not parsed"}
+
+        root = {
+            "traceId": trace_id,
+            "spanId": root_id,
+            "name": "evaluate_image",
+            "kind": SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(trace.start_ns),
+            "endTimeUnixNano": str(end_ns),
+            "attributes": otlp_attributes(
+                {
+                    "iqa.image_id": image_id,
+                    "gen_ai.request.model": model_id,
+                    "gen_ai.usage.input_tokens": trace.usage.get("input_tokens"),
+                    "gen_ai.usage.output_tokens": trace.usage.get("output_tokens"),
+                    "iqa.payload_bytes": trace.payload_bytes,
+                    "iqa.peak_rss_bytes": trace.peak_rss_bytes,
+                    "iqa.ttft_s": trace.timings.get("ttft"),
+                    "iqa.score": record.get("score") if record else None,
+                }
+            ),
+            "status": status,
+        }
+        spans = [root] + [
+            {
+                "traceId": trace_id,
+                "spanId": secrets.token_hex(8),
+                "parentSpanId": root_id,
+                "name": name,
+                "kind": SPAN_KIND_INTERNAL,
+                "startTimeUnixNano": str(start_ns),
+                "endTimeUnixNano": str(span_end_ns),
+            }
+            for name, start_ns, span_end_ns, _ in trace.spans
+        ]
+
+        self.writer.write(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": {
+                            "attributes": otlp_attributes(
+                                {"service.name": SERVICE_NAME}
+                            )
+                        },
+                        "scopeSpans": [{"scope": {"name": SCOPE_NAME}, "spans": spans}],
+                    }
+                ]
+            }
+        )
+
+    def close(self) -> None:
+        self.writer.close()
+        logging.info(f"Exported {self.writer.count} traces to {self.path}")
+
+
+def create_span_exporter() -> SpanExporter:
+    """
+    Create the span exporter from the IQA_TRACE_FILE environment variable.
+
+    Returns:
+        SpanExporter: The span exporter, or None if IQA_TRACE_FILE is not set.
+    """
+    path = os.environ.get("IQA_TRACE_FILE", "")
+    if not path:
+        return None
+    return SpanExporter(path)
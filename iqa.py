@@ -0,0 +1,194 @@
+"""
+# Title: Command-line interface for image quality assessments with any provider
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import argparse
+import asyncio
+import logging
+
+import providers as provider_registry
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+
+def run(args: argparse.Namespace) -> None:
+    """
+    Evaluate the images with the selected providers.
+
+    A single provider runs on its own; several providers run together, loading each
+    image once for all of them.
+
+    Args:
+        args (argparse.Namespace): The parsed 'run' arguments.
+    """
+    # Import the evaluation modules here, so 'list' and '--help' stay fast
+    import evaluation_engine
+    import fan_out_runner
+
+    names = list(dict.fromkeys(args.model))
+    providers = [provider_registry.load_provider(name) for name in names]
+
+    if len(providers) == 1:
+        asyncio.run(
+            evaluation_engine.evaluate_provider(
+                providers[0],
+                directory=args.directory,
+                resume=args.resume,
+                retry_failed=args.retry_failed,
+            )
+        )
+    else:
+        asyncio.run(
+            fan_out_runner.run_fan_out(
+                providers,
+                directory=args.directory or fan_out_runner.DIRECTORY,
+                resume=args.resume,
+                retry_failed=args.retry_failed,
+            )
+        )
+
+
+def batch_prepare(args: argparse.Namespace) -> None:
+    """
+    Write the Amazon Bedrock batch inference input shards for a provider.
+
+    Args:
+        args (argparse.Namespace): The parsed 'batch-prepare' arguments.
+    """
+    import bedrock_batch
+
+    bedrock_batch.prepare_batch(
+        load_batch_provider(args.model),
+        directory=args.directory,
+        batch_directory=args.batch_directory,
+        max_mb=args.max_shard_mb,
+        max_records=args.max_shard_records,
+    )
+
+
+def batch_collect(args: argparse.Namespace) -> None:
+    """
+    Collect the Amazon Bedrock batch inference output files into a provider's results.
+
+    Args:
+        args (argparse.Namespace): The parsed 'batch-collect' arguments.
+    """
+    import bedrock_batch
+
+    bedrock_batch.collect_batch(load_batch_provider(args.model), args.job_output)
+
+
+def load_batch_provider(name: str):
+    """
+    Load a provider that supports Amazon Bedrock batch inference.
+
+    Args:
+        name (str): The registered provider name.
+
+    Returns:
+        module: The provider module.
+    """
+    provider = provider_registry.load_provider(name)
+    if not hasattr(provider, "batch_model_input"):
+        raise SystemExit(f"Provider {name} does not support batch inference")
+    return provider
+
+
+def list_providers(args: argparse.Namespace) -> None:
+    """
+    Print the registered providers.
+
+    Args:
+        args (argparse.Namespace): The parsed 'list' arguments.
+    """
+    for name in provider_registry.provider_names():
+        _, description = provider_registry.REGISTRY[name]
+        print(f"{name:<20} {description}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Evaluate image quality with multimodal generative AI models."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser(
+        "run", help="Evaluate the images with one or more models"
+    )
+    run_parser.add_argument(
+        "--model",
+        "-m",
+        action="append",
+        required=True,
+        choices=provider_registry.provider_names(),
+        metavar="PROVIDER",
+        help="Provider to run; repeat to run several models together "
+        "(see 'iqa.py list')",
+    )
+    run_parser.add_argument(
+        "--directory",
+        help="Directory containing the images (default: input/)",
+    )
+    run_parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip images already recorded in each model's JSONL output",
+    )
+    run_parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Only evaluate the images recorded in each model's dead-letter file",
+    )
+    run_parser.set_defaults(handler=run)
+
+    batch_providers = [
+        name for name in provider_registry.provider_names() if name.startswith("bedrock_")
+    ]
+
+    prepare_parser = subparsers.add_parser(
+        "batch-prepare", help="Write Amazon Bedrock batch inference input shards"
+    )
+    prepare_parser.add_argument("--model", "-m", required=True, choices=batch_providers)
+    prepare_parser.add_argument(
+        "--directory", help="Directory containing the images (default: input/)"
+    )
+    prepare_parser.add_argument(
+        "--batch-directory",
+        default="batch/",
+        help="Directory the shards are written to (default: batch/)",
+    )
+    prepare_parser.add_argument(
+        "--max-shard-mb", type=float, default=512, help="Maximum shard size in MB"
+    )
+    prepare_parser.add_argument(
+        "--max-shard-records",
+        type=int,
+        default=50_000,
+        help="Maximum number of records per shard",
+    )
+    prepare_parser.set_defaults(handler=batch_prepare)
+
+    collect_parser = subparsers.add_parser(
+        "batch-collect", help="Collect Amazon Bedrock batch inference output files"
+    )
+    collect_parser.add_argument("--model", "-m", required=True, choices=batch_providers)
+    collect_parser.add_argument(
+        "job_output", help="Local copy of the batch job's output location"
+    )
+    collect_parser.set_defaults(handler=batch_collect)
+
+    list_parser = subparsers.add_parser("list", help="List the available providers")
+    list_parser.set_defaults(handler=list_providers)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
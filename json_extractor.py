@@ -0,0 +1,205 @@
+"""
+# Title: Extract and validate JSON results from model responses
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import json
+import logging
+import threading
+from collections import Counter
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+SCORES = (0, 1, 2)
+DECODER = json.JSONDecoder()
+
+# Parse outcomes: the whole response was the JSON object, the object was extracted
+# from surrounding prose or a code fence, a truncated object was closed, or no valid
+# object was found
+PARSE_STATS = Counter(direct=0, extracted=0, repaired=0, failed=0)
+STATS_LOCK = threading.Lock()
+
+
+class JsonObjectScanner:
+    """
+    Incremental, brace- and quote-aware scanner for the first top-level JSON object.
+
+    Text can be fed in chunks as it streams in. The scanner tracks the nesting depth
+    and whether it is inside a string, so braces within strings and nested objects
+    are handled, and reports as soon as the first object is closed. Text before the
+    first opening brace, such as prose or a code fence, is skipped.
+    """
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.start = None  # offset of the opening brace
+        self.end = None  # offset just past the closing brace
+        self.offset = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Scan the next chunk of text.
+
+        Args:
+            chunk (str): The next chunk of the response.
+
+        Returns:
+            bool: True once the first top-level object is complete.
+        """
+        if self.complete:
+            return True
+
+        for index, char in enumerate(chunk):
+            if self.depth == 0:
+                if char == "{":
+                    self.depth = 1
+                    self.start = self.offset + index
+                continue
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = self.offset + index + 1
+                    break
+
+        self.offset += len(chunk)
+        return self.complete
+
+    def closing(self) -> str:
+        """
+        Get the characters that would close an unfinished object, e.g. after the
+        response was cut off by the maximum number of tokens.
+
+        Returns:
+            str: The closing quote (if inside a string) and braces.
+        """
+        if self.start is None or self.complete:
+            return ""
+        return ('"' if self.in_string else "") + "}" * self.depth
+
+
+def validate_result(value) -> dict:
+    """
+    Validate a parsed object against the {score, explanation} result schema.
+
+    A score sent as a numeric string (e.g., "2") or an integral float (e.g., 2.0) is
+    converted to an integer. If the
+    object wraps the result in a single nested object, the nested object is used.
+
+    Args:
+        value: The parsed JSON value.
+
+    Returns:
+        dict: The result with an integer "score" and a string "explanation", or None
+              if the value does not match the schema.
+    """
+    if not isinstance(value, dict):
+        return None
+
+    if "score" not in value:
+        nested = [item for item in value.values() if isinstance(item, dict)]
+        return validate_result(nested[0]) if len(nested) == 1 else None
+
+    score = value["score"]
+    if isinstance(score, str) and score.strip().lstrip("-").isdigit():
+        score = int(score.strip())
+    elif isinstance(score, float) and score.is_integer():
+        score = int(score)
+    if isinstance(score, bool) or not isinstance(score, int) or score not in SCORES:
+        return None
+
+    explanation = value.get("explanation", "")
+    if not isinstance(explanation, str):
+        explanation = json.dumps(explanation)
+
+    result = dict(value)
+    result["score"] = score
+    result["explanation"] = explanation
+    return result
+
+
+def extract_result(response: str) -> tuple:
+    """
+    Extract the first valid {score, explanation} object from a model response.
+
+    The response is tried as-is first. Otherwise each opening brace is decoded in
+    place, without copying the text, so objects in prose or code fences and objects
+    containing braces in strings are found. Finally, an object cut off before its
+    end is closed and decoded.
+
+    Args:
+        response (str): The raw response text.
+
+    Returns:
+        tuple: The validated result (or None) and the outcome: "direct", "extracted",
+               "repaired" or "failed".
+    """
+    text = response.strip()
+    try:
+        result = validate_result(json.loads(text))
+        if result is not None:
+            return result, "direct"
+    except json.JSONDecodeError:
+        pass
+
+    index = text.find("{")
+    while index != -1:
+        try:
+            value, _ = DECODER.raw_decode(text, index)
+            result = validate_result(value)
+            if result is not None:
+                return result, "extracted"
+        except json.JSONDecodeError:
+            pass
+        index = text.find("{", index + 1)
+
+    scanner = JsonObjectScanner()
+    scanner.feed(text)
+    closing = scanner.closing()
+    if closing:
+        try:
+            result = validate_result(json.loads(text[scanner.start :] + closing))
+            if result is not None:
+                return result, "repaired"
+        except json.JSONDecodeError:
+            pass
+
+    return None, "failed"
+
+
+def record_outcome(outcome: str) -> None:
+    with STATS_LOCK:
+        PARSE_STATS[outcome] += 1
+
+
+def log_parse_stats() -> None:
+    """Log how the model responses were parsed."""
+    total = sum(PARSE_STATS.values())
+    failure_rate = PARSE_STATS["failed"] / total if total else 0
+    logging.info(
+        f"Response parsing: {PARSE_STATS['direct']} direct, "
+        f"{PARSE_STATS['extracted']} extracted, {PARSE_STATS['repaired']} repaired, "
+        f"{PARSE_STATS['failed']} failed ({failure_rate:.0%} failure rate)"
+    )
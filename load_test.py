@@ -0,0 +1,316 @@
+"""
+# Title: Measure end-to-end throughput and tail latency against the mock provider server
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import benchmark
+import evaluation_engine
+import fan_out_runner
+import mock_provider_server
+import providers as provider_registry
+import results_writer
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+LOAD_TEST_DIRECTORY = "benchmarks/load/"
+DIRECTORY = "input/"
+PERCENTILES = (50, 90, 99)
+
+# Placeholder credentials and endpoints, so no real keys are sent to the mock server;
+# the endpoints' hosts are replaced by IQA_ENDPOINT_URL
+MOCK_ENVIRONMENT = {
+    "ANTHROPIC_API_KEY": "mock",
+    "AWS_ACCESS_KEY_ID": "mock",
+    "AWS_SECRET_ACCESS_KEY": "mock",
+    "AWS_SESSION_TOKEN": "mock",
+    "AZURE_AI_LLAMA11B_CHAT_ENDPOINT": "https://mock.models.ai.azure.com",
+    "AZURE_AI_LLAMA11B_CHAT_KEY": "mock",
+    "AZURE_AI_LLAMA90B_CHAT_ENDPOINT": "https://mock.models.ai.azure.com",
+    "AZURE_AI_LLAMA90B_CHAT_KEY": "mock",
+    "AZURE_AI_PHI_CHAT_ENDPOINT": "https://mock.models.ai.azure.com",
+    "AZURE_AI_PHI_CHAT_KEY": "mock",
+    "AZURE_GPT4O_API_KEY": "mock",
+    "AZURE_GPT4O_MODEL_ENDPOINT": "https://mock.openai.azure.com/openai/deployments/"
+    "gpt-4o/chat/completions?api-version=2024-08-01-preview",
+    "GOOGLE_GEMINI_API_KEY": "mock",
+    "MISTRAL_API_KEY": "mock",
+    "NVIDIA_API_KEY": "mock",
+}
+
+
+def make_images(count: int, megapixels: float, directory: str) -> str:
+    """
+    Write synthetic JPEG images for the load test, each one distinct.
+
+    Images left in the directory by an earlier run are reused, and those beyond
+    `count` are removed, so the run evaluates exactly `count` images.
+
+    Args:
+        count (int): The number of images.
+        megapixels (float): The size of each image, in megapixels.
+        directory (str): The directory the images are written to.
+
+    Returns:
+        str: The directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    source_path = benchmark.make_synthetic_image(megapixels, "jpeg")
+    with open(source_path, "rb") as f:
+        source_bytes = f.read()
+
+    for i in range(count):
+        path = os.path.join(directory, f"load_{i:05d}.jpg")
+        if not os.path.exists(path):
+            # A JPEG comment after the start-of-image marker makes each file unique
+            comment = f"load test image {i}".encode()
+            segment = b"\xff\xfe" + (len(comment) + 2).to_bytes(2, "big") + comment
+            with open(path, "wb") as f:
+                f.write(source_bytes[:2] + segment + source_bytes[2:])
+
+    names = {f"load_{i:05d}.jpg" for i in range(count)}
+    for filename in os.listdir(directory):
+        if filename not in names:
+            os.remove(os.path.join(directory, filename))
+
+    return directory
+
+
+def summarize_provider(provider, elapsed: float) -> dict:
+    """
+    Summarize the throughput and latency of a provider from its JSONL records.
+
+    Args:
+        provider (module): The provider module.
+        elapsed (float): The wall-clock time of the run, in seconds.
+
+    Returns:
+        dict: The image counts, images per second, latency percentiles, and the
+              highest RSS sampled while an image was prepared.
+    """
+    records = list(
+        results_writer.read_records(results_writer.jsonl_path(provider.OUTPUT_PATH))
+    )
+    failed = list(
+        results_writer.read_records(results_writer.dead_letter_path(provider.OUTPUT_PATH))
+    )
+    summary = {
+        "model_id": provider.MODEL_ID,
+        "images": len(records),
+        "failed": len(failed),
+        "unparsed": sum(1 for record in records if record.get("score") == -1),
+        "elapsed_s": round(elapsed, 3),
+        "images_per_s": round(len(records) / elapsed, 2) if elapsed else None,
+    }
+
+    latencies = {
+        "total": [record["time"] for record in records],
+        "request": [record.get("timings", {}).get("request") for record in records],
+        "ttft": [record.get("timings", {}).get("ttft") for record in records],
+        "queue": [record.get("timings", {}).get("queue") for record in records],
+        "dispatch": [
+            record.get("timings", {}).get("dispatch") for record in records
+        ],
+    }
+    for name, values in latencies.items():
+        values = [value for value in values if value is not None]
+        if values:
+            summary[f"{name}_ms"] = {
+                f"p{percent}": round(
+                    benchmark.percentile(values, percent) * 1000, 1
+                )
+                for percent in PERCENTILES
+            }
+
+    peak_rss = [
+        record["peak_rss_bytes"] for record in records if "peak_rss_bytes" in record
+    ]
+    if peak_rss:
+        summary["peak_rss_mb"] = round(max(peak_rss) / 1e6, 1)
+
+    return summary
+
+
+def run_load_test(names: list, directory: str, fan_out: bool) -> tuple:
+    """
+    Evaluate the images with the selected providers, against the mock server.
+
+    Args:
+        names (list): The registered provider names.
+        directory (str): The directory containing the images.
+        fan_out (bool): Run the providers together, loading each image once, instead
+                        of one after the other.
+
+    Returns:
+        tuple: The summary of each provider, and the total wall-clock time.
+    """
+    providers = [provider_registry.load_provider(name) for name in names]
+    for provider in providers:
+        # Keep the load test's results apart from the real results
+        provider.OUTPUT_PATH = os.path.join(
+            LOAD_TEST_DIRECTORY, "output", os.path.basename(provider.OUTPUT_PATH)
+        )
+
+    summaries = []
+    start = time.perf_counter()
+    if fan_out:
+        asyncio.run(fan_out_runner.run_fan_out(providers, directory=directory))
+        elapsed = time.perf_counter() - start
+        summaries = [summarize_provider(provider, elapsed) for provider in providers]
+    else:
+        for provider in providers:
+            provider_start = time.perf_counter()
+            asyncio.run(evaluation_engine.evaluate_provider(provider, directory))
+            summaries.append(
+                summarize_provider(provider, time.perf_counter() - provider_start)
+            )
+    return summaries, time.perf_counter() - start
+
+
+def log_summary(summaries: list, server_stats: dict) -> None:
+    for summary in summaries:
+        latency = summary.get("total_ms", {})
+        memory = (
+            f"  peak RSS {summary['peak_rss_mb']} MB" if "peak_rss_mb" in summary else ""
+        )
+        logging.info(
+            f"{summary['model_id']:<40} {summary['images']:>5} images "
+            f"{summary['failed']:>4} failed {summary['unparsed']:>4} unparsed "
+            f"{summary['images_per_s']:>7} images/s  "
+            + "  ".join(f"{key} {value:.0f} ms" for key, value in latency.items())
+            + memory
+        )
+    logging.info(f"Mock server: {json.dumps(server_stats, sort_keys=True)}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Measure images/sec and tail latency of the evaluation pipeline "
+        "against the local mock provider server."
+    )
+    parser.add_argument(
+        "--model",
+        "-m",
+        action="append",
+        choices=provider_registry.provider_names(),
+        metavar="PROVIDER",
+        help="Provider to load test; repeat for several (default: anthropic_claude)",
+    )
+    parser.add_argument(
+        "--fan-out",
+        action="store_true",
+        help="Run the providers together, loading each image once",
+    )
+    parser.add_argument(
+        "--directory", help=f"Directory containing the images (default: {DIRECTORY})"
+    )
+    parser.add_argument(
+        "--images",
+        type=int,
+        help="Generate this many distinct synthetic images instead of using --directory",
+    )
+    parser.add_argument(
+        "--megapixels",
+        type=float,
+        default=1,
+        help="Size of the synthetic images, in megapixels",
+    )
+    parser.add_argument("--concurrency", type=int, help="Sets IQA_MAX_CONCURRENCY")
+    parser.add_argument(
+        "--requests-per-minute", type=float, help="Sets IQA_REQUESTS_PER_MINUTE"
+    )
+    parser.add_argument(
+        "--tokens-per-minute", type=float, help="Sets IQA_TOKENS_PER_MINUTE"
+    )
+    parser.add_argument("--stream", action="store_true", help="Sets IQA_STREAM")
+    parser.add_argument(
+        "--preprocess-processes",
+        help="Sets IQA_PREPROCESS_PROCESSES, a number or 'auto'",
+    )
+    parser.add_argument(
+        "--output", help="write the results to this JSON file, in addition to the log"
+    )
+    mock_provider_server.add_behavior_arguments(parser)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    names = list(dict.fromkeys(args.model or ["anthropic_claude"]))
+
+    directory = args.directory or DIRECTORY
+    if args.images:
+        directory = make_images(
+            args.images,
+            args.megapixels,
+            os.path.join(LOAD_TEST_DIRECTORY, f"images_{args.megapixels:g}mp"),
+        )
+
+    behavior = mock_provider_server.create_behavior(args)
+    server = mock_provider_server.create_server(behavior, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ.update(MOCK_ENVIRONMENT)
+    os.environ["IQA_ENDPOINT_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ["IQA_RESPONSE_CACHE"] = "off"
+    os.environ["IQA_UPLOAD_CACHE"] = "off"
+    if args.concurrency:
+        os.environ["IQA_MAX_CONCURRENCY"] = str(args.concurrency)
+    if args.requests_per_minute:
+        os.environ["IQA_REQUESTS_PER_MINUTE"] = str(args.requests_per_minute)
+    if args.tokens_per_minute:
+        os.environ["IQA_TOKENS_PER_MINUTE"] = str(args.tokens_per_minute)
+    if args.stream:
+        os.environ["IQA_STREAM"] = "on"
+    if args.preprocess_processes:
+        os.environ["IQA_PREPROCESS_PROCESSES"] = args.preprocess_processes
+
+    try:
+        summaries, elapsed = run_load_test(names, directory, args.fan_out)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    log_summary(summaries, dict(behavior.stats))
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "elapsed_s": round(elapsed, 3),
+                    "providers": summaries,
+                    "server": dict(behavior.stats),
+                    "settings": vars(args),
+                },
+                f,
+                indent=2,
+            )
+        logging.info(f"Results written to {args.output}")
+
+    # Without injected throttling, errors or timeouts, every image must succeed, e.g.
+    # by falling back from a rejected structured output mode
+    faults = args.throttle_rate or args.error_rate or args.timeout_rate
+    failed = sum(summary["failed"] for summary in summaries)
+    if failed and not faults:
+        logging.warning(f"{failed} images failed without injected faults")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
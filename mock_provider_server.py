@@ -0,0 +1,815 @@
+"""
+# Title: Local mock provider server for load testing image quality assessments
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import argparse
+import hashlib
+import http.server
+import json
+import logging
+import math
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+import zlib
+from collections import Counter
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+HOST = "127.0.0.1"
+PORT = 8765
+LATENCY_MS = 800  # median response latency
+LATENCY_SIGMA = 0.5  # lognormal shape; 0 for a fixed latency
+RETRY_AFTER = 1  # seconds, sent with throttled responses
+TIMEOUT_SECONDS = 30  # how long a timed-out request is held before the connection drops
+CHUNK_CHARS = 12  # characters of the reply in each streamed chunk
+CHUNK_DELAY_MS = 10
+TRAILING_TEXT = "\n\nI hope this assessment is helpful for your review of the image."
+FAULTS = ("throttle", "error", "timeout", "malformed")
+
+EXPLANATIONS = {
+    0: "The image is blurry and underexposed, with heavy noise in the shadows.",
+    1: "The image is reasonably sharp and well exposed, but the framing could be improved.",
+    2: "The image is tack-sharp, with ideal exposure, accurate color and excellent composition.",
+}
+
+# Replies that are not a valid result: cut off by the maximum tokens, prose only,
+# and a result with the wrong field types
+MALFORMED_REPLIES = [
+    '{"score": 1, "explanation": "The image is reasonably sharp and well exp',
+    "I'm sorry, but I can't provide an assessment of this image.",
+    '{"score": "good", "explanation": null}',
+]
+
+# Minimal discovery document of the Gemini File API, for resumable media uploads
+DISCOVERY_DOCUMENT = {
+    "kind": "discovery#restDescription",
+    "discoveryVersion": "v1",
+    "id": "generativelanguage:v1beta",
+    "name": "generativelanguage",
+    "version": "v1beta",
+    "protocol": "rest",
+    "servicePath": "",
+    "batchPath": "batch",
+    "parameters": {"key": {"type": "string", "location": "query"}},
+    "schemas": {
+        "File": {
+            "id": "File",
+            "type": "object",
+            "properties": {
+                "name": {"type": "string"},
+                "displayName": {"type": "string"},
+            },
+        },
+        "CreateFileRequest": {
+            "id": "CreateFileRequest",
+            "type": "object",
+            "properties": {"file": {"$ref": "File"}},
+        },
+        "CreateFileResponse": {
+            "id": "CreateFileResponse",
+            "type": "object",
+            "properties": {"file": {"$ref": "File"}},
+        },
+    },
+    "resources": {
+        "media": {
+            "methods": {
+                "upload": {
+                    "id": "generativelanguage.media.upload",
+                    "path": "v1beta/files",
+                    "httpMethod": "POST",
+                    "parameters": {},
+                    "parameterOrder": [],
+                    "request": {"$ref": "CreateFileRequest"},
+                    "response": {"$ref": "CreateFileResponse"},
+                    "supportsMediaUpload": True,
+                    "mediaUpload": {
+                        "accept": ["*/*"],
+                        "protocols": {
+                            "simple": {"multipart": True, "path": "/upload/v1beta/files"},
+                            "resumable": {
+                                "multipart": True,
+                                "path": "/resumable/upload/v1beta/files",
+                            },
+                        },
+                    },
+                }
+            }
+        }
+    },
+}
+
+
+class MockBehavior:
+    """
+    The latency and failures of the mock provider server.
+
+    Each request waits for a latency drawn from a lognormal distribution, then fails
+    with one of the faults at its rate, or succeeds. Successful replies are a result
+    chosen by a digest of the request body, so a repeated request gets the same result.
+
+    Args:
+        latency_ms (float): The median latency, in milliseconds.
+        latency_sigma (float): The lognormal shape; 0 for a fixed latency.
+        throttle_rate (float): The fraction of requests throttled (HTTP 429).
+        error_rate (float): The fraction of requests failed (HTTP 503).
+        timeout_rate (float): The fraction of requests held until the connection is
+                              dropped without a response.
+        malformed_rate (float): The fraction of replies that are not a valid result.
+        retry_after (float): The Retry-After seconds of throttled responses.
+        timeout_seconds (float): How long a timed-out request is held.
+        chunk_delay_ms (float): The delay between streamed chunks, in milliseconds.
+        seed (int, optional): The random seed of the latencies and faults.
+        reject_json_schema (bool): Reject chat completions with a json_schema
+                                   response_format (HTTP 400), like a model version
+                                   without structured outputs.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = LATENCY_MS,
+        latency_sigma: float = LATENCY_SIGMA,
+        throttle_rate: float = 0.0,
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+        retry_after: float = RETRY_AFTER,
+        timeout_seconds: float = TIMEOUT_SECONDS,
+        chunk_delay_ms: float = CHUNK_DELAY_MS,
+        seed: int = None,
+        reject_json_schema: bool = False,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.rates = {
+            "throttle": throttle_rate,
+            "error": error_rate,
+            "timeout": timeout_rate,
+            "malformed": malformed_rate,
+        }
+        self.retry_after = retry_after
+        self.timeout_seconds = timeout_seconds
+        self.chunk_delay = chunk_delay_ms / 1000
+        self.random = random.Random(seed)
+        self.reject_json_schema = reject_json_schema
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def latency(self) -> float:
+        """
+        Draw the latency of a request.
+
+        Returns:
+            float: The latency, in seconds.
+        """
+        if self.latency_ms <= 0:
+            return 0.0
+        with self.lock:
+            if self.latency_sigma <= 0:
+                return self.latency_ms / 1000
+            return (
+                self.random.lognormvariate(math.log(self.latency_ms), self.latency_sigma)
+                / 1000
+            )
+
+    def fault(self) -> str:
+        """
+        Draw the fault of a request.
+
+        Returns:
+            str: One of FAULTS, or None if the request succeeds.
+        """
+        with self.lock:
+            draw = self.random.random()
+        for fault in FAULTS:
+            if draw < self.rates[fault]:
+                return fault
+            draw -= self.rates[fault]
+        return None
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.stats[key] += 1
+
+
+def make_reply(body: bytes, malformed: bool = False) -> str:
+    """
+    Make the model's reply to a request.
+
+    Args:
+        body (bytes): The request body, which selects the result.
+        malformed (bool): Reply with text that is not a valid result.
+
+    Returns:
+        str: The reply text.
+    """
+    digest = hashlib.sha256(body).digest()
+    if malformed:
+        return MALFORMED_REPLIES[digest[1] % len(MALFORMED_REPLIES)]
+    score = digest[0] % len(EXPLANATIONS)
+    return json.dumps({"score": score, "explanation": EXPLANATIONS[score]})
+
+
+def tool_input(reply: str) -> dict:
+    # Tool input is always an object; a malformed reply becomes an invalid result
+    try:
+        result = json.loads(reply)
+    except json.JSONDecodeError:
+        result = None
+    return result if isinstance(result, dict) else {"explanation": reply}
+
+
+def estimate_tokens(text) -> int:
+    # Roughly four characters per token, as in rate_limiter.estimate_tokens
+    return max(1, len(text) // 4)
+
+
+def split_chunks(text: str) -> list:
+    return [text[i : i + CHUNK_CHARS] for i in range(0, len(text), CHUNK_CHARS)]
+
+
+def encode_event(event_type: str, payload: dict) -> bytes:
+    """
+    Encode an event in the AWS event stream format of Bedrock's ConverseStream.
+
+    Each message has a prelude (total and headers length), a prelude CRC32, the
+    headers, the JSON payload, and a message CRC32.
+
+    Args:
+        event_type (str): The event type, e.g. 'contentBlockDelta'.
+        payload (dict): The event payload.
+
+    Returns:
+        bytes: The encoded message.
+    """
+    headers = b""
+    for name, value in (
+        (":event-type", event_type),
+        (":content-type", "application/json"),
+        (":message-type", "event"),
+    ):
+        name, value = name.encode(), value.encode()
+        # Header value type 7 is a string
+        headers += struct.pack(">B", len(name)) + name
+        headers += struct.pack(">BH", 7, len(value)) + value
+    body = json.dumps(payload).encode()
+    prelude = struct.pack(">II", 12 + len(headers) + len(body) + 4, len(headers))
+    message = prelude + struct.pack(">I", zlib.crc32(prelude)) + headers + body
+    return message + struct.pack(">I", zlib.crc32(message))
+
+
+class MockProviderHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers requests in the wire format of each provider:
+
+    - Anthropic Messages: POST /v1/messages, with text or tool use, and SSE streaming
+    - Amazon Bedrock Converse: POST /model/{id}/converse and /model/{id}/converse-stream
+    - OpenAI-style chat completions (Azure OpenAI, Azure AI Inference, Mistral,
+      NVIDIA): POST .../chat/completions and /v1/vlm/..., with SSE streaming
+    - Google Gemini: POST /v1beta/models/{id}:generateContent and
+      :streamGenerateContent, and File API uploads
+
+    GET /stats returns the request and fault counts.
+    """
+
+    protocol_version = "HTTP/1.1"
+    behavior = MockBehavior()
+    files = {}
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(format % args)
+
+    def do_GET(self) -> None:
+        path = urllib.parse.urlsplit(self.path).path
+        if path == "/stats":
+            self.send_json(200, dict(self.behavior.stats))
+        elif path == "/$discovery/rest":
+            root_url = f"http://{self.headers['Host']}/"
+            self.send_json(
+                200, dict(DISCOVERY_DOCUMENT, rootUrl=root_url, baseUrl=root_url)
+            )
+        elif path.startswith("/v1beta/files/") and path[len("/v1beta/") :] in self.files:
+            self.send_json(200, self.files[path[len("/v1beta/") :]])
+        else:
+            self.send_json(404, {"error": {"code": 404, "message": "Not found"}})
+
+    def do_PUT(self) -> None:
+        self.do_POST()
+
+    def do_POST(self) -> None:
+        path = urllib.parse.urlsplit(self.path).path
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if "/upload/v1beta/files" in path:
+            self.upload_file(path, body)
+            return
+
+        routes = [
+            (r"^/v1/messages$", "anthropic"),
+            (r"^/model/[^/]+/converse$", "bedrock"),
+            (r"^/model/[^/]+/converse-stream$", "bedrock"),
+            (r"/chat/completions$|^/v1/vlm/", "openai"),
+            (r"^/v1beta/models/[^/]+:(generate|streamGenerate)Content$", "gemini"),
+        ]
+        api = next((api for pattern, api in routes if re.search(pattern, path)), None)
+        if api is None:
+            self.send_json(404, {"error": {"code": 404, "message": "Not found"}})
+            return
+
+        self.start_time = time.time()
+        behavior = self.behavior
+        behavior.count("requests")
+        behavior.count(f"requests.{api}")
+        time.sleep(behavior.latency())
+
+        fault = behavior.fault()
+        if fault is not None:
+            behavior.count(fault)
+        if fault == "timeout":
+            # Hold the request, then drop the connection without a response
+            time.sleep(behavior.timeout_seconds)
+            self.close_connection = True
+            return
+        if fault in ("throttle", "error"):
+            self.send_error_response(api, 429 if fault == "throttle" else 503)
+            return
+
+        request = json.loads(body or b"{}")
+        response_format = request.get("response_format") or {}
+        if (
+            api == "openai"
+            and behavior.reject_json_schema
+            and response_format.get("type") == "json_schema"
+        ):
+            behavior.count("rejected")
+            self.send_json(
+                400,
+                {
+                    "error": {
+                        "code": "BadRequest",
+                        "message": "Invalid parameter: 'response_format' of type "
+                        "'json_schema' is not supported with this model.",
+                    }
+                },
+            )
+            return
+
+        reply = make_reply(body, fault == "malformed")
+        usage = (estimate_tokens(body), estimate_tokens(reply))
+        try:
+            if api == "anthropic":
+                self.reply_anthropic(request, reply, usage)
+            elif api == "bedrock":
+                self.reply_bedrock(request, reply, usage, path.endswith("-stream"))
+            elif api == "openai":
+                self.reply_chat_completion(request, reply, usage)
+            else:
+                self.reply_gemini(path, reply, usage)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading a stream once the result was complete
+            behavior.count("cancelled")
+            self.close_connection = True
+
+    def send_json(self, status: int, body, headers: dict = None) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_response(self, api: str, status: int) -> None:
+        """
+        Send a throttling (429) or server error (503) in the provider's format.
+
+        Args:
+            api (str): The provider API.
+            status (int): The HTTP status code.
+        """
+        throttled = status == 429
+        message = "Rate limit exceeded" if throttled else "Service unavailable"
+        headers = {"Retry-After": str(self.behavior.retry_after)} if throttled else {}
+        if api == "anthropic":
+            error_type = "rate_limit_error" if throttled else "overloaded_error"
+            body = {"type": "error", "error": {"type": error_type, "message": message}}
+        elif api == "bedrock":
+            error_type = (
+                "ThrottlingException" if throttled else "ServiceUnavailableException"
+            )
+            headers["x-amzn-ErrorType"] = error_type
+            body = {"message": message}
+        elif api == "gemini":
+            error_status = "RESOURCE_EXHAUSTED" if throttled else "UNAVAILABLE"
+            body = {"error": {"code": status, "message": message, "status": error_status}}
+        else:
+            body = {"error": {"code": str(status), "message": message}}
+        self.send_json(status, body, headers)
+
+    def start_stream(self, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_chunk(self, data: bytes, delay: bool = True) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+        if delay:
+            time.sleep(self.behavior.chunk_delay)
+
+    def end_stream(self) -> None:
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+        self.behavior.count("streams_completed")
+
+    def write_sse(self, data, event: str = None) -> None:
+        text = data if isinstance(data, str) else json.dumps(data)
+        prefix = f"event: {event}\n" if event else ""
+        self.write_chunk(f"{prefix}data: {text}\n\n".encode())
+
+    def reply_anthropic(self, request: dict, reply: str, usage: tuple) -> None:
+        message_id = f"msg_{uuid.uuid4().hex[:24]}"
+        model = request.get("model", "mock")
+        tool = next(iter(request.get("tools") or []), None)
+        if tool is not None:
+            block = {
+                "type": "tool_use",
+                "id": f"toolu_{uuid.uuid4().hex[:24]}",
+                "name": tool["name"],
+                "input": tool_input(reply),
+            }
+            stop_reason = "tool_use"
+        else:
+            block = {"type": "text", "text": reply}
+            stop_reason = "end_turn"
+
+        if not request.get("stream"):
+            self.send_json(
+                200,
+                {
+                    "id": message_id,
+                    "type": "message",
+                    "role": "assistant",
+                    "model": model,
+                    "content": [block],
+                    "stop_reason": stop_reason,
+                    "stop_sequence": None,
+                    "usage": {"input_tokens": usage[0], "output_tokens": usage[1]},
+                },
+            )
+            return
+
+        self.start_stream("text/event-stream")
+        self.write_sse(
+            {
+                "type": "message_start",
+                "message": {
+                    "id": message_id,
+                    "type": "message",
+                    "role": "assistant",
+                    "model": model,
+                    "content": [],
+                    "stop_reason": None,
+                    "stop_sequence": None,
+                    "usage": {"input_tokens": usage[0], "output_tokens": 1},
+                },
+            },
+            "message_start",
+        )
+        if tool is not None:
+            start = dict(block, input={})
+            text = json.dumps(block["input"])
+            delta_type, delta_key = "input_json_delta", "partial_json"
+        else:
+            start = {"type": "text", "text": ""}
+            text = reply + TRAILING_TEXT
+            delta_type, delta_key = "text_delta", "text"
+        self.write_sse(
+            {"type": "content_block_start", "index": 0, "content_block": start},
+            "content_block_start",
+        )
+        for chunk in split_chunks(text):
+            self.write_sse(
+                {
+                    "type": "content_block_delta",
+                    "index": 0,
+                    "delta": {"type": delta_type, delta_key: chunk},
+                },
+                "content_block_delta",
+            )
+        self.write_sse({"type": "content_block_stop", "index": 0}, "content_block_stop")
+        self.write_sse(
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                "usage": {"output_tokens": usage[1]},
+            },
+            "message_delta",
+        )
+        self.write_sse({"type": "message_stop"}, "message_stop")
+        self.end_stream()
+
+    def reply_bedrock(self, request: dict, reply: str, usage: tuple, stream: bool) -> None:
+        tools = (request.get("toolConfig") or {}).get("tools") or []
+        tool = tools[0]["toolSpec"] if tools else None
+        tool_use_id = f"tooluse_{uuid.uuid4().hex[:22]}"
+        stop_reason = "tool_use" if tool is not None else "end_turn"
+        usage = {
+            "inputTokens": usage[0],
+            "outputTokens": usage[1],
+            "totalTokens": sum(usage),
+        }
+        latency_ms = int((time.time() - self.start_time) * 1000)
+
+        if not stream:
+            if tool is not None:
+                content = {
+                    "toolUse": {
+                        "toolUseId": tool_use_id,
+                        "name": tool["name"],
+                        "input": tool_input(reply),
+                    }
+                }
+            else:
+                content = {"text": reply}
+            self.send_json(
+                200,
+                {
+                    "output": {"message": {"role": "assistant", "content": [content]}},
+                    "stopReason": stop_reason,
+                    "usage": usage,
+                    "metrics": {"latencyMs": latency_ms},
+                },
+            )
+            return
+
+        self.start_stream("application/vnd.amazon.eventstream")
+        self.write_chunk(encode_event("messageStart", {"role": "assistant"}))
+        if tool is not None:
+            self.write_chunk(
+                encode_event(
+                    "contentBlockStart",
+                    {
+                        "start": {
+                            "toolUse": {"toolUseId": tool_use_id, "name": tool["name"]}
+                        },
+                        "contentBlockIndex": 0,
+                    },
+                )
+            )
+            chunks = split_chunks(json.dumps(tool_input(reply)))
+            deltas = [{"toolUse": {"input": chunk}} for chunk in chunks]
+        else:
+            chunks = split_chunks(reply + TRAILING_TEXT)
+            deltas = [{"text": chunk} for chunk in chunks]
+        for delta in deltas:
+            self.write_chunk(
+                encode_event(
+                    "contentBlockDelta", {"delta": delta, "contentBlockIndex": 0}
+                )
+            )
+        self.write_chunk(encode_event("contentBlockStop", {"contentBlockIndex": 0}))
+        self.write_chunk(encode_event("messageStop", {"stopReason": stop_reason}))
+        self.write_chunk(
+            encode_event(
+                "metadata", {"usage": usage, "metrics": {"latencyMs": latency_ms}}
+            ),
+            delay=False,
+        )
+        self.end_stream()
+
+    def reply_chat_completion(self, request: dict, reply: str, usage: tuple) -> None:
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = request.get("model") or "mock"
+        created = int(time.time())
+        usage = {
+            "prompt_tokens": usage[0],
+            "completion_tokens": usage[1],
+            "total_tokens": sum(usage),
+        }
+
+        if not request.get("stream"):
+            self.send_json(
+                200,
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": reply},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+            return
+
+        def chunk(delta: dict, finish_reason: str = None, **fields) -> dict:
+            return dict(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                    ],
+                },
+                **fields,
+            )
+
+        self.start_stream("text/event-stream")
+        self.write_sse(chunk({"role": "assistant", "content": ""}))
+        for text in split_chunks(reply + TRAILING_TEXT):
+            self.write_sse(chunk({"content": text}))
+        self.write_sse(chunk({}, "stop", usage=usage))
+        self.write_sse("[DONE]")
+        self.end_stream()
+
+    def reply_gemini(self, path: str, reply: str, usage: tuple) -> None:
+        model = path.split("/")[-1].split(":")[0]
+
+        def response(text: str, finish_reason: str = None) -> dict:
+            candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+            if finish_reason:
+                candidate["finishReason"] = finish_reason
+            return {
+                "candidates": [candidate],
+                "usageMetadata": {
+                    "promptTokenCount": usage[0],
+                    "candidatesTokenCount": usage[1],
+                    "totalTokenCount": sum(usage),
+                },
+                "modelVersion": model,
+            }
+
+        if path.endswith(":generateContent"):
+            self.send_json(200, response(reply, "STOP"))
+            return
+
+        # The REST transport streams a JSON array of responses
+        chunks = split_chunks(reply + TRAILING_TEXT)
+        self.start_stream("application/json")
+        for i, text in enumerate(chunks):
+            finish_reason = "STOP" if i == len(chunks) - 1 else None
+            separator = "[" if i == 0 else ","
+            self.write_chunk((separator + json.dumps(response(text, finish_reason))).encode())
+        self.write_chunk(b"]", delay=False)
+        self.end_stream()
+
+    def upload_file(self, path: str, body: bytes) -> None:
+        """
+        Accept a Gemini File API upload, in one request or with the resumable protocol:
+        the metadata is posted first, then the file is sent to the returned location.
+        """
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        if query.get("uploadType") == ["resumable"] and "upload_id" not in query:
+            mime_type = self.headers.get("X-Upload-Content-Type", "")
+            location = f"http://{self.headers['Host']}{path}?" + urllib.parse.urlencode(
+                {"upload_id": uuid.uuid4().hex, "mime_type": mime_type}
+            )
+            self.send_json(200, {}, {"Location": location})
+            return
+
+        self.behavior.count("uploads")
+        name = f"files/{uuid.uuid4().hex[:12]}"
+        file = {
+            "name": name,
+            "displayName": name,
+            "mimeType": query.get("mime_type", [self.headers.get("Content-Type")])[0],
+            "sizeBytes": str(len(body)),
+            "uri": f"http://{self.headers['Host']}/v1beta/{name}",
+            "state": "ACTIVE",
+        }
+        self.files[name] = file
+        self.send_json(200, {"file": file})
+
+
+class MockProviderServer(http.server.ThreadingHTTPServer):
+    """
+    Serves each connection in its own thread, like a provider's many frontends.
+    """
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address) -> None:
+        # Clients close idle keep-alive connections and abandon streams at will
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def create_server(
+    behavior: MockBehavior, host: str = HOST, port: int = PORT
+) -> MockProviderServer:
+    """
+    Create the mock provider server, with a thread for each connection.
+
+    Args:
+        behavior (MockBehavior): The latency and failures of the server.
+        host (str): The host to listen on.
+        port (int): The port to listen on; 0 for any free port.
+
+    Returns:
+        MockProviderServer: The server; call serve_forever() to start it.
+    """
+    handler = type(
+        "ConfiguredMockProviderHandler",
+        (MockProviderHandler,),
+        {"behavior": behavior, "files": {}},
+    )
+    return MockProviderServer((host, port), handler)
+
+
+def add_behavior_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the MockBehavior options to a command-line parser.
+
+    Args:
+        parser (ArgumentParser): The parser.
+    """
+    parser.add_argument(
+        "--latency-ms", type=float, default=LATENCY_MS, help="median latency"
+    )
+    parser.add_argument(
+        "--latency-sigma",
+        type=float,
+        default=LATENCY_SIGMA,
+        help="lognormal shape of the latency; 0 for a fixed latency",
+    )
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=RETRY_AFTER)
+    parser.add_argument("--timeout-seconds", type=float, default=TIMEOUT_SECONDS)
+    parser.add_argument("--chunk-delay-ms", type=float, default=CHUNK_DELAY_MS)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument(
+        "--reject-json-schema",
+        action="store_true",
+        help="reject chat completions with a json_schema response_format (HTTP 400)",
+    )
+
+
+def create_behavior(args: argparse.Namespace) -> MockBehavior:
+    return MockBehavior(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        malformed_rate=args.malformed_rate,
+        retry_after=args.retry_after,
+        timeout_seconds=args.timeout_seconds,
+        chunk_delay_ms=args.chunk_delay_ms,
+        seed=args.seed,
+        reject_json_schema=args.reject_json_schema,
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Serve mock model provider APIs with configurable latency and failures."
+    )
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    add_behavior_arguments(parser)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    server = create_server(create_behavior(args), args.host, args.port)
+    logging.info(
+        f"Mock provider server listening on http://{args.host}:{server.server_port}; "
+        f"set IQA_ENDPOINT_URL to this URL"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
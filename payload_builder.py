@@ -0,0 +1,144 @@
+"""
+# Title: Request payloads built with base64 encoded straight into a pre-sized buffer
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import binascii
+import json
+import logging
+
+import instrumentation
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+# Image bytes encoded per step; a multiple of 3, so no chunk but the last is padded
+ENCODE_CHUNK_BYTES = 3 * 256 * 1024
+# Stands in for the base64 image in the request while it is serialized to JSON; only
+# characters JSON leaves unescaped, like base64 itself
+IMAGE_PLACEHOLDER = "@@IQA_IMAGE_BASE64@@"
+
+
+def base64_length(size: int) -> int:
+    """
+    Get the length of the base64 encoding of a number of bytes, with padding.
+
+    Args:
+        size (int): The number of bytes.
+
+    Returns:
+        int: The number of base64 characters.
+    """
+    return 4 * ((size + 2) // 3)
+
+
+def encode_base64_into(buffer: bytearray, offset: int, image_bytes) -> int:
+    """
+    Encode bytes as base64 into a buffer, a chunk at a time.
+
+    Only one chunk's encoding is held besides the buffer, however large the image.
+
+    Args:
+        buffer (bytearray): The buffer, with room for the encoding at offset.
+        offset (int): The position in the buffer to write the encoding at.
+        image_bytes (bytes-like): The bytes to encode.
+
+    Returns:
+        int: The position in the buffer after the encoding.
+    """
+    view = memoryview(image_bytes)
+    for start in range(0, len(view), ENCODE_CHUNK_BYTES):
+        encoded = binascii.b2a_base64(
+            view[start : start + ENCODE_CHUNK_BYTES], newline=False
+        )
+        buffer[offset : offset + len(encoded)] = encoded
+        offset += len(encoded)
+    return offset
+
+
+def build_buffer(image_bytes, prefix: bytes = b"", suffix: bytes = b"") -> bytearray:
+    """
+    Build a buffer of the base64 encoded image between a prefix and a suffix.
+
+    The buffer is allocated at its final size, and the image is encoded straight into
+    it, so each byte is written once, and neither the base64 string nor a concatenated
+    copy of it is made. The RSS once the buffer is built, when the image is at its
+    largest in memory, is recorded in the current trace.
+
+    Args:
+        image_bytes (bytes-like): The image bytes.
+        prefix (bytes, optional): The bytes before the image.
+        suffix (bytes, optional): The bytes after the image.
+
+    Returns:
+        bytearray: The buffer.
+    """
+    buffer = bytearray(len(prefix) + base64_length(len(image_bytes)) + len(suffix))
+    buffer[: len(prefix)] = prefix
+    end = encode_base64_into(buffer, len(prefix), image_bytes)
+    buffer[end:] = suffix
+    instrumentation.record_memory()
+    return buffer
+
+
+def encode_base64(image_bytes) -> str:
+    """
+    Encode an image as a base64 string, for SDKs that take the image as a string.
+
+    Args:
+        image_bytes (bytes-like): The image bytes.
+
+    Returns:
+        str: The base64 encoded image.
+    """
+    return build_buffer(image_bytes).decode("ascii")
+
+
+def data_url(image_bytes, file_format: str) -> str:
+    """
+    Encode an image as a base64 data URL, for SDKs that take the image as a URL.
+
+    Args:
+        image_bytes (bytes-like): The image bytes.
+        file_format (str): The image format (e.g., 'jpeg', 'png').
+
+    Returns:
+        str: The data URL.
+    """
+    prefix = f"data:image/{file_format};base64,".encode("ascii")
+    return build_buffer(image_bytes, prefix).decode("ascii")
+
+
+def build_json_body(payload: dict, image_bytes) -> bytearray:
+    """
+    Serialize a request payload to a JSON body, with the image encoded in place.
+
+    The payload holds IMAGE_PLACEHOLDER where the base64 image goes, e.g. within a
+    data URL. The payload is serialized without the image, which keeps it small, and
+    the image is encoded straight into the body, so the body is the only full-size
+    copy made of it: there is no base64 string, data URL string, JSON string or
+    encoded JSON bytes.
+
+    Args:
+        payload (dict): The request payload, with IMAGE_PLACEHOLDER in one string.
+        image_bytes (bytes-like): The image bytes.
+
+    Returns:
+        bytearray: The UTF-8 JSON request body.
+
+    Raises:
+        ValueError: If the placeholder is not in the payload exactly once.
+    """
+    parts = json.dumps(payload).split(IMAGE_PLACEHOLDER)
+    if len(parts) != 2:
+        raise ValueError(
+            f"Expected the image placeholder once in the payload. Found {len(parts) - 1}"
+        )
+
+    prefix, suffix = (part.encode("utf-8") for part in parts)
+    return build_buffer(image_bytes, prefix, suffix)
@@ -0,0 +1,245 @@
+"""
+# Title: Process-pool image preprocessing, prefetched ahead of the model requests
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+
+import image_cache as image_caching
+import instrumentation
+import utilities
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+PREFETCH_PER_PROCESS = 2  # prepared payloads queued per process, by default
+
+
+def resize_in_process(image_path: str, max_pixels_list: list, file_format: str) -> tuple:
+    """
+    Resize and encode the variants of an image, in a pool process.
+
+    Args:
+        image_path (str): The path to the image file.
+        max_pixels_list (list): The maximum sizes to resize to.
+        file_format (str): The file format ('jpeg' or 'png').
+
+    Returns:
+        tuple: The image bytes of each variant, keyed by maximum size, and the spans
+               of the decode, resize and encode stages, to add to the parent's trace.
+    """
+    trace = instrumentation.start_trace()
+    variants = utilities.resize_variants(image_path, max_pixels_list, file_format)
+    return variants, trace.spans
+
+
+class PreprocessingPipeline:
+    """
+    Prepares the image payloads ahead of the model requests, in a pool of processes.
+
+    A producer task works through the images in order, keeping up to `prefetch`
+    images prepared or being prepared in a bounded queue, while the workers take
+    them from the queue and send them. When the queue is full, the producer waits
+    for a worker to take an image, so the memory held by prepared payloads stays
+    bounded however far the preprocessing gets ahead of the network.
+
+    Reading, hashing and the image cache stay in the event loop's threads, which
+    are I/O bound. Decoding, resizing and encoding, which are CPU bound and hold the
+    GIL in part, run in the pool's processes, so they scale across all cores.
+
+    Args:
+        directory (str): The directory containing the images.
+        filenames (list): The images to prepare, in order.
+        max_pixels_list (list): The maximum size of each payload variant. None means
+                                not resized.
+        processes (int): The number of pool processes.
+        prefetch (int, optional): The maximum number of images queued. Defaults to
+                                  PREFETCH_PER_PROCESS per process.
+        image_cache (ImageCache, optional): The cache of preprocessed payloads.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        filenames: list,
+        max_pixels_list: list,
+        processes: int,
+        prefetch: int = None,
+        image_cache: image_caching.ImageCache = None,
+    ) -> None:
+        self.directory = directory
+        self.filenames = filenames
+        self.max_pixels_list = max_pixels_list
+        self.processes = processes
+        self.prefetch = prefetch or PREFETCH_PER_PROCESS * processes
+        self.image_cache = image_cache
+        self.queue = asyncio.Queue(maxsize=self.prefetch)
+        self.executor = None
+        self.producer = None
+
+    def start_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        # Spawned, not forked, as the event loop already runs threads
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    async def __aenter__(self) -> "PreprocessingPipeline":
+        self.executor = self.start_pool()
+        self.producer = asyncio.create_task(self.produce())
+        logging.info(
+            f"Preprocessing with {self.processes} processes, "
+            f"up to {self.prefetch} images ahead"
+        )
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.producer.cancel()
+        await asyncio.gather(self.producer, return_exceptions=True)
+        # Cancel the images prepared ahead that no worker took
+        tasks = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not None:
+                item[1].cancel()
+                tasks.append(item[1])
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    async def produce(self) -> None:
+        for filename in self.filenames:
+            trace = instrumentation.RequestTrace()
+            task = asyncio.create_task(self.prepare(filename, trace))
+            await self.queue.put((filename, task, trace))
+        await self.queue.put(None)
+
+    async def prepare(self, filename: str, trace: instrumentation.RequestTrace) -> tuple:
+        """
+        Prepare the payload variants of an image.
+
+        Args:
+            filename (str): The filename of the image within the directory.
+            trace (RequestTrace): The trace the preprocessing stages are recorded in.
+
+        Returns:
+            tuple: A dict of image bytes keyed by maximum size, the file format
+                   ('jpeg' or 'png'), and the SHA-256 digest of the image file.
+        """
+        instrumentation.start_trace(trace)
+        image_path = os.path.join(self.directory, filename)
+        variants, pending, file_format, source_sha256, _ = await asyncio.to_thread(
+            utilities.load_variants, image_path, self.max_pixels_list, self.image_cache
+        )
+        if pending:
+            executor = self.executor
+            try:
+                resized, spans = await asyncio.get_running_loop().run_in_executor(
+                    executor, resize_in_process, image_path, pending, file_format
+                )
+            except concurrent.futures.process.BrokenProcessPool:
+                # A process died, e.g. out of memory on a huge image; replace the pool
+                # once, for the images still to come
+                if self.executor is executor:
+                    logging.error("A preprocessing process died, restarting the pool")
+                    self.executor = self.start_pool()
+                    executor.shutdown(wait=False)
+                raise
+            trace.spans.extend(spans)
+            await asyncio.to_thread(
+                utilities.store_variants,
+                self.image_cache,
+                source_sha256,
+                file_format,
+                resized,
+            )
+            variants.update(resized)
+
+        return variants, file_format, source_sha256
+
+    async def get(self) -> tuple:
+        """
+        Take the next image from the queue, waiting until it is prepared.
+
+        Returns:
+            tuple: The filename, its prepared payload variants (as returned by
+                   prepare), or the exception that failed them, and the trace of its
+                   preprocessing. None when all images have been taken.
+        """
+        item = await self.queue.get()
+        if item is None:
+            # Leave the end marker for the other workers
+            self.queue.put_nowait(None)
+            return None
+
+        filename, task, trace = item
+        try:
+            return filename, await task, trace
+        except Exception as e:
+            return filename, e, trace
+
+
+def get_processes() -> int:
+    """
+    Get the number of preprocessing processes from the IQA_PREPROCESS_PROCESSES
+    environment variable: a number, or "auto" for one per CPU core.
+
+    Returns:
+        int: The number of processes, or 0 to preprocess in the event loop's threads.
+    """
+    setting = os.environ.get("IQA_PREPROCESS_PROCESSES", "").lower()
+    if setting in ("", "0", "off", "false", "no"):
+        return 0
+    if setting == "auto":
+        return os.cpu_count() or 1
+    try:
+        return max(0, int(setting))
+    except ValueError:
+        logging.error("Invalid IQA_PREPROCESS_PROCESSES value. Preprocessing in threads.")
+        return 0
+
+
+def create_pipeline(
+    directory: str,
+    filenames: list,
+    max_pixels_list: list,
+    image_cache: image_caching.ImageCache = None,
+) -> PreprocessingPipeline:
+    """
+    Create the preprocessing pipeline from environment variables.
+
+    IQA_PREPROCESS_PROCESSES sets the number of processes ("auto" for one per CPU
+    core), and IQA_PREFETCH the number of images prepared ahead.
+
+    Args:
+        directory (str): The directory containing the images.
+        filenames (list): The images to prepare, in order.
+        max_pixels_list (list): The maximum size of each payload variant.
+        image_cache (ImageCache, optional): The cache of preprocessed payloads.
+
+    Returns:
+        PreprocessingPipeline: The pipeline, or None if IQA_PREPROCESS_PROCESSES is
+                               not set.
+    """
+    processes = get_processes()
+    if not processes:
+        return None
+
+    prefetch = None
+    if os.environ.get("IQA_PREFETCH"):
+        try:
+            prefetch = max(1, int(os.environ["IQA_PREFETCH"]))
+        except ValueError:
+            logging.error("Invalid IQA_PREFETCH value. Using default.")
+
+    return PreprocessingPipeline(
+        directory, filenames, max_pixels_list, processes, prefetch, image_cache
+    )
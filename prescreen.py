@@ -0,0 +1,325 @@
+"""
+# Title: Local pre-screen that scores obviously unusable images without a model call
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import concurrent.futures
+import logging
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+import utilities
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+SAMPLE_PIXELS = 512  # largest dimension of the downsampled copy that is measured
+# Side of the full-resolution center tile the noise is estimated on, as downsampling
+# averages the noise away
+NOISE_TILE_PIXELS = 512
+DARK_LEVEL = 8  # luminance at or below which a pixel is crushed to black
+BRIGHT_LEVEL = 247  # luminance at or above which a pixel is blown out to white
+# Default thresholds, well past the score-0 criteria of the prompt, so only images
+# any model would score 0 are screened out
+MIN_SHARPNESS = 5.0  # variance of the Laplacian of the downsampled copy
+MAX_CLIPPED = 0.9  # fraction of pixels crushed to black, or blown out to white
+MAX_NOISE = 30.0  # estimated standard deviation of the noise, in luminance levels
+MIN_RESOLUTION = 128  # pixels, on the largest dimension of the original image
+MAX_WORKERS = 4
+
+
+def load_luminance(image_path: str) -> tuple:
+    """
+    Load a downsampled grayscale copy of an image, and a full-resolution tile from its
+    center.
+
+    The image is decoded once, in grayscale where the format allows (JPEG).
+
+    Args:
+        image_path (str): The path to the image file.
+
+    Returns:
+        tuple: The luminance of the copy, of at most SAMPLE_PIXELS on its largest
+               dimension, and of the tile, of at most NOISE_TILE_PIXELS square, as
+               float32 arrays, and the (width, height) of the image.
+    """
+    with Image.open(image_path) as image:
+        width, height = image.size
+        image.draft("L", image.size)
+        with image.convert("L") as gray:
+            left = max(0, (width - NOISE_TILE_PIXELS) // 2)
+            top = max(0, (height - NOISE_TILE_PIXELS) // 2)
+            tile = np.asarray(
+                gray.crop(
+                    (
+                        left,
+                        top,
+                        min(width, left + NOISE_TILE_PIXELS),
+                        min(height, top + NOISE_TILE_PIXELS),
+                    )
+                ),
+                dtype=np.float32,
+            )
+            gray.thumbnail(
+                (SAMPLE_PIXELS, SAMPLE_PIXELS),
+                Image.LANCZOS,
+                reducing_gap=utilities.REDUCING_GAP,
+            )
+            return np.asarray(gray, dtype=np.float32), tile, (width, height)
+
+
+def laplacian_variance(luminance: np.ndarray) -> float:
+    """
+    Measure sharpness as the variance of the 4-neighbour Laplacian.
+
+    Blur removes the fine detail the Laplacian responds to, so an out-of-focus image
+    has a low variance.
+
+    Args:
+        luminance (np.ndarray): The luminance, a 2-D array.
+
+    Returns:
+        float: The variance of the Laplacian.
+    """
+    laplacian = (
+        luminance[:-2, 1:-1]
+        + luminance[2:, 1:-1]
+        + luminance[1:-1, :-2]
+        + luminance[1:-1, 2:]
+        - 4 * luminance[1:-1, 1:-1]
+    )
+    return float(laplacian.var())
+
+
+def clipped_fractions(luminance: np.ndarray) -> tuple:
+    """
+    Measure exposure as the fractions of crushed and blown-out pixels.
+
+    Args:
+        luminance (np.ndarray): The luminance, a 2-D array of 0-255 values.
+
+    Returns:
+        tuple: The fraction of pixels at or below DARK_LEVEL, and at or above
+               BRIGHT_LEVEL.
+    """
+    histogram = np.bincount(
+        np.clip(luminance, 0, 255).astype(np.uint8).ravel(), minlength=256
+    )
+    total = histogram.sum()
+    return (
+        float(histogram[: DARK_LEVEL + 1].sum() / total),
+        float(histogram[BRIGHT_LEVEL:].sum() / total),
+    )
+
+
+def noise_sigma(luminance: np.ndarray) -> float:
+    """
+    Estimate the standard deviation of the noise (Immerkaer, 1996).
+
+    The mask is the difference of two Laplacians, which cancels image structure up to
+    second order and leaves the noise. Edges and fine texture still add to the
+    estimate, which is why the default threshold is high.
+
+    Args:
+        luminance (np.ndarray): The luminance, a 2-D array.
+
+    Returns:
+        float: The estimated noise standard deviation, in luminance levels.
+    """
+    height, width = luminance.shape
+    if height < 3 or width < 3:
+        return 0.0
+    # Convolve with [[1, -2, 1], [-2, 4, -2], [1, -2, 1]], which is separable
+    rows = luminance[:, :-2] - 2 * luminance[:, 1:-1] + luminance[:, 2:]
+    response = rows[:-2] - 2 * rows[1:-1] + rows[2:]
+    return float(
+        np.sqrt(np.pi / 2) * np.abs(response).sum() / (6 * (width - 2) * (height - 2))
+    )
+
+
+def measure_image(image_path: str) -> dict:
+    """
+    Measure the local quality signals of an image.
+
+    Args:
+        image_path (str): The path to the image file.
+
+    Returns:
+        dict: The "width" and "height" of the image, the "sharpness",
+              "dark_fraction" and "bright_fraction" of its downsampled copy, and the
+              "noise" of its center tile.
+    """
+    luminance, tile, (width, height) = load_luminance(image_path)
+    dark_fraction, bright_fraction = clipped_fractions(luminance)
+    return {
+        "width": width,
+        "height": height,
+        "sharpness": round(laplacian_variance(luminance), 2),
+        "dark_fraction": round(dark_fraction, 4),
+        "bright_fraction": round(bright_fraction, 4),
+        "noise": round(noise_sigma(tile), 2),
+    }
+
+
+class Prescreen:
+    """
+    Scores images that are clearly unusable 0 locally, so they are not sent to the
+    models.
+
+    Each image is measured on a downsampled copy: sharpness (the variance of the
+    Laplacian) and exposure (the fractions of crushed and blown-out pixels), and on a
+    full-resolution tile from its center: noise. Its resolution is checked too. An
+    image past any threshold gets a score-0 result, marked "prescreened" and
+    explaining which thresholds it failed, which is recorded as each model's result
+    instead of sending the image. An image that cannot be read is left to the
+    models, which record the failure.
+
+    Args:
+        min_sharpness (float): The minimum variance of the Laplacian.
+        max_clipped (float): The maximum fraction of crushed or blown-out pixels.
+        max_noise (float): The maximum estimated noise standard deviation.
+        min_resolution (int): The minimum largest dimension, in pixels.
+    """
+
+    def __init__(
+        self,
+        min_sharpness: float = MIN_SHARPNESS,
+        max_clipped: float = MAX_CLIPPED,
+        max_noise: float = MAX_NOISE,
+        min_resolution: int = MIN_RESOLUTION,
+    ) -> None:
+        self.min_sharpness = min_sharpness
+        self.max_clipped = max_clipped
+        self.max_noise = max_noise
+        self.min_resolution = min_resolution
+
+    def failures(self, metrics: dict) -> list:
+        """
+        Check the measurements of an image against the thresholds.
+
+        Args:
+            metrics (dict): The measurements, as returned by measure_image.
+
+        Returns:
+            list: A description of each threshold the image failed; empty if it passed.
+        """
+        failures = []
+        if max(metrics["width"], metrics["height"]) < self.min_resolution:
+            failures.append(
+                f"resolution too low ({metrics['width']}x{metrics['height']} pixels)"
+            )
+        if metrics["dark_fraction"] >= self.max_clipped:
+            failures.append(
+                f"severely underexposed ({metrics['dark_fraction']:.0%} of pixels "
+                "crushed to black)"
+            )
+        if metrics["bright_fraction"] >= self.max_clipped:
+            failures.append(
+                f"severely overexposed ({metrics['bright_fraction']:.0%} of pixels "
+                "blown out to white)"
+            )
+        if metrics["sharpness"] < self.min_sharpness:
+            failures.append(
+                f"extremely blurry or out of focus (Laplacian variance "
+                f"{metrics['sharpness']})"
+            )
+        if metrics["noise"] > self.max_noise:
+            failures.append(f"heavy noise (estimated sigma {metrics['noise']})")
+        return failures
+
+    def screen_image(self, directory: str, filename: str) -> tuple:
+        """
+        Screen an image.
+
+        Args:
+            directory (str): The directory containing the image.
+            filename (str): The filename of the image.
+
+        Returns:
+            tuple: The score-0 result, with "score", "explanation", "prescreened" and
+                   the "prescreen" measurements, and the seconds the screening took;
+                   or None if the image passed or could not be read.
+        """
+        t0 = time.time()
+        try:
+            metrics = measure_image(os.path.join(directory, filename))
+        except Exception as e:
+            logging.error(f"Error pre-screening {filename}: {e}")
+            return None
+
+        failures = self.failures(metrics)
+        if not failures:
+            return None
+
+        result = {
+            "score": 0,
+            "explanation": f"Pre-screen: {'; '.join(failures)}.",
+            "prescreened": True,
+            "prescreen": metrics,
+        }
+        return result, round(time.time() - t0, 3)
+
+    def screen_images(self, directory: str, filenames: list) -> dict:
+        """
+        Screen images in a pool of threads.
+
+        Args:
+            directory (str): The directory containing the images.
+            filenames (list): The images to screen.
+
+        Returns:
+            dict: The result and screening time of each image that failed, keyed by
+                  filename, as returned by screen_image.
+        """
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(MAX_WORKERS, os.cpu_count() or 1)
+        ) as executor:
+            screened = executor.map(
+                lambda filename: self.screen_image(directory, filename), filenames
+            )
+            failed = {
+                filename: result
+                for filename, result in zip(filenames, screened)
+                if result is not None
+            }
+
+        logging.info(
+            f"Pre-screen: {len(failed)} of {len(filenames)} images scored 0 locally"
+        )
+        return failed
+
+
+def get_threshold(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        logging.error(f"Invalid {name} value. Using default.")
+        return default
+
+
+def create_prescreen() -> Prescreen:
+    """
+    Create the pre-screen from environment variables.
+
+    IQA_PRESCREEN_MIN_SHARPNESS, IQA_PRESCREEN_MAX_CLIPPED, IQA_PRESCREEN_MAX_NOISE
+    and IQA_PRESCREEN_MIN_RESOLUTION override the thresholds. Whether it is enabled
+    (IQA_PRESCREEN) is checked by evaluation_engine.create_prescreen, before this
+    module and NumPy are imported.
+
+    Returns:
+        Prescreen: The pre-screen.
+    """
+    return Prescreen(
+        get_threshold("IQA_PRESCREEN_MIN_SHARPNESS", MIN_SHARPNESS),
+        get_threshold("IQA_PRESCREEN_MAX_CLIPPED", MAX_CLIPPED),
+        get_threshold("IQA_PRESCREEN_MAX_NOISE", MAX_NOISE),
+        int(get_threshold("IQA_PRESCREEN_MIN_RESOLUTION", MIN_RESOLUTION)),
+    )
@@ -0,0 +1,102 @@
+"""
+# Title: Registry of image quality assessment provider adapters
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import importlib
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+# Provider name: (adapter module, description). Adapter modules are only imported when
+# selected, so a run only pays the import cost of the SDKs it actually uses.
+REGISTRY = {
+    "anthropic_claude": (
+        "image_quality_anthropic_claude",
+        "Anthropic Claude 3.5 Sonnet",
+    ),
+    "azure_gpt_4o": ("image_quality_azure_gpt_4o", "Azure OpenAI GPT-4o"),
+    "azure_llama_11b": (
+        "image_quality_azure_llama_11b",
+        "Azure AI Meta Llama 3.2 11B Vision Instruct",
+    ),
+    "azure_llama_90b": (
+        "image_quality_azure_llama_90b",
+        "Azure AI Meta Llama 3.2 90B Vision Instruct",
+    ),
+    "azure_phi": ("image_quality_azure_phi", "Azure AI Microsoft Phi-3.5 Vision Instruct"),
+    "bedrock_llama_11b": (
+        "image_quality_bedrock_llama_11b",
+        "Amazon Bedrock Meta Llama 3.2 11B Vision Instruct",
+    ),
+    "bedrock_llama_90b": (
+        "image_quality_bedrock_llama_90b",
+        "Amazon Bedrock Meta Llama 3.2 90B Vision Instruct",
+    ),
+    "bedrock_sonnet": (
+        "image_quality_bedrock_sonnet",
+        "Amazon Bedrock Anthropic Claude 3.5 Sonnet",
+    ),
+    "google_gemini": ("image_quality_google_gemini", "Google Gemini 1.5 Pro 002"),
+    "mistralai_pixtral": ("image_quality_mistralai_pixtral", "Mistral AI Pixtral 12B"),
+    "nvidia_neva22b": ("image_quality_nvidia_neva22b", "NVIDIA NeVA-22B"),
+}
+
+# Every adapter module defines these model settings, plus an
+# `open_invoker(rate_limiter)` async context manager that yields a coroutine
+# function `invoke_model(image_bytes, file_format) -> str`.
+ADAPTER_ATTRIBUTES = (
+    "MODEL_ID",
+    "DIRECTORY",
+    "TEMPERATURE",
+    "MAX_TOKENS",
+    "MAX_CONCURRENCY",
+    "REQUESTS_PER_MINUTE",
+    "TOKENS_PER_MINUTE",
+    "OUTPUT_PATH",
+    "SYSTEM_PROMPT",
+    "USER_PROMPT",
+    "open_invoker",
+)
+
+
+def provider_names() -> list:
+    """
+    List the registered provider names.
+
+    Returns:
+        list: The provider names, sorted.
+    """
+    return sorted(REGISTRY)
+
+
+def load_provider(name: str):
+    """
+    Import a provider's adapter module, and with it the provider's SDK.
+
+    Args:
+        name (str): The registered provider name, e.g. 'anthropic_claude'.
+
+    Returns:
+        module: The adapter module.
+
+    Raises:
+        KeyError: If the provider is not registered.
+        AttributeError: If the adapter module does not define the adapter interface.
+    """
+    module_name, _ = REGISTRY[name]
+    adapter = importlib.import_module(module_name)
+
+    missing = [attribute for attribute in ADAPTER_ATTRIBUTES if not hasattr(adapter, attribute)]
+    if missing:
+        raise AttributeError(
+            f"Provider adapter {module_name} is missing: {', '.join(missing)}"
+        )
+
+    return adapter
@@ -0,0 +1,357 @@
+"""
+# Title: Adaptive token-bucket rate limiter shared by all model providers
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import asyncio
+import email.utils
+import logging
+import math
+import os
+import re
+import time
+from datetime import datetime
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+BURST_SECONDS = 10  # size of each bucket, in seconds of quota
+MIN_RATE_SCALE = 0.1  # never slow down below 10% of the configured quota
+DECREASE_FACTOR = 0.5  # multiplicative decrease on throttling
+INCREASE_STEP = 0.05  # additive increase on success
+DEFAULT_THROTTLE_PAUSE = 5.0  # seconds, when the provider sends no Retry-After
+DURATION_PATTERN = re.compile(
+    r"(?:(\d+(?:\.\d+)?)h)?(?:(\d+(?:\.\d+)?)m(?!s))?"
+    r"(?:(\d+(?:\.\d+)?)s)?(?:(\d+(?:\.\d+)?)ms)?"
+)
+THROTTLING_ERROR_CODES = (
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+    "ResourceExhausted",
+)
+
+
+class TokenBucket:
+    """
+    A token bucket refilled continuously at a per-minute rate.
+
+    Args:
+        per_minute (float): The refill rate, in tokens per minute.
+        capacity (float): The maximum number of tokens the bucket can hold.
+    """
+
+    def __init__(self, per_minute: float, capacity: float) -> None:
+        self.per_minute = per_minute
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, scale: float) -> None:
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.level = min(
+            self.capacity, self.level + elapsed * self.per_minute * scale / 60
+        )
+        self.updated = now
+
+    def wait_time(self, amount: float, scale: float) -> float:
+        """Return the seconds until `amount` tokens are available."""
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / (self.per_minute * scale)
+
+
+class RateLimiter:
+    """
+    Adaptive rate limiter built from a request bucket and an optional token bucket.
+
+    The limiter starts at the configured quota. Each throttling response halves the
+    effective rate and pauses all callers for the Retry-After period, then each
+    success adds back a small step until the full quota is reached again.
+    Rate-limit headers returned by the provider keep the buckets in step with the
+    provider's own accounting.
+
+    Args:
+        requests_per_minute (float): The request quota, in requests per minute.
+        tokens_per_minute (float, optional): The token quota, in tokens per minute.
+                                             If None, tokens are not limited.
+    """
+
+    def __init__(
+        self, requests_per_minute: float, tokens_per_minute: float = None
+    ) -> None:
+        self.requests = TokenBucket(
+            requests_per_minute, max(1, requests_per_minute * BURST_SECONDS / 60)
+        )
+        self.tokens = None
+        if tokens_per_minute:
+            self.tokens = TokenBucket(
+                tokens_per_minute, max(1, tokens_per_minute * BURST_SECONDS / 60)
+            )
+        self.scale = 1.0
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """
+        Wait until a request of the given size fits within the quota.
+
+        Args:
+            tokens (int): The estimated number of tokens the request will consume.
+        """
+        async with self.lock:
+            while True:
+                delay = self.paused_until - time.monotonic()
+                self.requests.refill(self.scale)
+                delay = max(delay, self.requests.wait_time(1, self.scale))
+                if self.tokens is not None and tokens:
+                    self.tokens.refill(self.scale)
+                    delay = max(delay, self.tokens.wait_time(tokens, self.scale))
+                if delay <= 0:
+                    break
+                logging.debug(f"Rate limiter waiting {delay:.2f} seconds")
+                await asyncio.sleep(delay)
+
+            self.requests.level -= 1
+            if self.tokens is not None and tokens:
+                self.tokens.level -= min(tokens, self.tokens.capacity)
+
+    def record_success(self, headers: dict = None) -> None:
+        """
+        Record a successful request and recover towards the configured quota.
+
+        Args:
+            headers (dict, optional): The response headers, used to synchronize the
+                                      buckets with the provider's remaining quota.
+        """
+        self.scale = min(1.0, self.scale + INCREASE_STEP)
+        if headers:
+            self.update_from_headers(headers)
+
+    def record_throttle(self, retry_after: float = None) -> None:
+        """
+        Record a throttled request, slow down, and pause all callers.
+
+        Args:
+            retry_after (float, optional): Seconds to wait, as sent by the provider.
+        """
+        self.scale = max(MIN_RATE_SCALE, self.scale * DECREASE_FACTOR)
+        pause = retry_after if retry_after is not None else DEFAULT_THROTTLE_PAUSE
+        self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        self.requests.level = min(self.requests.level, 0)
+        logging.warning(
+            f"Throttled by provider. Pausing {pause:.2f} seconds, rate scaled to {self.scale:.0%}"
+        )
+
+    def update_from_headers(self, headers: dict) -> None:
+        """
+        Synchronize the buckets with `x-ratelimit-*` style response headers.
+
+        Supports the OpenAI/Azure (`x-ratelimit-remaining-requests`,
+        `x-ratelimit-reset-requests`, ...) and Anthropic
+        (`anthropic-ratelimit-requests-remaining`, ...) header conventions.
+
+        Args:
+            headers (dict): The response headers.
+        """
+        headers = {key.lower(): value for key, value in headers.items()}
+        for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            if bucket is None:
+                continue
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}") or headers.get(
+                f"anthropic-ratelimit-{kind}-remaining"
+            )
+            reset = headers.get(f"x-ratelimit-reset-{kind}") or headers.get(
+                f"anthropic-ratelimit-{kind}-reset"
+            )
+            try:
+                remaining = float(remaining) if remaining is not None else None
+            except ValueError:
+                remaining = None
+            if remaining is None:
+                continue
+            bucket.level = min(bucket.level, remaining)
+            if remaining <= 0:
+                reset_seconds = parse_duration(reset)
+                if reset_seconds is not None:
+                    self.paused_until = max(
+                        self.paused_until, time.monotonic() + reset_seconds
+                    )
+
+
+def parse_duration(value: str) -> float:
+    """
+    Parse a rate-limit reset or Retry-After value into seconds from now.
+
+    Accepts plain seconds ("20", "1.5"), Go-style durations ("1m30s", "250ms"),
+    HTTP dates and RFC 3339 timestamps.
+
+    Args:
+        value (str): The header value.
+
+    Returns:
+        float: The number of seconds, or None if the value could not be parsed.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    match = DURATION_PATTERN.fullmatch(value)
+    if match and any(match.groups()):
+        hours, minutes, seconds, millis = (float(group or 0) for group in match.groups())
+        return hours * 3600 + minutes * 60 + seconds + millis / 1000
+
+    try:
+        reset = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        try:
+            reset = datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return max(0.0, reset - time.time())
+
+
+def get_status_code(exc: Exception) -> int:
+    """
+    Get the HTTP status code from a provider SDK exception, if there is one.
+
+    Args:
+        exc (Exception): The exception raised by the SDK.
+
+    Returns:
+        int: The HTTP status code, or None.
+    """
+    status = getattr(exc, "status_code", None)  # Anthropic, Azure, Mistral
+    if isinstance(status, int):
+        return status
+    code = getattr(exc, "code", None)  # Google API core
+    if isinstance(code, int):
+        return code
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):  # botocore ClientError
+        return response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    status = getattr(response, "status_code", None)  # requests HTTPError
+    if isinstance(status, int):
+        return status
+    return None
+
+
+def is_throttling_error(exc: Exception) -> bool:
+    """
+    Determine whether an exception means the provider throttled the request.
+
+    Args:
+        exc (Exception): The exception raised by the SDK.
+
+    Returns:
+        bool: True for HTTP 429 responses and provider throttling error codes.
+    """
+    if get_status_code(exc) == 429:
+        return True
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):  # botocore ClientError
+        return response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    return type(exc).__name__ in THROTTLING_ERROR_CODES
+
+
+def get_response_headers(exc: Exception) -> dict:
+    """
+    Get the HTTP response headers from a provider SDK exception, if there are any.
+
+    Args:
+        exc (Exception): The exception raised by the SDK.
+
+    Returns:
+        dict: The response headers, or an empty dict.
+    """
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):  # botocore ClientError
+        return response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+    headers = getattr(response, "headers", None)
+    return dict(headers) if headers else {}
+
+
+def get_retry_after(exc: Exception) -> float:
+    """
+    Get the Retry-After delay from a provider SDK exception.
+
+    Args:
+        exc (Exception): The exception raised by the SDK.
+
+    Returns:
+        float: The delay in seconds, or None if the provider did not send one.
+    """
+    headers = {key.lower(): value for key, value in get_response_headers(exc).items()}
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    return parse_duration(headers.get("retry-after"))
+
+
+def estimate_tokens(prompt: str, max_tokens: int, image_tokens: int = 1600) -> int:
+    """
+    Estimate the tokens a request will consume, for token-per-minute quotas.
+
+    Args:
+        prompt (str): The combined system and user prompt text.
+        max_tokens (int): The maximum number of output tokens.
+        image_tokens (int): The estimated number of tokens for the image.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return len(prompt) // 4 + image_tokens + max_tokens
+
+
+def create_rate_limiter(
+    requests_per_minute: float, tokens_per_minute: float = None
+) -> RateLimiter:
+    """
+    Create a rate limiter from a provider's default quota.
+
+    The defaults can be overridden with the IQA_REQUESTS_PER_MINUTE and
+    IQA_TOKENS_PER_MINUTE environment variables. A request quota that is not a
+    finite positive number, or a token quota that is negative or not finite, is logged as an error and the
+    provider default is used.
+
+    Args:
+        requests_per_minute (float): The provider's default request quota.
+        tokens_per_minute (float, optional): The provider's default token quota.
+
+    Returns:
+        RateLimiter: The rate limiter.
+    """
+    try:
+        value = float(os.environ.get("IQA_REQUESTS_PER_MINUTE", requests_per_minute))
+        if not (math.isfinite(value) and value > 0):
+            raise ValueError(value)
+        requests_per_minute = value
+    except ValueError:
+        logging.error("Invalid IQA_REQUESTS_PER_MINUTE value. Using provider default.")
+
+    try:
+        # 0 leaves tokens unlimited
+        value = float(os.environ.get("IQA_TOKENS_PER_MINUTE", tokens_per_minute or 0))
+        if not (math.isfinite(value) and value >= 0):
+            raise ValueError(value)
+        tokens_per_minute = value
+    except ValueError:
+        logging.error("Invalid IQA_TOKENS_PER_MINUTE value. Using provider default.")
+
+    logging.info(
+        f"Rate limit: {requests_per_minute:g} requests/min, {tokens_per_minute or 'unlimited'} tokens/min"
+    )
+    return RateLimiter(requests_per_minute, tokens_per_minute or None)
@@ -0,0 +1,269 @@
+"""
+# Title: Content-addressed cache of model responses for image quality assessments
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+DEFAULT_CACHE_PATH = "cache/responses.sqlite"
+DEFAULT_MAX_MB = 512
+DEFAULT_MAX_AGE_DAYS = 90
+EVICT_EVERY = 100  # check the eviction limits after this many writes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    image_sha256 TEXT NOT NULL,
+    model_id TEXT NOT NULL,
+    response_text TEXT NOT NULL,
+    result TEXT NOT NULL,
+    time REAL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at);
+"""
+
+
+def hash_prompts(system_prompt: str, user_prompt: str) -> str:
+    """
+    Calculate the SHA-256 digest of the system and user prompts.
+
+    Args:
+        system_prompt (str): The system prompt.
+        user_prompt (str): The user prompt.
+
+    Returns:
+        str: The hexadecimal SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    for prompt in (system_prompt, user_prompt):
+        encoded = prompt.encode("utf-8")
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+def make_key(
+    image_sha256: str,
+    model_id: str,
+    prompt_hash: str,
+    temperature: float,
+    max_tokens: int,
+) -> str:
+    """
+    Build the cache key for a model response.
+
+    Args:
+        image_sha256 (str): The SHA-256 digest of the image file.
+        model_id (str): The model identifier.
+        prompt_hash (str): The digest of the system and user prompts.
+        temperature (float): The sampling temperature.
+        max_tokens (int): The maximum number of output tokens.
+
+    Returns:
+        str: The hexadecimal cache key.
+    """
+    fields = json.dumps(
+        [image_sha256, model_id, prompt_hash, float(temperature), int(max_tokens)]
+    )
+    return hashlib.sha256(fields.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache of raw model responses and their parsed results.
+
+    Entries older than `max_age_days` are removed, and when the cache grows beyond
+    `max_mb` the least recently used entries are removed first.
+
+    Args:
+        path (str): The path of the SQLite database file.
+        max_mb (float): The maximum total size of the cached responses, in megabytes.
+        max_age_days (float): The maximum age of a cached response, in days.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_mb: float = DEFAULT_MAX_MB,
+        max_age_days: float = DEFAULT_MAX_AGE_DAYS,
+    ) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_age_days * 24 * 60 * 60
+        self.stats = Counter(hits=0, misses=0, writes=0, evictions=0)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self.evict()
+
+    def get(self, key: str) -> dict:
+        """
+        Look up a cached response.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            dict: The cached entry with "response_text", "result" and "time" keys,
+                  or None on a cache miss.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response_text, result, time, created_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None or row[3] < time.time() - self.max_age:
+                self.stats["misses"] += 1
+                return None
+            self.connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+            self.connection.commit()
+            self.stats["hits"] += 1
+
+        return {"response_text": row[0], "result": json.loads(row[1]), "time": row[2]}
+
+    def put(
+        self,
+        key: str,
+        image_sha256: str,
+        model_id: str,
+        response_text: str,
+        result: dict,
+        elapsed: float = None,
+    ) -> None:
+        """
+        Store a model response.
+
+        Args:
+            key (str): The cache key.
+            image_sha256 (str): The SHA-256 digest of the image file.
+            model_id (str): The model identifier.
+            response_text (str): The raw response text.
+            result (dict): The parsed result, as returned by utilities.truncate.
+            elapsed (float, optional): The original processing time, in seconds.
+        """
+        result_json = json.dumps(result)
+        size = len(response_text.encode("utf-8")) + len(result_json.encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    image_sha256,
+                    model_id,
+                    response_text,
+                    result_json,
+                    elapsed,
+                    size,
+                    now,
+                    now,
+                ),
+            )
+            self.connection.commit()
+            self.stats["writes"] += 1
+            evict = self.stats["writes"] % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Remove expired entries, then least recently used entries over the size limit.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        with self.lock:
+            removed = self.connection.execute(
+                "DELETE FROM responses WHERE created_at < ?",
+                (time.time() - self.max_age,),
+            ).rowcount
+
+            total = self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                rows = self.connection.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed_at"
+                )
+                stale = []
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((key,))
+                    total -= size
+                self.connection.executemany("DELETE FROM responses WHERE key = ?", stale)
+                removed += len(stale)
+
+            self.connection.commit()
+            self.stats["evictions"] += removed
+
+        if removed:
+            logging.info(f"Evicted {removed} cached responses")
+        return removed
+
+    def log_stats(self) -> None:
+        """Log the cache hit and miss statistics."""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups if lookups else 0
+        logging.info(
+            f"Response cache: {self.stats['hits']} hits, {self.stats['misses']} misses "
+            f"({hit_rate:.0%} hit rate), {self.stats['writes']} writes, "
+            f"{self.stats['evictions']} evictions"
+        )
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self.lock:
+            self.connection.close()
+
+
+def create_response_cache() -> ResponseCache:
+    """
+    Create the response cache from environment variables.
+
+    IQA_RESPONSE_CACHE sets the database path, or disables the cache when set to
+    "off". IQA_RESPONSE_CACHE_MAX_MB and IQA_RESPONSE_CACHE_MAX_AGE_DAYS set the
+    eviction limits.
+
+    Returns:
+        ResponseCache: The response cache, or None if it is disabled.
+    """
+    path = os.environ.get("IQA_RESPONSE_CACHE", DEFAULT_CACHE_PATH)
+    if path.lower() in ("off", "false", "0", "none"):
+        logging.info("Response cache disabled")
+        return None
+
+    try:
+        max_mb = float(os.environ.get("IQA_RESPONSE_CACHE_MAX_MB", DEFAULT_MAX_MB))
+        max_age_days = float(
+            os.environ.get("IQA_RESPONSE_CACHE_MAX_AGE_DAYS", DEFAULT_MAX_AGE_DAYS)
+        )
+    except ValueError:
+        logging.error("Invalid response cache limit. Using defaults.")
+        max_mb, max_age_days = DEFAULT_MAX_MB, DEFAULT_MAX_AGE_DAYS
+
+    return ResponseCache(path, max_mb, max_age_days)
@@ -0,0 +1,512 @@
+"""
+# Title: SQLite results database of runs, models, images and evaluations
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import results_writer
+import utilities
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+DEFAULT_DATABASE_PATH = "output/results.sqlite"
+OUTPUT_DIRECTORY = "output/"
+BATCH_SIZE = 10_000  # records inserted per statement batch
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    label TEXT,
+    source TEXT NOT NULL,
+    source_sha256 TEXT NOT NULL UNIQUE,
+    created_at REAL NOT NULL,
+    imported_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS models (
+    model_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS images (
+    image_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS evaluations (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    model_id INTEGER NOT NULL REFERENCES models (model_id),
+    image_id INTEGER NOT NULL REFERENCES images (image_id),
+    score INTEGER NOT NULL,
+    explanation TEXT,
+    temperature REAL,
+    max_tokens INTEGER,
+    time REAL,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    payload_bytes INTEGER,
+    timings TEXT,
+    UNIQUE (run_id, model_id, image_id)
+);
+CREATE INDEX IF NOT EXISTS evaluations_image ON evaluations (image_id, model_id);
+CREATE INDEX IF NOT EXISTS evaluations_model_score ON evaluations (model_id, score);
+CREATE INDEX IF NOT EXISTS evaluations_score ON evaluations (score);
+"""
+
+EVALUATION_COLUMNS = """
+    e.run_id, m.name AS model_id, i.name AS image_id, e.score, e.explanation,
+    e.temperature, e.max_tokens, e.time, e.input_tokens, e.output_tokens,
+    e.payload_bytes, e.timings
+"""
+
+
+def read_results_file(path: str):
+    """
+    Read the records of a JSON results file, or of a JSONL results file.
+
+    Args:
+        path (str): The path of the results file.
+
+    Yields:
+        dict: Each result record.
+    """
+    if path.endswith(".jsonl"):
+        yield from results_writer.read_records(path)
+        return
+
+    with open(path, "r") as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or "scores" not in data:
+        raise ValueError(f"{path} is not a results file")
+    yield from data["scores"]
+
+
+class ResultsDatabase:
+    """
+    SQLite database of evaluation results across runs.
+
+    Each imported results file is a run. Models and images are stored once and
+    referenced by ID, and the evaluations are indexed by image, by model and score,
+    and by score, so the lookups below stay fast over millions of evaluations.
+
+    Args:
+        path (str): The path of the SQLite database file.
+    """
+
+    def __init__(self, path: str = DEFAULT_DATABASE_PATH) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(SCHEMA)
+        # The IDs already looked up, by table and name
+        self.ids = {"models": {}, "images": {}}
+
+    def intern(self, table: str, name: str) -> int:
+        """
+        Get the ID of a model or image name, adding it if it is new.
+
+        Args:
+            table (str): "models" or "images".
+            name (str): The model or image name.
+
+        Returns:
+            int: The ID.
+        """
+        ids = self.ids[table]
+        if name not in ids:
+            column = "model_id" if table == "models" else "image_id"
+            self.connection.execute(
+                f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,)
+            )
+            ids[name] = self.connection.execute(
+                f"SELECT {column} FROM {table} WHERE name = ?", (name,)
+            ).fetchone()[0]
+        return ids[name]
+
+    def import_file(self, path: str, label: str = None) -> int:
+        """
+        Import a results file as a run.
+
+        A file whose contents were already imported is skipped, so importing the
+        output directory again only adds the results files that changed. A changed
+        file replaces the runs previously imported from the same path, as it holds
+        their records too when it was rewritten by a resumed run, and keeps their
+        label unless a new one is given. If an image was recorded more than once for
+        a model, the last record wins.
+
+        Args:
+            path (str): The path of the JSON or JSONL results file.
+            label (str, optional): A label for the run.
+
+        Returns:
+            int: The run ID, or None if the file was already imported.
+        """
+        source = os.path.normpath(path)
+        source_sha256 = utilities.hash_file(path)
+        existing = self.connection.execute(
+            "SELECT run_id FROM runs WHERE source_sha256 = ?", (source_sha256,)
+        ).fetchone()
+        if existing is not None:
+            logging.info(f"Skipping {path}, already imported as run {existing[0]}")
+            return None
+
+        previous = self.connection.execute(
+            "SELECT run_id, label FROM runs WHERE source = ? ORDER BY run_id", (source,)
+        ).fetchall()
+        if label is None and previous:
+            label = previous[-1]["label"]
+
+        count = 0
+        try:
+            with self.connection:
+                for run in previous:
+                    self.connection.execute(
+                        "DELETE FROM runs WHERE run_id = ?", (run["run_id"],)
+                    )
+                    logging.info(f"Replacing run {run['run_id']}, imported from {path}")
+                run_id = self.connection.execute(
+                    "INSERT INTO runs "
+                    "(label, source, source_sha256, created_at, imported_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (label, source, source_sha256, os.path.getmtime(path), time.time()),
+                ).lastrowid
+
+                batch = []
+                for record in read_results_file(path):
+                    usage = record.get("usage") or {}
+                    timings = record.get("timings")
+                    batch.append(
+                        (
+                            run_id,
+                            self.intern("models", record["model_id"]),
+                            self.intern("images", record["image_id"]),
+                            record.get("score", -1),
+                            record.get("explanation"),
+                            record.get("temperature"),
+                            record.get("max_tokens"),
+                            record.get("time"),
+                            usage.get("input_tokens"),
+                            usage.get("output_tokens"),
+                            record.get("payload_bytes"),
+                            json.dumps(timings) if timings else None,
+                        )
+                    )
+                    if len(batch) >= BATCH_SIZE:
+                        count += self.insert_evaluations(batch)
+                        batch = []
+                count += self.insert_evaluations(batch)
+        except Exception:
+            # The models and images added with the run were rolled back with it
+            self.ids = {"models": {}, "images": {}}
+            raise
+
+        logging.info(f"Imported {count} evaluations from {path} as run {run_id}")
+        return run_id
+
+    def insert_evaluations(self, rows: list) -> int:
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO evaluations "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        return len(rows)
+
+    def import_directory(
+        self, directory: str = OUTPUT_DIRECTORY, label: str = None
+    ) -> list:
+        """
+        Import the JSON results files in a directory.
+
+        Only the JSON results files are imported; the JSONL files they were written
+        from hold the same records. Import the JSONL file of an interrupted run with
+        import_file.
+
+        Args:
+            directory (str): The directory of the results files.
+            label (str, optional): A label for the runs.
+
+        Returns:
+            list: The IDs of the new runs.
+        """
+        run_ids = []
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith(".json"):
+                run_id = self.import_file(os.path.join(directory, filename), label)
+                if run_id is not None:
+                    run_ids.append(run_id)
+        return run_ids
+
+    def delete_run(self, run_id: int) -> int:
+        """
+        Delete a run and its evaluations.
+
+        Args:
+            run_id (int): The run ID.
+
+        Returns:
+            int: The number of evaluations deleted.
+        """
+        with self.connection:
+            count = self.connection.execute(
+                "SELECT COUNT(*) FROM evaluations WHERE run_id = ?", (run_id,)
+            ).fetchone()[0]
+            self.connection.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+        return count
+
+    def image_scores(self, image_id: str, run_id: int = None) -> list:
+        """
+        Get the evaluations of an image, by every model and run.
+
+        Args:
+            image_id (str): The image ID, e.g. 'image_01.jpg'.
+            run_id (int, optional): Only the evaluations of this run.
+
+        Returns:
+            list: The evaluations (dicts), by run and model.
+        """
+        query = (
+            f"SELECT {EVALUATION_COLUMNS} FROM images i "
+            "JOIN evaluations e ON e.image_id = i.image_id "
+            "JOIN models m ON m.model_id = e.model_id WHERE i.name = ?"
+        )
+        params = [image_id]
+        if run_id is not None:
+            query += " AND e.run_id = ?"
+            params.append(run_id)
+        query += " ORDER BY e.run_id, m.name"
+        return [dict(row) for row in self.connection.execute(query, params)]
+
+    def model_scores(
+        self, model_id: str, score: int = None, run_id: int = None, limit: int = None
+    ) -> list:
+        """
+        Get the evaluations of a model.
+
+        Args:
+            model_id (str): The model ID, e.g. 'claude-3-5-sonnet-20241022'.
+            score (int, optional): Only the evaluations with this score.
+            run_id (int, optional): Only the evaluations of this run.
+            limit (int, optional): The maximum number of evaluations.
+
+        Returns:
+            list: The evaluations (dicts), by run and image.
+        """
+        query = (
+            f"SELECT {EVALUATION_COLUMNS} FROM models m "
+            "JOIN evaluations e ON e.model_id = m.model_id "
+            "JOIN images i ON i.image_id = e.image_id WHERE m.name = ?"
+        )
+        params = [model_id]
+        if score is not None:
+            query += " AND e.score = ?"
+            params.append(score)
+        if run_id is not None:
+            query += " AND e.run_id = ?"
+            params.append(run_id)
+        query += " ORDER BY e.run_id, i.name"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [dict(row) for row in self.connection.execute(query, params)]
+
+    def runs(self) -> list:
+        """
+        List the runs, with their models and number of evaluations.
+
+        Returns:
+            list: The runs (dicts), oldest first.
+        """
+        rows = self.connection.execute(
+            "SELECT r.run_id, r.label, r.source, r.created_at, r.imported_at, "
+            "(SELECT COUNT(*) FROM evaluations e WHERE e.run_id = r.run_id) AS evaluations, "
+            "(SELECT GROUP_CONCAT(name) FROM models WHERE model_id IN "
+            "(SELECT DISTINCT model_id FROM evaluations e WHERE e.run_id = r.run_id)) "
+            "AS models FROM runs r ORDER BY r.run_id"
+        )
+        return [dict(row) for row in rows]
+
+    def models(self) -> list:
+        """
+        List the models, with their number of runs and count of each score.
+
+        Returns:
+            list: The models (dicts), by name.
+        """
+        # Both counts are read from an index, without visiting the evaluations
+        runs = dict(
+            self.connection.execute(
+                "SELECT model_id, COUNT(*) FROM "
+                "(SELECT DISTINCT run_id, model_id FROM evaluations) GROUP BY model_id"
+            ).fetchall()
+        )
+        models = {}
+        for name, model_id, score, count in self.connection.execute(
+            "SELECT m.name, e.model_id, e.score, COUNT(*) FROM evaluations e "
+            "JOIN models m ON m.model_id = e.model_id GROUP BY e.model_id, e.score"
+        ):
+            model = models.setdefault(
+                name,
+                {
+                    "model_id": name,
+                    "runs": runs.get(model_id, 0),
+                    "evaluations": 0,
+                    "score_unparsed": 0,
+                    "score_0": 0,
+                    "score_1": 0,
+                    "score_2": 0,
+                },
+            )
+            model["evaluations"] += count
+            key = "score_unparsed" if score == -1 else f"score_{score}"
+            model[key] = model.get(key, 0) + count
+        return [models[name] for name in sorted(models)]
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self.connection.close()
+
+
+def create_results_database() -> ResultsDatabase:
+    """
+    Create the results database from the IQA_RESULTS_DB environment variable.
+
+    When it is set to a path (or "on" for the default path), each run's JSON results
+    file is imported into the database at the end of the run.
+
+    Returns:
+        ResultsDatabase: The database, or None if IQA_RESULTS_DB is not set.
+    """
+    setting = os.environ.get("IQA_RESULTS_DB", "")
+    if setting.lower() in ("", "0", "off", "false", "no"):
+        return None
+    if setting.lower() in ("1", "on", "true", "yes"):
+        setting = DEFAULT_DATABASE_PATH
+    return ResultsDatabase(setting)
+
+
+def import_results(output_paths: list) -> None:
+    """
+    Import the JSON results files of a run into the results database, if it is
+    enabled with IQA_RESULTS_DB.
+
+    Args:
+        output_paths (list): The paths of the JSON results files.
+    """
+    database = create_results_database()
+    if database is None:
+        return
+    try:
+        for output_path in output_paths:
+            database.import_file(output_path)
+    finally:
+        database.close()
+
+
+def print_evaluations(evaluations: list, as_json: bool) -> None:
+    for evaluation in evaluations:
+        if as_json:
+            print(json.dumps(evaluation))
+        else:
+            print(
+                f"{evaluation['run_id']:>5}  {evaluation['model_id']:<40} "
+                f"{evaluation['image_id']:<30} {evaluation['score']:>2}"
+            )
+
+
+def print_rows(rows: list, as_json: bool) -> None:
+    for row in rows:
+        if as_json:
+            print(json.dumps(row))
+        else:
+            print("  ".join("" if value is None else str(value) for value in row.values()))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Import image quality assessment results into a SQLite database "
+        "and query them across runs, models and images."
+    )
+    parser.add_argument(
+        "--database",
+        default=DEFAULT_DATABASE_PATH,
+        help=f"Path of the database (default: {DEFAULT_DATABASE_PATH})",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print each row as a JSON object"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser(
+        "import", help="Import results files, by default the JSON files in output/"
+    )
+    import_parser.add_argument(
+        "paths", nargs="*", help="JSON or JSONL results files or directories"
+    )
+    import_parser.add_argument("--label", help="Label for the imported runs")
+
+    image_parser = subparsers.add_parser(
+        "image", help="Show every model's evaluations of an image"
+    )
+    image_parser.add_argument("image_id")
+    image_parser.add_argument("--run", type=int, help="Only this run")
+
+    model_parser = subparsers.add_parser("model", help="Show a model's evaluations")
+    model_parser.add_argument("model_id")
+    model_parser.add_argument("--score", type=int, choices=(-1, 0, 1, 2))
+    model_parser.add_argument("--run", type=int, help="Only this run")
+    model_parser.add_argument("--limit", type=int)
+
+    subparsers.add_parser("runs", help="List the runs")
+    subparsers.add_parser("models", help="List the models and their score counts")
+
+    delete_parser = subparsers.add_parser("delete-run", help="Delete a run")
+    delete_parser.add_argument("run_id", type=int)
+
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    database = ResultsDatabase(args.database)
+
+    try:
+        if args.command == "import":
+            for path in args.paths or [OUTPUT_DIRECTORY]:
+                if os.path.isdir(path):
+                    database.import_directory(path, args.label)
+                else:
+                    database.import_file(path, args.label)
+        elif args.command == "image":
+            print_evaluations(database.image_scores(args.image_id, args.run), args.json)
+        elif args.command == "model":
+            print_evaluations(
+                database.model_scores(args.model_id, args.score, args.run, args.limit),
+                args.json,
+            )
+        elif args.command == "runs":
+            print_rows(database.runs(), args.json)
+        elif args.command == "models":
+            print_rows(database.models(), args.json)
+        elif args.command == "delete-run":
+            count = database.delete_run(args.run_id)
+            logging.info(f"Deleted run {args.run_id} and its {count} evaluations")
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+# Title: Crash-safe streaming writer for image quality assessment results
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import json
+import logging
+import os
+import time
+from collections import Counter
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+FSYNC_EVERY = 50  # records
+FSYNC_INTERVAL = 5.0  # seconds
+
+
+def jsonl_path(output_path: str) -> str:
+    """
+    Get the JSONL checkpoint path for a JSON output path.
+
+    Args:
+        output_path (str): The path of the JSON results file.
+
+    Returns:
+        str: The same path with a .jsonl extension.
+    """
+    return f"{os.path.splitext(output_path)[0]}.jsonl"
+
+
+def dead_letter_path(output_path: str) -> str:
+    """
+    Get the dead-letter path, where failed images are recorded, for a JSON output path.
+
+    Args:
+        output_path (str): The path of the JSON results file.
+
+    Returns:
+        str: The same path with a .failed.jsonl extension.
+    """
+    return f"{os.path.splitext(output_path)[0]}.failed.jsonl"
+
+
+def read_records(path: str):
+    """
+    Read result records from a JSONL file, one at a time.
+
+    A truncated last line, left by a crash mid-write, is skipped.
+
+    Args:
+        path (str): The path of the JSONL file.
+
+    Yields:
+        dict: Each result record.
+    """
+    with open(path, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"Skipping incomplete record on line {line_number} of {path}")
+
+
+def load_completed_ids(path: str) -> set:
+    """
+    Index the image IDs already recorded in a JSONL file.
+
+    Args:
+        path (str): The path of the JSONL file.
+
+    Returns:
+        set: The image IDs, or an empty set if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return set()
+    return {record["image_id"] for record in read_records(path) if "image_id" in record}
+
+
+class JsonlResultWriter:
+    """
+    Append result records to a JSONL file as each image finishes.
+
+    Every record is flushed to the operating system immediately, and the file is
+    fsync'd every `fsync_every` records or `fsync_interval` seconds, so a crash
+    loses at most the last batch and never corrupts earlier records.
+
+    Args:
+        path (str): The path of the JSONL file.
+        append (bool): Append to an existing file (to resume a run) instead of
+                       starting a new one.
+        fsync_every (int): The number of records between fsyncs.
+        fsync_interval (float): The maximum number of seconds between fsyncs.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        append: bool = False,
+        fsync_every: int = FSYNC_EVERY,
+        fsync_interval: float = FSYNC_INTERVAL,
+    ) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.file = open(path, "a" if append else "w")
+        self.pending = 0
+        self.synced = time.monotonic()
+        self.count = 0
+
+        # A crash mid-write can leave a partial last line; start on a fresh line
+        if append and self.file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write("\n")
+
+    def write(self, record: dict) -> None:
+        """
+        Append a result record.
+
+        Args:
+            record (dict): The result record.
+        """
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        self.count += 1
+        self.pending += 1
+        if (
+            self.pending >= self.fsync_every
+            or time.monotonic() - self.synced >= self.fsync_interval
+        ):
+            self.sync()
+
+    def sync(self) -> None:
+        """Flush and fsync the pending records to disk."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+        self.synced = time.monotonic()
+
+    def close(self) -> None:
+        """Sync and close the file."""
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def export_scores(path: str, output_path: str) -> Counter:
+    """
+    Convert a JSONL results file into the {"scores": [...]} JSON results file.
+
+    Records are written in image order. Only the image IDs and file offsets are held
+    in memory, and if an image was recorded more than once, the last record wins.
+
+    Args:
+        path (str): The path of the JSONL file.
+        output_path (str): The path of the JSON file to write.
+
+    Returns:
+        Counter: The count of each score.
+    """
+    offsets = {}
+    with open(path, "rb") as f:
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            try:
+                offsets[json.loads(line)["image_id"]] = offset
+            except (json.JSONDecodeError, KeyError):
+                continue
+
+    score_counts = Counter()
+    temp_path = f"{output_path}.tmp"
+    with open(path, "rb") as source, open(temp_path, "w") as f:
+        f.write('{\n  "scores": [')
+        for index, image_id in enumerate(sorted(offsets)):
+            source.seek(offsets[image_id])
+            record = json.loads(source.readline())
+            score_counts[record.get("score")] += 1
+            record_json = json.dumps(record, indent=2).replace("\n", "\n    ")
+            f.write(("," if index else "") + "\n    " + record_json)
+        f.write("\n  ]\n}" if offsets else "]\n}")
+    os.replace(temp_path, output_path)
+
+    logging.info(f"Wrote {len(offsets)} results to {output_path}")
+    logging.info(f"Scores: {sorted(score_counts.items(), key=lambda item: str(item[0]))}")
+
+    return score_counts
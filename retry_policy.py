@@ -0,0 +1,211 @@
+"""
+# Title: Retry policy for image quality assessment requests
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import asyncio
+import logging
+import os
+import random
+
+import instrumentation
+import rate_limiter as rate_limiting
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+DEFAULT_MAX_ATTEMPTS = 5  # attempts per image, including the first
+BASE_DELAY = 1.0  # seconds
+MAX_DELAY = 60.0  # seconds
+
+# Error categories
+THROTTLED = "throttled"
+TRANSIENT = "transient"
+FATAL = "fatal"
+
+RETRYABLE_STATUS_CODES = (408, 500, 502, 503, 504, 529)  # 529: Anthropic overloaded
+# Exception class names and error codes of transient failures, across the SDKs
+TRANSIENT_ERRORS = (
+    "APIConnectionError",  # Anthropic
+    "APITimeoutError",  # Anthropic
+    "InternalServerError",  # Anthropic, Google
+    "ServiceRequestError",  # Azure
+    "ServiceResponseError",  # Azure
+    "ServiceUnavailable",  # Google
+    "DeadlineExceeded",  # Google
+    "ConnectError",  # httpx
+    "ConnectTimeout",  # requests, httpx
+    "ReadTimeout",  # requests, httpx
+    "ConnectionError",  # requests, built-in
+    "TimeoutError",  # built-in
+    "InternalServerException",  # Bedrock
+    "ServiceUnavailableException",  # Bedrock
+    "ModelNotReadyException",  # Bedrock
+    "HTTPClientError",  # botocore: connection closed, timeouts, endpoint unreachable
+)
+
+
+def get_error_code(exc: Exception) -> str:
+    """
+    Get the provider error code of a botocore ClientError, if there is one.
+
+    Args:
+        exc (Exception): The exception raised by the SDK.
+
+    Returns:
+        str: The error code, or None.
+    """
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code")
+    return None
+
+
+def classify_error(exc: Exception, retryable_errors: tuple = ()) -> str:
+    """
+    Classify an exception as throttled, transient or fatal.
+
+    Throttled and transient errors are retried; fatal errors, such as invalid
+    requests, authentication failures and unparseable responses, are not.
+
+    Args:
+        exc (Exception): The exception raised by the SDK.
+        retryable_errors (tuple): The provider's additional transient exception class
+                                  names and error codes.
+
+    Returns:
+        str: THROTTLED, TRANSIENT or FATAL.
+    """
+    if rate_limiting.is_throttling_error(exc):
+        return THROTTLED
+
+    if rate_limiting.get_status_code(exc) in RETRYABLE_STATUS_CODES:
+        return TRANSIENT
+
+    transient_errors = TRANSIENT_ERRORS + tuple(retryable_errors)
+    if get_error_code(exc) in transient_errors:
+        return TRANSIENT
+    if any(cls.__name__ in transient_errors for cls in type(exc).__mro__):
+        return TRANSIENT
+
+    return FATAL
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, honoring Retry-After, for a capped number
+    of attempts.
+
+    The delay before retry n (starting at 0) is a random value between 0 and
+    min(max_delay, base_delay * 2 ** n), or the provider's Retry-After if longer.
+
+    Args:
+        max_attempts (int): The maximum number of attempts per image, including the
+                            first.
+        base_delay (float): The backoff delay of the first retry, in seconds.
+        max_delay (float): The maximum backoff delay, in seconds.
+        retryable_errors (tuple): The provider's additional transient exception class
+                                  names and error codes.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        base_delay: float = BASE_DELAY,
+        max_delay: float = MAX_DELAY,
+        retryable_errors: tuple = (),
+    ) -> None:
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retryable_errors = tuple(retryable_errors)
+
+    def classify(self, exc: Exception) -> str:
+        return classify_error(exc, self.retryable_errors)
+
+    def backoff(self, retry: int, retry_after: float = None) -> float:
+        """
+        Calculate the delay before a retry.
+
+        Args:
+            retry (int): The retry number, starting at 0.
+            retry_after (float, optional): The provider's Retry-After, in seconds.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**retry))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    async def call(self, invoke, rate_limiter=None, request_tokens: int = 0, label=""):
+        """
+        Call a coroutine function, retrying throttled and transient failures.
+
+        Args:
+            invoke (Callable): Coroutine function to call, without arguments.
+            rate_limiter (RateLimiter, optional): The provider's shared rate limiter,
+                                                  acquired before each attempt.
+            request_tokens (int): The estimated tokens consumed by each request.
+            label (str): The name used in log messages, e.g. the image filename.
+
+        Returns:
+            tuple: (result, None, attempts) on success, or (None, (category,
+                   exception), attempts) once the error is fatal or the attempts are
+                   exhausted.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            if rate_limiter is not None:
+                with instrumentation.stage("queue"):
+                    await rate_limiter.acquire(request_tokens)
+            try:
+                with instrumentation.stage("request"):
+                    result = await invoke()
+            except Exception as e:
+                category = self.classify(e)
+                retry_after = rate_limiting.get_retry_after(e)
+                if category == THROTTLED and rate_limiter is not None:
+                    rate_limiter.record_throttle(retry_after)
+                if category == FATAL or attempt == self.max_attempts:
+                    return None, (category, e), attempt
+
+                delay = self.backoff(attempt - 1, retry_after)
+                logging.warning(
+                    f"Attempt {attempt} for {label} failed ({category}: {e}). "
+                    f"Retrying in {delay:.2f} seconds"
+                )
+                with instrumentation.stage("backoff"):
+                    await asyncio.sleep(delay)
+                continue
+
+            if rate_limiter is not None:
+                rate_limiter.record_success()
+            return result, None, attempt
+
+
+def create_retry_policy(retryable_errors: tuple = ()) -> RetryPolicy:
+    """
+    Create the retry policy from environment variables.
+
+    IQA_MAX_ATTEMPTS sets the maximum number of attempts per image.
+
+    Args:
+        retryable_errors (tuple): The provider's additional transient exception class
+                                  names and error codes.
+
+    Returns:
+        RetryPolicy: The retry policy.
+    """
+    try:
+        max_attempts = int(os.environ.get("IQA_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS))
+    except ValueError:
+        logging.error("Invalid IQA_MAX_ATTEMPTS value. Using default.")
+        max_attempts = DEFAULT_MAX_ATTEMPTS
+
+    return RetryPolicy(max_attempts, retryable_errors=retryable_errors)
@@ -0,0 +1,266 @@
+"""
+# Title: Streaming model responses with early termination
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import asyncio
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import Counter
+
+import instrumentation
+import json_extractor
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+SSE_DATA_PREFIX = "data:"
+SSE_DONE = "[DONE]"
+
+# Stream outcomes: stopped as soon as the result object closed, or read to the end
+STREAM_STATS = Counter(stopped=0, completed=0)
+FIRST_TOKEN_TIMES = []
+STATS_LOCK = threading.Lock()
+
+
+def stream_enabled() -> bool:
+    """
+    Determine whether responses are streamed, from the IQA_STREAM environment variable.
+
+    Returns:
+        bool: True if IQA_STREAM is set to 1, true, yes or on.
+    """
+    return os.environ.get("IQA_STREAM", "").lower() in ("1", "true", "yes", "on")
+
+
+class StreamCollector:
+    """
+    Collects a streamed response and detects when the result object is complete.
+
+    Create the collector just before sending the request, so that the time to first
+    token includes the request.
+
+    Each chunk of text is fed into an incremental JSON scanner. Once the first
+    top-level object closes and validates as a {score, explanation} result, the
+    caller can stop reading and cancel the stream, rather than paying for the tokens
+    the model generates after the closing brace. The time to the first non-empty
+    chunk is recorded as the "ttft" timing of the current trace.
+    """
+
+    def __init__(self) -> None:
+        self.scanner = json_extractor.JsonObjectScanner()
+        self.chunks = []
+        self.base = 0  # offset of the text being scanned
+        self.t0 = time.perf_counter()
+        self.ttft = None
+        self.done = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Add the next chunk of the response.
+
+        Args:
+            chunk (str): The next chunk of text, or None.
+
+        Returns:
+            bool: True once a complete, valid result object has been read.
+        """
+        if not chunk or self.done:
+            return self.done
+
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.t0
+            instrumentation.record_time("ttft", self.ttft)
+
+        self.chunks.append(chunk)
+        while self.scanner.feed(chunk):
+            text = self.text
+            start = self.base + self.scanner.start
+            end = self.base + self.scanner.end
+            try:
+                value = json.loads(text[start:end])
+                if json_extractor.validate_result(value) is not None:
+                    self.done = True
+                    return True
+            except json.JSONDecodeError:
+                pass
+            # The first object was not the result (e.g. an example in prose), so scan
+            # the rest of the response for another
+            self.base = end
+            self.scanner = json_extractor.JsonObjectScanner()
+            chunk = text[end:]
+        return False
+
+    def finish(self) -> str:
+        """
+        Record the stream outcome.
+
+        Returns:
+            str: The collected response text.
+        """
+        with STATS_LOCK:
+            STREAM_STATS["stopped" if self.done else "completed"] += 1
+            if self.ttft is not None:
+                FIRST_TOKEN_TIMES.append(self.ttft)
+        return self.text.strip()
+
+
+async def iterate_in_thread(iterator):
+    """
+    Iterate a blocking iterator, e.g. a boto3 event stream, without blocking the event
+    loop; each item is read in a worker thread.
+
+    Args:
+        iterator (Iterator): The blocking iterator.
+
+    Yields:
+        The items of the iterator.
+    """
+    sentinel = object()
+    while True:
+        item = await asyncio.to_thread(next, iterator, sentinel)
+        if item is sentinel:
+            return
+        yield item
+
+
+async def sse_events(lines):
+    """
+    Parse the JSON data of server-sent events, until the [DONE] event.
+
+    Args:
+        lines (AsyncIterator): The lines of the response body.
+
+    Yields:
+        dict: The data of each event.
+    """
+    async for line in lines:
+        if not line or not line.startswith(SSE_DATA_PREFIX):
+            continue
+        data = line[len(SSE_DATA_PREFIX) :].strip()
+        if data == SSE_DONE:
+            return
+        yield json.loads(data)
+
+
+async def collect_chat_completion_stream(lines, collector: StreamCollector) -> str:
+    """
+    Collect a streamed OpenAI-compatible chat completion, stopping early once the
+    result object is complete.
+
+    Args:
+        lines (AsyncIterator): The lines of the server-sent event stream.
+        collector (StreamCollector): The collector, created before the request was
+                                     sent so the time to first token includes it.
+
+    Returns:
+        str: The response text.
+    """
+    async for event in sse_events(lines):
+        usage = event.get("usage")
+        if usage:
+            instrumentation.record_usage(
+                usage.get("prompt_tokens"), usage.get("completion_tokens")
+            )
+        choices = event.get("choices") or [{}]
+        delta = choices[0].get("delta") or {}
+        if collector.feed(delta.get("content")):
+            break
+    return collector.finish()
+
+
+async def collect_chat_completion_updates(updates, collector: StreamCollector) -> str:
+    """
+    Collect the streamed chat completion updates of an SDK client (Azure AI Inference
+    or Mistral), stopping early once the result object is complete. The stream is
+    closed either way, which drops the connection if it was not fully read.
+
+    Args:
+        updates (AsyncIterator): The SDK's streaming response.
+        collector (StreamCollector): The collector, created before the request was
+                                     sent so the time to first token includes it.
+
+    Returns:
+        str: The response text.
+    """
+    try:
+        async for update in updates:
+            update = getattr(update, "data", update)  # Mistral wraps each update
+            usage = getattr(update, "usage", None)
+            if usage:
+                instrumentation.record_usage(
+                    usage.prompt_tokens, usage.completion_tokens
+                )
+            content = update.choices[0].delta.content if update.choices else None
+            if isinstance(content, str) and collector.feed(content):
+                break
+    finally:
+        close = getattr(updates, "aclose", None) or updates.close
+        await close()
+    return collector.finish()
+
+
+async def collect_converse_stream(bedrock_runtime, **request) -> str:
+    """
+    Send a Bedrock ConverseStream request, stopping early once the result object is
+    complete. Text and tool-use input deltas are both collected. The token usage is
+    only reported at the end of the stream, so it is unknown when stopped early.
+
+    Args:
+        bedrock_runtime: The Bedrock Runtime client.
+        **request: The Converse request parameters.
+
+    Returns:
+        str: The response text, or the tool-use input JSON.
+    """
+    collector = StreamCollector()
+    # boto3 is synchronous, so send the request and read the events in worker threads
+    response = await asyncio.to_thread(bedrock_runtime.converse_stream, **request)
+    event_stream = response["stream"]
+    try:
+        async for event in iterate_in_thread(iter(event_stream)):
+            usage = event.get("metadata", {}).get("usage")
+            if usage:
+                instrumentation.record_usage(
+                    usage.get("inputTokens"), usage.get("outputTokens")
+                )
+            delta = event.get("contentBlockDelta", {}).get("delta", {})
+            chunk = delta.get("text") or delta.get("toolUse", {}).get("input")
+            if collector.feed(chunk):
+                break
+    finally:
+        # Closing the event stream drops the connection, ending the generation
+        event_stream.close()
+    return collector.finish()
+
+
+def log_stream_stats() -> None:
+    """Log how many streams stopped early, and the time to first token."""
+    total = sum(STREAM_STATS.values())
+    if not total:
+        return
+    message = (
+        f"Streaming: {STREAM_STATS['stopped']} of {total} responses stopped early "
+        f"once the result was complete"
+    )
+    if FIRST_TOKEN_TIMES:
+        times = sorted(FIRST_TOKEN_TIMES)
+        p90 = times[min(len(times) - 1, int(len(times) * 0.9))]
+        message += (
+            f", time to first token median {statistics.median(times):.2f}s, "
+            f"p90 {p90:.2f}s"
+        )
+    logging.info(message)
@@ -0,0 +1,137 @@
+"""
+# Title: Structured output settings and fallback for image quality assessments
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import logging
+
+import rate_limiter as rate_limiting
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+# JSON Schema of the result, usable in strict mode (all properties required, no
+# additional properties)
+RESULT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "score": {
+            "type": "integer",
+            "enum": [0, 1, 2],
+            "description": "The image quality score: 0 (poorest), 1 (average) or 2 (highest).",
+        },
+        "explanation": {
+            "type": "string",
+            "description": "A detailed justification for the score.",
+        },
+    },
+    "required": ["score", "explanation"],
+    "additionalProperties": False,
+}
+
+# Gemini accepts an OpenAPI subset without integer enums; the score range is checked
+# when the response is parsed
+GEMINI_RESULT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "score": {"type": "integer"},
+        "explanation": {"type": "string"},
+    },
+    "required": ["score", "explanation"],
+}
+
+# Tool the model is forced to call, for providers that constrain output through tool use
+TOOL_NAME = "record_image_quality"
+TOOL_DESCRIPTION = "Record the quality score and explanation for the image."
+
+# Request parameters named in the errors of providers that do not support them
+UNSUPPORTED_HINTS = (
+    "response_format",
+    "json_schema",
+    "json_object",
+    "response_schema",
+    "response_mime_type",
+    "tool_choice",
+    "toolchoice",
+    "toolconfig",
+    "tools",
+)
+
+
+def is_unsupported_error(exc: Exception) -> bool:
+    """
+    Determine whether an error means the model rejected a structured output setting.
+
+    Args:
+        exc (Exception): The exception raised by the SDK.
+
+    Returns:
+        bool: True for HTTP 400 or validation errors that name a structured output
+              request parameter.
+    """
+    status = rate_limiting.get_status_code(exc)
+    response = getattr(exc, "response", None)
+    validation = isinstance(response, dict) and (
+        response.get("Error", {}).get("Code") == "ValidationException"
+    )
+    if status not in (400, 422) and not validation:
+        return False
+
+    # requests and httpx errors only carry the error body on the response
+    message = f"{exc} {getattr(response, 'text', '')}".lower()
+    return any(hint in message for hint in UNSUPPORTED_HINTS)
+
+
+class OutputModes:
+    """
+    The structured output modes of a provider, in order of preference, with fallback.
+
+    Requests use the first mode until the model rejects it as unsupported, then fall
+    back to the next mode for the rest of the run. The last mode is usually the plain
+    prompt, relying on json_extractor to parse the response.
+
+    Args:
+        modes (list): The mode names, in order of preference.
+        label (str): The name used in log messages, e.g. the model ID.
+    """
+
+    def __init__(self, modes: list, label: str = "") -> None:
+        self.modes = list(modes)
+        self.index = 0
+        self.label = label
+
+    @property
+    def current(self) -> str:
+        return self.modes[self.index]
+
+    async def invoke(self, send):
+        """
+        Send a request in the current mode, falling back if the mode is unsupported.
+
+        Args:
+            send (Callable): Coroutine function that sends the request in a given mode.
+
+        Returns:
+            The result of `send`.
+        """
+        while True:
+            mode = self.current
+            try:
+                return await send(mode)
+            except Exception as e:
+                if not is_unsupported_error(e):
+                    raise
+                # Another request may have fallen back already; if so, just retry
+                if self.current == mode:
+                    if self.index == len(self.modes) - 1:
+                        raise
+                    self.index += 1
+                    logging.warning(
+                        f"{self.label} rejected structured output mode '{mode}' ({e}). "
+                        f"Falling back to '{self.current}'"
+                    )
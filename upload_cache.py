@@ -0,0 +1,165 @@
+"""
+# Title: Cache of uploaded file URIs for image quality assessments
+# Author: Gary A. Stafford
+# Date: 2026-10-17
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+# Set up logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+# Constants
+DEFAULT_CACHE_PATH = "cache/uploads.sqlite"
+DEFAULT_TTL_HOURS = 48  # Gemini File API files are deleted after 48 hours
+EXPIRY_MARGIN = 60 * 60  # stop reusing an upload an hour before it expires
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    service TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    name TEXT NOT NULL,
+    uri TEXT NOT NULL,
+    mime_type TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (service, sha256)
+);
+"""
+
+
+class UploadCache:
+    """
+    Persistent SQLite cache of uploaded file URIs, keyed by the file's content hash.
+
+    An upload is reused until shortly before the service deletes it, so the same
+    image is uploaded at most once per expiry window, across runs.
+
+    Args:
+        path (str): The path of the SQLite database file.
+        ttl_hours (float): How long the service keeps an uploaded file, in hours.
+    """
+
+    def __init__(
+        self, path: str = DEFAULT_CACHE_PATH, ttl_hours: float = DEFAULT_TTL_HOURS
+    ) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl_hours * 60 * 60
+        self.stats = Counter(hits=0, misses=0, writes=0)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM uploads WHERE expires_at < ?", (time.time(),)
+            )
+            self.connection.commit()
+
+    def get(self, service: str, sha256: str) -> dict:
+        """
+        Look up an upload that is still usable.
+
+        Args:
+            service (str): The service the file was uploaded to (e.g., 'gemini').
+            sha256 (str): The SHA-256 digest of the file content.
+
+        Returns:
+            dict: The upload with "name", "uri" and "mime_type" keys, or None if the
+                  file has not been uploaded or is about to expire.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT name, uri, mime_type FROM uploads "
+                "WHERE service = ? AND sha256 = ? AND expires_at > ?",
+                (service, sha256, time.time() + EXPIRY_MARGIN),
+            ).fetchone()
+            self.stats["hits" if row else "misses"] += 1
+
+        if row is None:
+            return None
+        return {"name": row[0], "uri": row[1], "mime_type": row[2]}
+
+    def put(
+        self,
+        service: str,
+        sha256: str,
+        name: str,
+        uri: str,
+        mime_type: str,
+        expires_at: float = None,
+    ) -> None:
+        """
+        Store an upload.
+
+        Args:
+            service (str): The service the file was uploaded to.
+            sha256 (str): The SHA-256 digest of the file content.
+            name (str): The service's resource name of the file.
+            uri (str): The file URI used to reference the file in requests.
+            mime_type (str): The MIME type of the file.
+            expires_at (float, optional): When the service deletes the file, as a Unix
+                                          timestamp. Defaults to now plus the TTL.
+        """
+        if expires_at is None:
+            expires_at = time.time() + self.ttl
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?)",
+                (service, sha256, name, uri, mime_type, expires_at),
+            )
+            self.connection.commit()
+            self.stats["writes"] += 1
+
+    def delete(self, service: str, sha256: str) -> None:
+        """
+        Forget an upload, e.g. after the service rejects its URI.
+
+        Args:
+            service (str): The service the file was uploaded to.
+            sha256 (str): The SHA-256 digest of the file content.
+        """
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM uploads WHERE service = ? AND sha256 = ?", (service, sha256)
+            )
+            self.connection.commit()
+
+    def log_stats(self) -> None:
+        """Log the cache hit and miss statistics."""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups if lookups else 0
+        logging.info(
+            f"Upload cache: {self.stats['hits']} hits, {self.stats['misses']} misses "
+            f"({hit_rate:.0%} hit rate), {self.stats['writes']} uploads"
+        )
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self.lock:
+            self.connection.close()
+
+
+def create_upload_cache() -> UploadCache:
+    """
+    Create the upload cache from environment variables.
+
+    IQA_UPLOAD_CACHE sets the database path, or disables the cache when set to "off".
+
+    Returns:
+        UploadCache: The upload cache, or None if it is disabled.
+    """
+    path = os.environ.get("IQA_UPLOAD_CACHE", DEFAULT_CACHE_PATH)
+    if path.lower() in ("off", "false", "0", "none"):
+        logging.info("Upload cache disabled")
+        return None
+
+    return UploadCache(path)
@@ -4,82 +4,167 @@
 # Date: 2024-10-14
 """
 
-import base64
 from collections import Counter
+import hashlib
 import io
 import json
 import logging
+import mmap
+import os
 
 from PIL import Image
 
+import image_cache as image_caching
+import instrumentation
+import json_extractor
+import payload_builder
+
 # Set up logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 
+# Constants
+IMAGE_QUALITY = 100
+# Resize in two steps: a fast integer reduction (JPEG draft decoding, or Image.reduce)
+# and a final LANCZOS pass that still shrinks the image at least this many times, which
+# is visually the same as a single LANCZOS pass over the full-resolution image
+REDUCING_GAP = 2.0
+
 
 def truncate(response: str) -> dict:
     """
-    Truncate and parse a JSON response string.
+    Extract and parse the JSON result from a model response.
 
-    This function modifies the input response string to ensure it starts and ends with
-    curly braces, then attempts to parse it as a JSON object. If the parsing fails,
-    it returns a dictionary with an error explanation and a score of -1.
+    The JSON object may be wrapped in prose or a code fence, contain braces within
+    its strings, or be cut off before its end (see json_extractor.extract_result).
+    It must match the {score, explanation} schema. The outcome is counted in the
+    parse statistics.
 
     Args:
-        response (str): The raw response string to be truncated and parsed.
+        response (str): The raw response string to be parsed.
 
     Returns:
         dict: The parsed JSON object as a dictionary. If parsing fails, returns a
                 dictionary with an error explanation and a score of -1.
     """
-    try:
-        if not response.startswith("{") and response.count("{") > 0:
-            delimiter = "{"
-            response = "{" + response.split(delimiter, 1)[1]
-            print(f"left_fix: {response}")
-        if not response.endswith("}") and response.count("}") > 0:
-            delimiter = "}"
-            response = response.split(delimiter, 1)[0] + "}"
-            print(f"right_fix: {response}")
-        print(f"final_raw: {response}")
-        result = json.loads(response)
-        logging.debug(f"Response (JSON): {json.dumps(result, indent=2)}")
-    except json.JSONDecodeError:
-        logging.error(f"Error parsing JSON. Raw response: {response}")
-        result = {}
-        result["explanation"] = "Error parsing JSON response."
-        result["score"] = -1
+    result, outcome = json_extractor.extract_result(response)
+    json_extractor.record_outcome(outcome)
+
+    if result is None:
+        logging.debug(f"Error parsing JSON. Raw response: {response}")
+        return {"explanation": "Error parsing JSON response.", "score": -1}
 
+    logging.debug(f"Response (JSON, {outcome}): {json.dumps(result, indent=2)}")
     return result
 
-def resize_image(img: Image, max_pixels: int) -> Image:
+
+def draft_image(img: Image, max_pixels: int) -> tuple:
+    """
+    Set up a JPEG image, before it is decoded, to be decoded at a reduced scale.
+
+    The JPEG decoder can scale by 1/2, 1/4 or 1/8 in the DCT domain, so the pixels a
+    resize would discard are never decoded or held in memory. The largest scale that
+    keeps the image REDUCING_GAP times larger than the target size is used.
+
+    Args:
+        img (Image): The image, opened but not yet loaded.
+        max_pixels (int): The maximum number of pixels for the largest dimension of the
+                          resized image.
+
+    Returns:
+        tuple: The region of the full image in the reduced image, to pass to
+               resize_image, or None if the image is not reduced (not a JPEG,
+               already loaded, or no resize is needed).
+    """
+    width, height = img.size
+    if max(width, height) <= max_pixels:
+        return None
+
+    scale_factor = max_pixels / max(width, height) * REDUCING_GAP
+    drafted = img.draft(
+        None, (max(1, int(width * scale_factor)), max(1, int(height * scale_factor)))
+    )
+    return None if drafted is None else drafted[1]
+
+def resize_image(img: Image, max_pixels: int, box: tuple = None) -> Image:
     """
     Resize an image to ensure its largest dimension does not exceed a specified maximum number of pixels.
 
+    A JPEG that has not been loaded yet is decoded at a reduced scale (see
+    draft_image), and large reductions are resampled in two steps (REDUCING_GAP).
+
     Args:
         img (Image): The input image to be resized.
         max_pixels (int): The maximum number of pixels for the largest dimension of the image.
+        box (tuple, optional): The region of the full image, as returned by
+                               draft_image if the image was already drafted.
 
     Returns:
         Image: The resized image, if resizing was necessary; otherwise, the original image.
     """
-    width, height = img.size
+    if box is None:
+        box = draft_image(img, max_pixels)
+    # Sized from the full image's region, so a reduced scale decode resizes to the same
+    # size as the full-resolution image would
+    width, height = img.size if box is None else (box[2] - box[0], box[3] - box[1])
     if max(width, height) > max_pixels:
         scale_factor = max_pixels / max(width, height)
         new_size = (int(width * scale_factor), int(height * scale_factor))
         logging.info(
-            f"Resizing image from {width}x{height} to {new_size[0]}x{new_size[1]}"
+            f"Resizing image from {img.size[0]}x{img.size[1]} to {new_size[0]}x{new_size[1]}"
         )
-        img = img.resize(new_size, Image.LANCZOS)
+        img = img.resize(new_size, Image.LANCZOS, box=box, reducing_gap=REDUCING_GAP)
 
     return img
 
+def close_resized(img: Image, image_resize: Image) -> None:
+    """
+    Close a resized image once it is encoded, freeing its pixels straight away rather
+    than when it is garbage collected. The source image is left open.
+
+    Args:
+        img (Image): The source image.
+        image_resize (Image): The image returned by resize_image.
+    """
+    if image_resize is not img:
+        image_resize.close()
+
+def original_image_path(img: Image, file_format: str) -> str:
+    """
+    Get the source file of an image that can be sent without re-encoding.
+
+    An image qualifies when it was opened from a file, has not been resized or
+    converted (those operations return a new image without a filename), and its
+    format already matches the requested format.
+
+    Args:
+        img (Image): The PIL Image to check.
+        file_format (str): The requested format (e.g., 'JPEG', 'PNG').
+
+    Returns:
+        str: The path of the source file, or None if the image must be re-encoded.
+    """
+    filename = getattr(img, "filename", None)
+    if not filename or img.format is None:
+        return None
+    formats = {"jpg": "jpeg"}
+    source_format = formats.get(img.format.lower(), img.format.lower())
+    target_format = formats.get(file_format.lower(), file_format.lower())
+    if source_format != target_format or os.path.getsize(filename) == 0:
+        return None
+
+    return filename
+
 def image_to_base64(img: Image, file_format: str) -> str:
     """
     Convert a PIL Image to a base64 encoded string.
 
+    If the image is unchanged from its source file and already in the requested
+    format, the original file is memory-mapped and encoded as-is, skipping the
+    decode and re-encode.
+
     Args:
         img (Image): The PIL Image to be converted.
         file_format (str): The format to save the image in (e.g., 'JPEG', 'PNG').
@@ -91,10 +176,17 @@ def image_to_base64(img: Image, file_format: str) -> str:
         ValueError: If the provided img is not an instance of PIL.Image.
     """
     if isinstance(img, Image.Image):
+        source_path = original_image_path(img, file_format)
+        if source_path is not None:
+            logging.debug("Encoding original image file without re-encoding")
+            with open(source_path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return payload_builder.encode_base64(mapped)
+
         logging.debug("Converting PIL Image to bytes")
         buffer = io.BytesIO()
-        img.save(buffer, format=file_format, quality=100)
-        return base64.b64encode(buffer.getvalue()).decode("utf-8")
+        img.save(buffer, format=file_format, quality=IMAGE_QUALITY)
+        return payload_builder.encode_base64(buffer.getbuffer())
     else:
         raise ValueError(f"Expected PIL Image. Got {type(img)}")
 
@@ -102,6 +194,9 @@ def image_to_bytes(img: Image, file_format: str) -> bytes:
     """
     Convert a PIL Image to bytes.
 
+    If the image is unchanged from its source file and already in the requested
+    format, the original file bytes are returned as-is, skipping the re-encode.
+
     Args:
         img (Image): The PIL Image to convert.
         file_format (str): The format to save the image in (e.g., 'JPEG', 'PNG').
@@ -113,13 +208,228 @@ def image_to_bytes(img: Image, file_format: str) -> bytes:
         ValueError: If the provided img is not an instance of PIL Image.
     """
     if isinstance(img, Image.Image):
+        source_path = original_image_path(img, file_format)
+        if source_path is not None:
+            logging.debug("Reading original image file without re-encoding")
+            with open(source_path, "rb") as f:
+                return f.read()
+
         logging.debug("Converting PIL Image to bytes")
         buffer = io.BytesIO()
-        img.save(buffer, format=file_format, quality=100)
+        img.save(buffer, format=file_format, quality=IMAGE_QUALITY)
         return buffer.getvalue()
     else:
         raise ValueError(f"Expected PIL Image. Got {type(img)}")
 
+def prepare_image(
+    image_path: str,
+    max_pixels: int = None,
+    image_cache: image_caching.ImageCache = None,
+    source_sha256: str = None,
+) -> tuple:
+    """
+    Load an image from disk, optionally resize it, and convert it to bytes.
+
+    Only the image header is read unless a resize is required, so images that
+    already fit are sent as the original file bytes without being decoded.
+    Resized payloads are stored in the image cache, if given, so each variant of
+    an image is only resized and encoded once across runs and models.
+
+    Args:
+        image_path (str): The path to the image file.
+        max_pixels (int, optional): The maximum number of pixels for the largest dimension
+                                    of the image. If None, the image is not resized.
+        image_cache (ImageCache, optional): The cache of preprocessed payloads.
+        source_sha256 (str, optional): The SHA-256 digest of the image file, if already
+                                       known. Calculated when needed for the cache.
+
+    Returns:
+        tuple: The image data in bytes and the file format ('jpeg' or 'png').
+    """
+    with instrumentation.stage("decode"):
+        image = Image.open(image_path)
+    with image:
+        file_format = "jpeg" if image.format.lower() in ["jpg", "jpeg"] else "png"
+        if max_pixels is None or max(image.size) <= max_pixels:
+            with instrumentation.stage("read"):
+                return image_to_bytes(image, file_format), file_format
+
+        cache_key = None
+        if image_cache is not None:
+            source_sha256 = source_sha256 or hash_file(image_path)
+            cache_key = image_caching.make_key(
+                source_sha256, max_pixels, file_format, IMAGE_QUALITY
+            )
+            image_bytes = image_cache.get(cache_key)
+            if image_bytes is not None:
+                logging.debug(f"Using cached {max_pixels} pixel variant of {image_path}")
+                return image_bytes, file_format
+
+        with instrumentation.stage("decode"):
+            box = draft_image(image, max_pixels)
+            image.load()
+        with instrumentation.stage("resize"):
+            image_resize = resize_image(image, max_pixels, box)
+        instrumentation.record_memory()
+        with instrumentation.stage("encode"):
+            image_bytes = image_to_bytes(image_resize, file_format)
+        close_resized(image, image_resize)
+
+    if cache_key is not None:
+        image_cache.put(cache_key, image_bytes)
+
+    return image_bytes, file_format
+
+def load_variants(
+    image_path: str, max_pixels_list: list, image_cache: image_caching.ImageCache = None
+) -> tuple:
+    """
+    Read an image and collect the payload variants that need no resizing.
+
+    The file is read and hashed once, and only its header is parsed. Sizes the image
+    already fits are the original file bytes, and resized variants are taken from
+    the image cache when present.
+
+    Args:
+        image_path (str): The path to the image file.
+        max_pixels_list (list): The maximum number of pixels for the largest dimension
+                                of each variant. None means not resized.
+        image_cache (ImageCache, optional): The cache of preprocessed payloads.
+
+    Returns:
+        tuple: A dict of the ready image bytes keyed by maximum size, the list of
+               maximum sizes still to resize, the file format ('jpeg' or 'png'), the
+               SHA-256 digest of the image file, and the file bytes.
+    """
+    with instrumentation.stage("read"):
+        with open(image_path, "rb") as f:
+            source_bytes = f.read()
+    source_sha256 = hashlib.sha256(source_bytes).hexdigest()
+
+    variants = {}
+    pending = []
+    with instrumentation.stage("decode"):
+        image = Image.open(io.BytesIO(source_bytes))
+    with image:
+        file_format = "jpeg" if image.format.lower() in ["jpg", "jpeg"] else "png"
+        for max_pixels in set(max_pixels_list):
+            if max_pixels is None or max(image.size) <= max_pixels:
+                variants[max_pixels] = source_bytes
+                continue
+
+            if image_cache is not None:
+                variants[max_pixels] = image_cache.get(
+                    image_caching.make_key(
+                        source_sha256, max_pixels, file_format, IMAGE_QUALITY
+                    )
+                )
+                if variants[max_pixels] is not None:
+                    continue
+            pending.append(max_pixels)
+
+    return variants, pending, file_format, source_sha256, source_bytes
+
+def resize_variants(source, max_pixels_list: list, file_format: str) -> dict:
+    """
+    Decode an image once, then resize and encode it to each maximum size.
+
+    A JPEG is decoded at the reduced scale that suits the largest size.
+
+    Args:
+        source (str or file): The path to the image file, or a file object.
+        max_pixels_list (list): The maximum number of pixels for the largest dimension
+                                of each variant, all smaller than the image.
+        file_format (str): The format to encode the variants in ('jpeg' or 'png').
+
+    Returns:
+        dict: The image bytes of each variant, keyed by maximum size.
+    """
+    variants = {}
+    with Image.open(source) as image:
+        with instrumentation.stage("decode"):
+            box = draft_image(image, max(max_pixels_list))
+            image.load()
+        for max_pixels in max_pixels_list:
+            with instrumentation.stage("resize", variant=max_pixels):
+                image_resize = resize_image(image, max_pixels, box)
+            instrumentation.record_memory()
+            with instrumentation.stage("encode", variant=max_pixels):
+                variants[max_pixels] = image_to_bytes(image_resize, file_format)
+            close_resized(image, image_resize)
+
+    return variants
+
+def store_variants(
+    image_cache: image_caching.ImageCache,
+    source_sha256: str,
+    file_format: str,
+    variants: dict,
+) -> None:
+    """
+    Store resized payload variants in the image cache.
+
+    Args:
+        image_cache (ImageCache): The cache of preprocessed payloads, or None.
+        source_sha256 (str): The SHA-256 digest of the image file.
+        file_format (str): The file format of the variants ('jpeg' or 'png').
+        variants (dict): The resized image bytes, keyed by maximum size.
+    """
+    if image_cache is None:
+        return
+    for max_pixels, image_bytes in variants.items():
+        image_cache.put(
+            image_caching.make_key(source_sha256, max_pixels, file_format, IMAGE_QUALITY),
+            image_bytes,
+        )
+
+def prepare_variants(
+    image_path: str, max_pixels_list: list, image_cache: image_caching.ImageCache = None
+) -> tuple:
+    """
+    Load an image from disk once and prepare a payload for each maximum size.
+
+    The file is read and hashed once, decoded at most once, and each distinct
+    maximum size is resized and encoded once, so providers that share a size
+    share the same payload. Sizes the image already fits are sent as the
+    original file bytes.
+
+    Args:
+        image_path (str): The path to the image file.
+        max_pixels_list (list): The maximum number of pixels for the largest dimension
+                                of each variant. None means not resized.
+        image_cache (ImageCache, optional): The cache of preprocessed payloads.
+
+    Returns:
+        tuple: A dict of image bytes keyed by maximum size, the file format
+               ('jpeg' or 'png'), and the SHA-256 digest of the image file.
+    """
+    variants, pending, file_format, source_sha256, source_bytes = load_variants(
+        image_path, max_pixels_list, image_cache
+    )
+    if pending:
+        resized = resize_variants(io.BytesIO(source_bytes), pending, file_format)
+        store_variants(image_cache, source_sha256, file_format, resized)
+        variants.update(resized)
+
+    return variants, file_format, source_sha256
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Calculate the SHA-256 digest of a file's contents.
+
+    Args:
+        path (str): The path to the file.
+        chunk_size (int): The number of bytes read at a time.
+
+    Returns:
+        str: The hexadecimal SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 def count_scores(scores: dict) -> Counter:
     """
     Count the occurrences of each score in the provided dictionary and return them sorted.